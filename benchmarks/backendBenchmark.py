@@ -0,0 +1,92 @@
+#!/usr/bin/python3.6
+
+"""
+.. module:: backendBenchmark
+    :platform: Windows, linux
+    :synopsis: compares the catalogue backends (mongoDB, SQLite) on the same synthetic dataset.
+
+.. moduleauthor:: Miguel Garcia <zeycus@gmail.com>
+
+Usage::
+
+    python benchmarks/backendBenchmark.py conn_mongo.json conn_sqlite.json --ndocs=100000
+
+For each config file, the collections ``bench_files`` and ``bench_volumes`` are created, exercised and dropped.
+The timings, in seconds, are printed as JSON.
+"""
+
+
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+
+from fsbackup.dbBackends import openDatabase, openShelve
+
+
+def syntheticDocs(nDocs, nVolumes=10, seed=0):
+    """Returns the list of pairs (filename, info) and (hash, volInfo) of a synthetic catalogue."""
+    rnd = random.Random(seed)
+    files = []
+    volumes = []
+    for n in range(nDocs):
+        sha = hashlib.sha256(str(n).encode()).hexdigest()
+        size = int(rnd.lognormvariate(10, 2))
+        files.append(("dir%03d/sub%03d/file%07d.dat" % (n % 997, n % 101, n), dict(hash=sha, size=size, timestamp=1.5e9 + n)))
+        volumes.append((sha, dict(volume="VOL%02d" % (n % nVolumes), size=size, storedsize=size)))
+    return files, volumes
+
+
+def timed(timings, label, func):
+    t0 = time.perf_counter()
+    result = func()
+    timings[label] = round(time.perf_counter() - t0, 4)
+    return result
+
+
+def benchmarkBackend(confFile, files, volumes, nLookups):
+    with open(confFile) as f:
+        dbConf = json.load(f)
+    db = openDatabase(dbConf, confFile)
+    timings = dict(backend=dbConf.get('backend', 'mongodb'))
+    for name, keyField in (('bench_files', 'filename'), ('bench_volumes', 'hash')):
+        db[name].delete_many({})
+        db[name].create_index([(keyField, 1)], unique=True)
+    db['bench_files'].create_index([('hash', 1)])
+    db['bench_volumes'].create_index([('volume', 1)])
+    fShelve = openShelve(db, 'bench_files', 'filename')
+    vShelve = openShelve(db, 'bench_volumes', 'hash')
+
+    def setItems():
+        for fn, info in files:
+            fShelve[fn] = info
+    timed(timings, 'setitem', setItems)
+    timed(timings, 'bulkInsert', lambda: vShelve.insert([dict(info, hash=sha) for sha, info in volumes]))
+    sample = random.Random(1).sample(files, min(nLookups, len(files)))
+    timed(timings, 'getitem', lambda: [fShelve[fn] for fn, _ in sample])
+    timed(timings, 'itemsScan', lambda: sum(1 for _ in fShelve.items()))
+    timed(timings, 'hashesSet', lambda: len(set(info['hash'] for _, info in fShelve.items())))
+    timed(timings, 'findVolume', lambda: sum(1 for _ in vShelve.find(dict(volume="VOL00"))))
+    timed(timings, 'replaceVolume', lambda: vShelve.replaceWhere(
+        dict(volume="VOL00"), (dict(info, hash=sha) for sha, info in volumes if info['volume'] == "VOL00")))
+    timed(timings, 'deleteMany', lambda: vShelve.delete_many(dict(volume="VOL01")))
+    for name in ('bench_files', 'bench_volumes', 'bench_volumes_staging'):
+        db[name].drop()
+    return timings
+
+
+def main(argList):
+    parser = argparse.ArgumentParser(description="Catalogue backends benchmark")
+    parser.add_argument('conffiles', nargs='+', help="config files of the backends to compare")
+    parser.add_argument('--ndocs', type=int, default=100000, help="number of files in the synthetic catalogue")
+    parser.add_argument('--nlookups', type=int, default=10000, help="number of keyed look-ups")
+    args = parser.parse_args(argList)
+    files, volumes = syntheticDocs(args.ndocs)
+    results = [dict(benchmarkBackend(confFile, files, volumes, args.nlookups), conffile=confFile) for confFile in args.conffiles]
+    print(json.dumps(dict(ndocs=args.ndocs, results=results), indent=2))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,216 @@
+#!/usr/bin/python3.6
+
+"""
+.. module:: fsbckBenchmark
+    :platform: Windows, linux
+    :synopsis: times every fsbck command path on a synthetic tree, reporting the results as JSON.
+
+.. moduleauthor:: Miguel Garcia <zeycus@gmail.com>
+
+Usage::
+
+    python benchmarks/fsbckBenchmark.py --workdir=/mnt/scratch/bench --nfiles=1000000 --output=bench_0.3.json
+
+A synthetic tree is created in the work dir (see :func:`createSyntheticTree <fsbackup.auxiliarForTests.createSyntheticTree>`),
+together with a volume folder and a config file using the SQLite backend. With ``--conftemplate`` another config file
+is used instead, for instance to benchmark a mongoDB database: its keys ``mountPoint``, ``paths`` and ``reportpref`` are
+overridden. **Its database is destroyed.**
+
+Each command runs in a fresh process, and for each of them the elapsed time, files/s, MB/s, peak RSS,
+number of database round trips and seconds spent in each phase are reported. Comparing the output of two
+releases shows regressions. Phases may overlap: for instance, with ``--fsbckargs=--writebehind`` the time in
+``dbWriteBehind`` runs in the background, while files are hashed or copied.
+
+The growth of the page cache during each command is reported too (Linux only): comparing with
+``--fsbckargs=--noiohints`` shows how much of it the I/O hints spare.
+"""
+
+
+import os
+import sys
+import json
+import time
+import shutil
+import random
+import platform
+import argparse
+import multiprocessing
+
+from fsbackup.auxiliarForTests import createSyntheticTree
+
+
+def _pageCacheKiB():
+    """Returns the size of the page cache in KiB, or None if unknown (only Linux is supported)."""
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('Cached:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def _childRun(argList, results):
+    """Runs a fsbck command in the current (child) process and reports its measures."""
+    from fsbackup.fsbckWrapper import fsbck_wrapper
+    commandCounter = []
+    try:
+        import pymongo.monitoring
+
+        class CommandCounter(pymongo.monitoring.CommandListener):
+            def started(self, event):
+                commandCounter.append(1)
+
+            def succeeded(self, event):
+                pass
+
+            def failed(self, event):
+                pass
+
+        pymongo.monitoring.register(CommandCounter())
+    except ImportError:
+        pass
+    cacheBefore = _pageCacheKiB()
+    t0 = time.perf_counter()
+    info = fsbck_wrapper(argList)
+    elapsed = time.perf_counter() - t0
+    cacheAfter = _pageCacheKiB()
+    pageCacheGrowthKiB = None if cacheBefore is None else cacheAfter - cacheBefore
+    db = info['db']
+    roundTrips = db.roundTrips if hasattr(db, 'roundTrips') else len(commandCounter)
+    try:
+        import resource
+        peakRssKiB = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # KiB in Linux
+    except ImportError:
+        peakRssKiB = None
+    phases = {phase: round(info['secs'], 4) for phase, info in info['metrics'].toDict()['phases'].items()}
+    results.put(dict(elapsed=elapsed, peakRssKiB=peakRssKiB, dbRoundTrips=roundTrips, phaseSecs=phases,
+                     pageCacheGrowthKiB=pageCacheGrowthKiB))
+
+
+def runCommand(argList):
+    """Runs a fsbck command in a fresh process. Returns its measures."""
+    ctx = multiprocessing.get_context('spawn')
+    results = ctx.Queue()
+    proc = ctx.Process(target=_childRun, args=(argList, results))
+    proc.start()
+    measures = results.get()
+    proc.join()
+    if proc.exitcode != 0:
+        raise RuntimeError("Command %s failed." % argList)
+    return measures
+
+
+def rates(measures, nFiles, nBytes):
+    """Completes the measures with files/s and MB/s, for the given amount of work."""
+    elapsed = max(measures['elapsed'], 1e-9)
+    measures.update(
+        elapsed=round(elapsed, 4),
+        files=nFiles,
+        bytes=nBytes,
+        filesPerSec=round(nFiles / elapsed, 1),
+        MBPerSec=round(nBytes / 2**20 / elapsed, 2),
+    )
+    return measures
+
+
+def main(argList):
+    parser = argparse.ArgumentParser(description="fsbck commands benchmark on a synthetic tree")
+    parser.add_argument('--workdir', required=True, help="folder where the tree, volume and checkout are created. It is emptied first.")
+    parser.add_argument('--conftemplate', help="config file to use instead of the default SQLite one. Its database is destroyed!")
+    parser.add_argument('--nfiles', type=int, default=10000, help="number of files in the tree")
+    parser.add_argument('--sizemedian', type=int, default=2**14, help="median file size, in bytes")
+    parser.add_argument('--sizesigma', type=float, default=1.5, help="sigma of the log-normal distribution of file sizes")
+    parser.add_argument('--sizemax', type=int, default=2**30, help="maximum file size, in bytes")
+    parser.add_argument('--dupratio', type=float, default=0.1, help="fraction of files that duplicate another's content")
+    parser.add_argument('--depth', type=int, default=4, help="maximum folder depth")
+    parser.add_argument('--fanout', type=int, default=10, help="subfolders per folder")
+    parser.add_argument('--seed', type=int, default=0, help="random seed, the same seed creates the same tree")
+    parser.add_argument('--fsbckargs', default="", help="extra arguments passed to every fsbck command, for instance to compare options")
+    parser.add_argument('--output', help="file where the JSON report is written. By default, stdout.")
+    args = parser.parse_args(argList)
+
+    workdir = os.path.abspath(args.workdir)
+    shutil.rmtree(workdir, ignore_errors=True)
+    treePath = os.path.join(workdir, 'tree')
+    volPath = os.path.join(workdir, 'volume')
+    checkoutPath = os.path.join(workdir, 'checkout')
+    os.makedirs(volPath)
+
+    t0 = time.perf_counter()
+    nUnique, nBytes = createSyntheticTree(
+        treePath, args.nfiles, sizeMedian=args.sizemedian, sizeSigma=args.sizesigma, sizeMax=args.sizemax,
+        duplicateRatio=args.dupratio, depth=args.depth, fanout=args.fanout, seed=args.seed)
+    treeCreation = time.perf_counter() - t0
+
+    if args.conftemplate:
+        with open(args.conftemplate) as f:
+            dbConf = json.load(f)
+    else:
+        dbConf = dict(backend='sqlite', sqlitefile=os.path.join(workdir, 'catalogue.sqlite'))
+    dbConf.update(mountPoint=workdir, paths=['tree'], reportpref=os.path.join(workdir, 'report_'))
+    confFile = os.path.join(workdir, 'conn_benchmark.json')
+    with open(confFile, 'w') as f:
+        json.dump(dbConf, f, indent=4)
+
+    common = ['-db=%s' % confFile, '--loglevel=CRITICAL'] + args.fsbckargs.split()
+    if os.name == 'nt':
+        from fsbackup.mountPathInDrive import MountPathInDrive
+        from fsbackup.diskTools import getAvailableLetter
+        letter = getAvailableLetter()
+        volArgs = ['--drive=%s' % letter, '--volumeid=benchmark']
+        mounted = MountPathInDrive(path=volPath, driveLetter=letter)
+    else:
+        volArgs = ['--drivemountpoint=%s' % volPath, '--volumeid=benchmark']
+        mounted = None
+
+    # The average size of distinct contents is used as an estimate for the work on the volume.
+    uniqueBytes = int(nBytes * nUnique / args.nfiles) if args.nfiles else 0
+    results = dict()
+    runCommand(['createdatabase', '--force'] + common)
+    results['refreshhashes_cold'] = rates(runCommand(['refreshhashes'] + common), args.nfiles, nBytes)
+    results['refreshhashes_warm'] = rates(runCommand(['refreshhashes'] + common), args.nfiles, 0)
+    if mounted is not None:
+        mounted.__enter__()
+    try:
+        results['updatevolume'] = rates(runCommand(['updatevolume'] + common + volArgs), nUnique, uniqueBytes)
+        results['backupstatus'] = rates(runCommand(['backupstatus'] + common), args.nfiles, 0)
+        results['snapshot'] = rates(runCommand(['snapshot'] + common), args.nfiles, 0)
+        results['backupstatus_snapshot'] = rates(runCommand(['backupstatus', '--fromsnapshot'] + common), args.nfiles, 0)
+        results['checkout'] = rates(runCommand(
+            ['checkout', '--sourcepath=tree', '--destpath=%s' % checkoutPath] + common + volArgs), args.nfiles, nBytes)
+        results['integritycheck'] = rates(runCommand(['integritycheck'] + common + volArgs), nUnique, 2 * uniqueBytes)
+        # Remove a tenth of the files, so that the volume has something to clean
+        rnd = random.Random(args.seed)
+        nDeleted = 0
+        for root, _, fns in os.walk(treePath):
+            for fn in fns:
+                if rnd.random() < 0.1:
+                    os.remove(os.path.join(root, fn))
+                    nDeleted += 1
+        results['refreshhashes_afterdelete'] = rates(runCommand(['refreshhashes'] + common), args.nfiles - nDeleted, 0)
+        results['cleanvolume'] = rates(runCommand(['cleanvolume'] + common + volArgs), nDeleted, 0)
+    finally:
+        if mounted is not None:
+            mounted.__exit__()
+
+    report = dict(
+        python=platform.python_version(),
+        platform=platform.platform(),
+        backend=dbConf.get('backend', 'mongodb'),
+        fsbckargs=args.fsbckargs,
+        tree=dict(nfiles=args.nfiles, nunique=nUnique, bytes=nBytes, sizemedian=args.sizemedian, sizesigma=args.sizesigma,
+                  sizemax=args.sizemax, dupratio=args.dupratio, depth=args.depth, fanout=args.fanout, seed=args.seed,
+                  creationSecs=round(treeCreation, 2)),
+        commands=results,
+    )
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
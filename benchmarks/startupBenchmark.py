@@ -0,0 +1,98 @@
+#!/usr/bin/python3.6
+
+"""
+.. module:: startupBenchmark
+    :platform: Windows, linux
+    :synopsis: times the start of fsbck for the commands that do not need the DDBB, failing over a budget.
+
+.. moduleauthor:: Miguel Garcia <zeycus@gmail.com>
+
+Usage::
+
+    python benchmarks/startupBenchmark.py --repeat=20 --budget=0.1
+
+``fsbck showvolumeid`` is called from udev hooks, so it must start fast. It is run ``--repeat`` times, each one
+in a fresh interpreter, and so is an empty Python script. The difference of their medians is the start-up
+overhead of fsbck. The config file points to an unreachable mongoDB server: the command must not need it.
+
+The results are printed as JSON. The exit code is 1 if the overhead is over ``--budget`` seconds, or if any of
+the heavy modules (the database drivers, numpy) was imported.
+
+The budget can only be met with Python 3.7 or later: in older versions, importing the package loads
+``FileDB`` and ``HashVolume`` right away (see ``fsbackup/__init__.py``), and with them numpy.
+"""
+
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import platform
+import statistics
+import subprocess
+
+
+HEAVY_MODULES = ('numpy', 'pymongo', 'bson', 'sqlite3', 'subprocess', 'ctypes')
+
+_CHILD_CODE = """
+import sys, json
+from fsbackup.fsbckWrapper import fsbck_wrapper
+fsbck_wrapper(sys.argv[1:])
+print(json.dumps(sorted(m for m in %r if m in sys.modules)))
+""" % (HEAVY_MODULES, )
+
+
+def timeRuns(argList, repeat):
+    """Runs a Python process ``repeat`` times. Returns the elapsed times, and the output of the last run."""
+    env = dict(os.environ)
+    packageRoot = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env['PYTHONPATH'] = os.pathsep.join([packageRoot] + ([env['PYTHONPATH']] if env.get('PYTHONPATH') else []))
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        output = subprocess.check_output([sys.executable] + argList, env=env)
+        times.append(time.perf_counter() - t0)
+    return times, output.decode('utf-8')
+
+
+def main(argList):
+    parser = argparse.ArgumentParser(description="fsbck start-up benchmark")
+    parser.add_argument('--repeat', type=int, default=10, help="number of runs of each process")
+    parser.add_argument('--budget', type=float, default=0.1, help="maximum start-up overhead of fsbck, in seconds")
+    args = parser.parse_args(argList)
+    if sys.version_info < (3, 7):
+        print("Warning: with Python older than 3.7 the package imports its main classes eagerly, the budget is not met.",
+              file=sys.stderr)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        dbConf = dict(connstr='mongodb://127.0.0.1:1/fsbckstartup', mountPoint=workdir, paths=[],
+                      reportpref=os.path.join(workdir, 'report_'))
+        confFile = os.path.join(workdir, 'conn_startup.json')
+        with open(confFile, 'w') as f:
+            json.dump(dbConf, f)
+        volArgs = ['--drive=Z'] if os.name == 'nt' else ['--drivemountpoint=%s' % workdir]
+        fsbckArgs = ['showvolumeid', '-db=%s' % confFile, '--volumeid=benchmark', '--loglevel=CRITICAL'] + volArgs
+        bareTimes, _ = timeRuns(['-c', 'pass'], args.repeat)
+        fsbckTimes, output = timeRuns(['-c', _CHILD_CODE] + fsbckArgs, args.repeat)
+
+    heavyLoaded = json.loads(output.strip().split('\n')[-1])
+    overhead = statistics.median(fsbckTimes) - statistics.median(bareTimes)
+    report = dict(
+        python=platform.python_version(),
+        platform=platform.platform(),
+        repeat=args.repeat,
+        pythonSecs=round(statistics.median(bareTimes), 4),
+        showvolumeidSecs=round(statistics.median(fsbckTimes), 4),
+        overheadSecs=round(overhead, 4),
+        budgetSecs=args.budget,
+        heavyModules=heavyLoaded,
+    )
+    print(json.dumps(report, indent=2))
+    if heavyLoaded or (overhead > args.budget):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,3 +1,25 @@
-from .fileDB import FileDB
-from .hashVolume import HashVolume
-from .fsbckWrapper import fsbck_wrapper
\ No newline at end of file
+import sys
+
+
+# The main classes are imported only when they are used: importing any module of the package, like
+# the command line wrapper, must not load the database drivers and numpy just in case.
+_lazyAttributes = dict(
+    FileDB='fsbackup.fileDB',
+    HashVolume='fsbackup.hashVolume',
+    fsbck_wrapper='fsbackup.fsbckWrapper',
+)
+
+
+def __getattr__(name):
+    if name in _lazyAttributes:
+        import importlib
+        return getattr(importlib.import_module(_lazyAttributes[name]), name)
+    raise AttributeError("module 'fsbackup' has no attribute '%s'" % name)
+
+
+# Module __getattr__ needs Python 3.7. In older versions they are imported right away, as they used to be, so
+# importing any module of the package loads numpy: fsbck starts as slow as it did.
+if sys.version_info < (3, 7):
+    from .fileDB import FileDB
+    from .hashVolume import HashVolume
+    from .fsbckWrapper import fsbck_wrapper
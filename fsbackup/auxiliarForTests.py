@@ -11,6 +11,8 @@
 
 
 import os
+import math
+import random
 import filecmp
 
 from fsbackup.fileTools import abspath2longabspath
@@ -36,6 +38,60 @@ def createTree(pathbase, nFiles):
             print("The last two digits of the number are '%02d'." % (n % 100), file=f)
 
 
+def createSyntheticTree(pathbase, nFiles, sizeMedian=2**14, sizeSigma=2.0, sizeMax=2**30,
+                        duplicateRatio=0.1, depth=4, fanout=10, seed=0):
+    """Creates a tree of files that resembles a real filesystem, for benchmarking.
+
+    :param pathbase: the location where the tree is created.
+    :type pathbase: str
+    :param nFiles: the number of files created
+    :type nFiles: int
+    :param sizeMedian: median file size in bytes. Sizes follow a log-normal distribution.
+    :type sizeMedian: int
+    :param sizeSigma: sigma of the log-normal distribution of sizes, the bigger the more spread.
+    :type sizeSigma: float
+    :param sizeMax: maximum file size in bytes.
+    :type sizeMax: int
+    :param duplicateRatio: fraction of files whose content is a copy of another file's.
+    :type duplicateRatio: float
+    :param depth: maximum depth of the folders that contain files.
+    :type depth: int
+    :param fanout: number of subfolders in each folder.
+    :type fanout: int
+    :param seed: seed for the random generator, the same seed creates the same tree.
+    :type seed: int
+    :rtype: a pair (nUnique, totalBytes), the number of distinct contents and the size of the tree.
+
+    The content of each file is a header that makes it unique, followed by random bytes.
+    """
+    rnd = random.Random(seed)
+    block = bytes(rnd.getrandbits(8) for _ in range(2**16))
+    contents = []  # (n, size) for each distinct content, so that duplicates can be rebuilt
+    totalBytes = 0
+    for n in range(nFiles):
+        fnDepth = rnd.randint(1, depth)
+        folders = ["d%d" % rnd.randrange(fanout) for _ in range(fnDepth - 1)]
+        fn_dest = os.path.join(pathbase, *folders, "f%07d.dat" % n)
+        if contents and (rnd.random() < duplicateRatio):
+            nContent, size = rnd.choice(contents)
+        else:
+            nContent = n
+            size = min(sizeMax, int(rnd.lognormvariate(math.log(sizeMedian), sizeSigma)))
+            contents.append((nContent, size))
+        os.makedirs(os.path.dirname(fn_dest), exist_ok=True)
+        with open(fn_dest, 'wb') as f:
+            header = b"content %d\n" % nContent
+            f.write(header[:size])
+            remaining = size - len(header)
+            offset = nContent % len(block)
+            while remaining > 0:
+                chunk = (block[offset:] + block[:offset])[:remaining]
+                f.write(chunk)
+                remaining -= len(chunk)
+        totalBytes += size
+    return len(contents), totalBytes
+
+
 def checkFiletreesIdentical(path1, path2):
     """Returns whether folders path1 and path2 are identical.
 
@@ -0,0 +1,322 @@
+#!/usr/bin/python3.6
+
+"""
+.. module:: backupStats
+    :platform: Windows, linux
+    :synopsis: module for class :class:`BackupStats <backupStats.BackupStats>`.
+
+.. moduleauthor:: Miguel Garcia <zeycus@gmail.com>
+
+The summary of the backup status is a handful of figures: the files not backed-up, and for each volume
+the files it backs-up and the objects that are no longer needed. Computing them requires going through
+the whole catalogue, so they are kept in the collection ``stats``, and updated as files and volume
+objects are added and removed. The summary is then available right away.
+
+The summary is a dict like this:
+
+.. code-block:: python
+
+    {
+        'missing': {'files': 12, 'size': 40960},
+        'volumes': {
+            '3EC0BECC': {'files': 1203, 'size': 2**30, 'deletableFiles': 3, 'deletableSize': 2**20,
+                         'objects': 1100, 'objectsSize': 2**30, 'storedSize': 2**29},
+        },
+    }
+
+where ``files`` and ``size`` count paths in the filesystem, and ``objects``, ``objectsSize`` and ``storedSize``
+count the distinct contents stored in the volume.
+"""
+
+
+import time
+from collections import defaultdict
+
+from fsbackup.fileTools import sizeof_fmt
+
+
+VOLUME_FIELDS = ('files', 'size', 'deletableFiles', 'deletableSize', 'objects', 'objectsSize', 'storedSize')
+
+
+def emptyVolumeStats():
+    return {field: 0 for field in VOLUME_FIELDS}
+
+
+def writeSummaryFile(filename, summary):
+    """Writes the summary of the backup status as a text file.
+
+    :param filename: the file to be created
+    :type filename: str
+    :param summary: the summary, see :mod:`backupStats <fsbackup.backupStats>`.
+    :type summary: dict
+    """
+    with open(filename, 'w') as f:
+        print("Missing files: %s (%s)\n" % (summary['missing']['files'], sizeof_fmt(summary['missing']['size'])), file=f)
+
+        for vol, volStats in sorted(summary['volumes'].items()):
+            print("Information volume '%s':" % vol, file=f)
+            print("\tBackup up %s files (%s)" % (volStats['files'], sizeof_fmt(volStats['size'])), file=f)
+            print("\tDeletable %s files (%s)" % (volStats['deletableFiles'], sizeof_fmt(volStats['deletableSize'])), file=f)
+            if volStats['storedSize'] is not None:
+                print("\tStored %s in %s of the volume" % (sizeof_fmt(volStats['objectsSize']), sizeof_fmt(volStats['storedSize'])), file=f)
+            print("", file=f)
+
+
+def summaryDifferences(cached, actual):
+    """Returns the differences between two summaries, as a list of human-readable messages.
+
+    :rtype: list of str
+    """
+    differences = []
+    for field in ('files', 'size'):
+        if cached['missing'][field] != actual['missing'][field]:
+            differences.append("Missing %s: %s cached, %s actual." % (field, cached['missing'][field], actual['missing'][field]))
+    for vol in sorted(set(cached['volumes']) | set(actual['volumes'])):
+        cachedVol = cached['volumes'].get(vol, emptyVolumeStats())
+        actualVol = actual['volumes'].get(vol, emptyVolumeStats())
+        for field in VOLUME_FIELDS:
+            if cachedVol[field] != actualVol[field]:
+                differences.append("Volume '%s', %s: %s cached, %s actual." % (vol, field, cachedVol[field], actualVol[field]))
+    return differences
+
+
+class BackupStats(object):
+    """Summary of the backup status, kept in the DDBB and updated incrementally.
+
+    :meth:`fileChanges` and :meth:`volumeChanges` just gather the changes in memory, for each hash.
+    They are applied with :meth:`flush`, once the command ends (or when too many are pending): then
+    the number of files for each hash, and the volumes that contain it, are read from the DDBB in
+    batches, and the summary is updated with the difference between the figures of those hashes
+    before and after the changes. So the changes must be written to the DDBB before :meth:`flush`.
+
+    Until a summary is stored with :meth:`store`, or after :meth:`invalidate`, the cached
+    summary is not valid, and changes are not tracked.
+
+    """
+    validKey = 'computed'
+    missingKey = 'missing'
+    volumePrefix = 'volume:'
+
+    def __init__(self, container, filesContainer, volContainer, batchSize=1000, maxPending=100000):
+        """Constructor.
+
+        :param container: the collection ``stats``, where the summary is kept.
+        :type container: MongoShelve or SqliteShelve
+        :param filesContainer: the files information in DDBB.
+        :type filesContainer: MongoShelve or SqliteShelve
+        :param volContainer: the volumes information in DDBB.
+        :type volContainer: MongoShelve or SqliteShelve
+        :param batchSize: number of hashes looked up at once.
+        :type batchSize: int
+        :param maxPending: number of changes gathered in memory, beyond which they are applied.
+        :type maxPending: int
+
+        """
+        self.container = container
+        self.filesContainer = filesContainer
+        self.volContainer = volContainer
+        self.batchSize = batchSize
+        self.maxPending = maxPending
+        self._clearPending()
+
+    def _clearPending(self):
+        self.pendingFiles = defaultdict(lambda: [0, 0])  # For each hash, the change in [number of files, bytes]
+        self.pendingObjects = dict()  # For each (volume, hash), the first change: (1, None) or (-1, (size, storedSize))
+
+    def isValid(self):
+        """Tells whether the cached summary can be trusted.
+
+        :rtype: bool
+        """
+        return self.validKey in self.container
+
+    def invalidate(self):
+        """Marks the cached summary as not valid, for instance after the volume information is rebuilt."""
+        self._clearPending()
+        if self.validKey in self.container:
+            del self.container[self.validKey]
+
+    def summary(self):
+        """Returns the cached summary, or None if it is not valid.
+
+        :rtype: dict
+        """
+        self.flush()
+        if not self.isValid():
+            return None
+        summary = dict(missing=dict(files=0, size=0), volumes=dict())
+        for key, doc in self.container.items():
+            if key == self.missingKey:
+                summary['missing'] = {field: doc[field] for field in ('files', 'size')}
+            elif key.startswith(self.volumePrefix) and doc['objects'] > 0:
+                summary['volumes'][key[len(self.volumePrefix):]] = {field: doc[field] for field in VOLUME_FIELDS}
+        return summary
+
+    def store(self, summary):
+        """Stores a summary computed from scratch, making the cached summary valid.
+
+        :param summary: the summary, see :mod:`backupStats <fsbackup.backupStats>`.
+        :type summary: dict
+        """
+        self.invalidate()  # Pending changes are already in the summary
+        for key in list(self.container):
+            if key.startswith(self.volumePrefix) and (key[len(self.volumePrefix):] not in summary['volumes']):
+                del self.container[key]
+        self.container[self.missingKey] = dict(summary['missing'])
+        for vol, volStats in summary['volumes'].items():
+            self.container[self.volumePrefix + vol] = dict(volStats)
+        self.container[self.validKey] = dict(time=time.time())
+
+    def recompute(self):
+        """Computes the summary from scratch. The files information is streamed, the volumes information is kept in memory.
+
+        :rtype: dict
+        """
+        volumesOf = defaultdict(dict)  # For each hash, {vol: size}
+        volumes = defaultdict(emptyVolumeStats)
+        for doc in self.volContainer.find({}, ['hash', 'volume', 'size', 'storedsize']):
+            volumesOf[doc['hash']][doc['volume']] = doc['size']
+            volStats = volumes[doc['volume']]
+            volStats['objects'] += 1
+            volStats['objectsSize'] += doc['size']
+            volStats['storedSize'] += doc.get('storedsize', doc['size'])
+        missing = dict(files=0, size=0)
+        hashesNeeded = set()
+        for doc in self.filesContainer.find({}, ['hash', 'size']):
+            hashesNeeded.add(doc['hash'])
+            if doc['hash'] in volumesOf:
+                for vol in volumesOf[doc['hash']]:
+                    volumes[vol]['files'] += 1
+                    volumes[vol]['size'] += doc['size']
+            else:
+                missing['files'] += 1
+                missing['size'] += doc['size']
+        for sha, vols in volumesOf.items():
+            if sha not in hashesNeeded:
+                for vol, size in vols.items():
+                    volumes[vol]['deletableFiles'] += 1
+                    volumes[vol]['deletableSize'] += size
+        return dict(missing=missing, volumes=dict(volumes))
+
+    def _batches(self, shas):
+        shas = sorted(shas)
+        for pos in range(0, len(shas), self.batchSize):
+            yield shas[pos:pos + self.batchSize]
+
+    def _refCounts(self, shas):
+        """Returns, for each hash, the pair [number of files, bytes] in the files information."""
+        refs = defaultdict(lambda: [0, 0])
+        for doc in self.filesContainer.find({'hash': {'$in': shas}}, ['hash', 'size']):
+            refs[doc['hash']][0] += 1
+            refs[doc['hash']][1] += doc['size']
+        return refs
+
+    def _volumesOf(self, shas):
+        """Returns, for each hash, the volumes that contain it as a dict {vol: (size, storedSize)}."""
+        volumesOf = defaultdict(dict)
+        for doc in self.volContainer.find({'hash': {'$in': shas}}, ['hash', 'volume', 'size', 'storedsize']):
+            volumesOf[doc['hash']][doc['volume']] = (doc['size'], doc.get('storedsize', doc['size']))
+        return volumesOf
+
+    def _load(self, vols):
+        """Returns the cached figures for the missing files and the given volumes."""
+        missing = self.container[self.missingKey] if self.missingKey in self.container else dict(files=0, size=0)
+        volumes = dict()
+        for vol in vols:
+            key = self.volumePrefix + vol
+            volumes[vol] = self.container[key] if key in self.container else emptyVolumeStats()
+        return missing, volumes
+
+    def _save(self, missing, volumes):
+        self.container[self.missingKey] = missing
+        for vol, volStats in volumes.items():
+            self.container[self.volumePrefix + vol] = volStats
+
+    def fileChanges(self, added, removed):
+        """Records that entries of the files information were added or removed. See :meth:`flush`.
+
+        A file whose content changed is both removed (with its former hash and size) and added.
+
+        :param added: pairs (hash, size) of the files added.
+        :type added: list
+        :param removed: pairs (hash, size) of the files removed.
+        :type removed: list
+        """
+        for sha, size in added:
+            self.pendingFiles[sha][0] += 1
+            self.pendingFiles[sha][1] += size
+        for sha, size in removed:
+            self.pendingFiles[sha][0] -= 1
+            self.pendingFiles[sha][1] -= size
+        self._flushIfTooMany()
+
+    def volumeChanges(self, volId, added, removed):
+        """Records that objects were added to a volume, or removed from it. See :meth:`flush`.
+
+        :param volId: the volume
+        :type volId: str
+        :param added: triplets (hash, size, storedSize) of the objects added.
+        :type added: list
+        :param removed: triplets (hash, size, storedSize) of the objects removed.
+        :type removed: list
+        """
+        for sha, _, _ in added:
+            self.pendingObjects.setdefault((volId, sha), (1, None))
+        for sha, size, storedSize in removed:
+            self.pendingObjects.setdefault((volId, sha), (-1, (size, storedSize)))
+        self._flushIfTooMany()
+
+    def _flushIfTooMany(self):
+        if len(self.pendingFiles) + len(self.pendingObjects) >= self.maxPending:
+            self.flush()
+
+    def flush(self):
+        """Applies the changes recorded so far to the cached summary. They must be written to the DDBB already."""
+        pendingFiles, pendingObjects = self.pendingFiles, self.pendingObjects
+        self._clearPending()
+        if not (pendingFiles or pendingObjects) or not self.isValid():
+            return
+        firstChanges = defaultdict(dict)  # For each hash, {vol: first change}
+        for (vol, sha), change in pendingObjects.items():
+            firstChanges[sha][vol] = change
+        for batch in self._batches(set(pendingFiles) | set(firstChanges)):
+            refs = self._refCounts(batch)
+            volumesOf = self._volumesOf(batch)
+            missingDelta = dict(files=0, size=0)
+            volumesDelta = defaultdict(emptyVolumeStats)
+            for sha in batch:
+                nbFiles, nbBytes = refs[sha] if sha in refs else (0, 0)
+                volsAfter = volumesOf.get(sha, dict())
+                volsBefore = dict(volsAfter)
+                for vol, (sign, sizes) in firstChanges.get(sha, dict()).items():
+                    if sign > 0:  # Added, so it was not there before
+                        volsBefore.pop(vol, None)
+                    else:
+                        volsBefore[vol] = sizes
+                filesChange, bytesChange = pendingFiles.get(sha, (0, 0))
+                self._addFigures(missingDelta, volumesDelta, nbFiles, nbBytes, volsAfter, 1)
+                self._addFigures(missingDelta, volumesDelta, nbFiles - filesChange, nbBytes - bytesChange, volsBefore, -1)
+            missing, volumes = self._load(volumesDelta)
+            for field in ('files', 'size'):
+                missing[field] += missingDelta[field]
+            for vol, volStats in volumes.items():
+                for field in VOLUME_FIELDS:
+                    volStats[field] += volumesDelta[vol][field]
+            self._save(missing, volumes)
+
+    @staticmethod
+    def _addFigures(missing, volumes, nbFiles, nbBytes, vols, sign):
+        """Adds (or subtracts, with sign -1) the figures of a hash, given its files and the volumes that contain it."""
+        if not vols:
+            missing['files'] += sign * nbFiles
+            missing['size'] += sign * nbBytes
+        for vol, (size, storedSize) in vols.items():
+            volStats = volumes[vol]
+            volStats['files'] += sign * nbFiles
+            volStats['size'] += sign * nbBytes
+            volStats['objects'] += sign
+            volStats['objectsSize'] += sign * size
+            volStats['storedSize'] += sign * storedSize
+            if nbFiles == 0:
+                volStats['deletableFiles'] += sign
+                volStats['deletableSize'] += sign * size
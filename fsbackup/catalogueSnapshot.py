@@ -0,0 +1,312 @@
+#!/usr/bin/python3.6
+
+"""
+.. module:: catalogueSnapshot
+    :platform: Windows, linux
+    :synopsis: module for the compact, memory-mappable snapshot of the catalogue.
+
+.. moduleauthor:: Miguel Garcia <zeycus@gmail.com>
+
+Reading the whole collections ``files`` and ``volumes`` as Python dicts takes minutes and several GB for catalogues
+with tens of millions of files. A snapshot is a single file with the same information as
+`numpy <https://pypi.org/project/numpy/>`_ arrays, that are memory-mapped when it is loaded:
+
+    * for each file, sorted by name: its hash (32 bytes), size and timestamp.
+    * the filenames, front-coded: in each block of :data:`BLOCK_SIZE` names, every name but the first is stored as
+      the length of the prefix it shares with the previous one, and the rest of it.
+    * for each volume object, sorted by hash: its hash, size, stored size and volume.
+
+Set operations on the hashes are then vectorized, see :class:`HashSet <fsbackup.hashSet.HashSet>`. The snapshot
+reflects the catalogue when it was taken: it is meant for read-only commands, and taken again with ``fsbck.py snapshot``.
+
+The file starts with :data:`MAGIC`, the length of a JSON header and the header itself, that describes the
+arrays. Each array starts at a multiple of 64 bytes.
+"""
+
+
+import os
+import json
+import time
+import struct
+from array import array
+
+import numpy
+
+from fsbackup.reportWriters import BackgroundWriter, createReportWriter
+from fsbackup.backupStats import writeSummaryFile, emptyVolumeStats
+from fsbackup.hashSet import HashSet, hashToBytes, bytesToHash, uniqueKeys
+
+
+MAGIC = b'FSBCKSNP'
+VERSION = 1
+BLOCK_SIZE = 16
+ALIGNMENT = 64
+MAX_PREFIX = 2 ** 16 - 1  # Prefix lengths are stored as uint16
+
+
+def writeSnapshot(filename, filesContainer, volContainer, blockSize=BLOCK_SIZE):
+    """Creates a snapshot of the catalogue. The file is replaced only when complete.
+
+    :param filename: the snapshot file
+    :type filename: str
+    :param filesContainer: the files information in DDBB.
+    :type filesContainer: MongoShelve or SqliteShelve
+    :param volContainer: the volumes information in DDBB.
+    :type volContainer: MongoShelve or SqliteShelve
+    :param blockSize: number of filenames in each front-coded block.
+    :type blockSize: int
+    :rtype: tuple
+
+    Returns the number of files and of volume objects in the snapshot.
+
+    """
+    # Files, streamed sorted by name
+    nameData = bytearray()
+    nameOffsets = array('Q', [0])
+    namePrefixes = array('H')
+    fileHashes = bytearray()
+    fileSizes = array('q')
+    fileTimes = array('d')
+    previous = b''
+    for pos, doc in enumerate(filesContainer.find({}, ['filename', 'hash', 'size', 'timestamp'], sort=[('filename', 1)])):
+        current = doc['filename'].encode('utf-8', 'surrogateescape')
+        prefix = 0 if pos % blockSize == 0 else min(len(os.path.commonprefix((previous, current))), MAX_PREFIX)
+        namePrefixes.append(prefix)
+        nameData += current[prefix:]
+        nameOffsets.append(len(nameData))
+        fileHashes += hashToBytes(doc['hash'])
+        fileSizes.append(doc['size'])
+        fileTimes.append(doc['timestamp'])
+        previous = current
+
+    # Volume objects, sorted by hash
+    volumes = dict()  # Index of each volume
+    volHashes = bytearray()
+    volSizes, volStoredSizes = array('q'), array('q')
+    volIndexes = array('i')
+    for doc in volContainer.find({}, ['hash', 'volume', 'size', 'storedsize']):
+        volHashes += hashToBytes(doc['hash'])
+        volSizes.append(doc['size'])
+        volStoredSizes.append(doc.get('storedsize', doc['size']))
+        volIndexes.append(volumes.setdefault(doc['volume'], len(volumes)))
+    volHashes = numpy.frombuffer(bytes(volHashes), dtype='S32')
+    order = numpy.argsort(volHashes, kind='stable')
+
+    arrays = [
+        ('fileHashes', numpy.frombuffer(bytes(fileHashes), dtype='S32')),
+        ('fileSizes', numpy.frombuffer(fileSizes, dtype=numpy.int64)),
+        ('fileTimes', numpy.frombuffer(fileTimes, dtype=numpy.float64)),
+        ('namePrefixes', numpy.frombuffer(namePrefixes, dtype=numpy.uint16)),
+        ('nameOffsets', numpy.frombuffer(nameOffsets, dtype=numpy.uint64)),
+        ('nameData', numpy.frombuffer(bytes(nameData), dtype=numpy.uint8)),
+        ('volHashes', volHashes[order]),
+        ('volSizes', numpy.frombuffer(volSizes, dtype=numpy.int64)[order]),
+        ('volStoredSizes', numpy.frombuffer(volStoredSizes, dtype=numpy.int64)[order]),
+        ('volIndexes', numpy.frombuffer(volIndexes, dtype=numpy.int32)[order]),
+    ]
+    header = dict(version=VERSION, created=time.time(), blockSize=blockSize,
+                  volumes=sorted(volumes, key=volumes.get), arrays=dict())
+    offset = 0
+    for name, values in arrays:
+        header['arrays'][name] = dict(dtype=values.dtype.str, length=len(values), offset=offset)
+        offset += -(-values.nbytes // ALIGNMENT) * ALIGNMENT
+    headerBytes = json.dumps(header).encode('utf-8')
+    dataStart = -(-(len(MAGIC) + 8 + len(headerBytes)) // ALIGNMENT) * ALIGNMENT
+
+    fnTemp = filename + '.tmp'
+    with open(fnTemp, 'wb') as f:
+        f.write(MAGIC + struct.pack('<Q', len(headerBytes)) + headerBytes)
+        for name, values in arrays:
+            f.seek(dataStart + header['arrays'][name]['offset'])
+            f.write(values.tobytes())
+        f.truncate(dataStart + offset)
+    os.replace(fnTemp, filename)
+    return len(arrays[0][1]), len(volHashes)
+
+
+class CatalogueSnapshot(object):
+    """A snapshot of the catalogue, loaded from the file created by :func:`writeSnapshot`.
+
+    Arrays are memory-mapped, so loading takes no time, and the pages are read as they are used.
+    Volume objects are unique by hash, as in the DDBB, so each file is backed-up in one volume at most.
+
+    """
+    def __init__(self, filename):
+        """Constructor.
+
+        :param filename: the snapshot file
+        :type filename: str
+
+        """
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError("File '%s' is not a catalogue snapshot." % filename)
+            headerLen, = struct.unpack('<Q', f.read(8))
+            header = json.loads(f.read(headerLen).decode('utf-8'))
+        if header['version'] != VERSION:
+            raise ValueError("Snapshot '%s' has version %s, %s expected." % (filename, header['version'], VERSION))
+        self.created = header['created']
+        self.blockSize = header['blockSize']
+        self.volumes = header['volumes']
+        dataStart = -(-(len(MAGIC) + 8 + headerLen) // ALIGNMENT) * ALIGNMENT
+        for name, spec in header['arrays'].items():
+            if spec['length'] == 0:  # Empty files cannot be mapped
+                values = numpy.zeros(0, dtype=spec['dtype'])
+            else:
+                values = numpy.memmap(filename, dtype=spec['dtype'], mode='r', offset=dataStart + spec['offset'],
+                                      shape=(spec['length'],))
+            setattr(self, name, values)
+
+    def __len__(self):
+        """Number of files in the snapshot."""
+        return len(self.fileHashes)
+
+    def _suffix(self, pos):
+        return self.nameData[int(self.nameOffsets[pos]):int(self.nameOffsets[pos + 1])].tobytes()
+
+    def filenameAt(self, pos):
+        """Returns the name of the file in a position, decoding its block up to it.
+
+        :param pos: position of the file, in the order of the names
+        :type pos: int
+        :rtype: str
+        """
+        current = b''
+        for i in range(pos - pos % self.blockSize, pos + 1):
+            current = current[:int(self.namePrefixes[i])] + self._suffix(i)
+        return current.decode('utf-8', 'surrogateescape')
+
+    def filenames(self, chunkSize=65536):
+        """Iterator over the filenames, sorted.
+
+        :param chunkSize: number of names decoded from each slice of the arrays.
+        :type chunkSize: int
+        """
+        current = b''
+        for start in range(0, len(self), chunkSize):
+            stop = min(start + chunkSize, len(self))
+            offsets = self.nameOffsets[start:stop + 1].tolist()
+            prefixes = self.namePrefixes[start:stop].tolist()
+            data = self.nameData[offsets[0]:offsets[-1]].tobytes()
+            base = offsets[0]
+            for i, prefix in enumerate(prefixes):
+                current = current[:prefix] + data[offsets[i] - base:offsets[i + 1] - base]
+                yield current.decode('utf-8', 'surrogateescape')
+
+    def __iter__(self):
+        """Iterator over pairs (filename, info), like :class:`FileDB <fsbackup.fileDB.FileDB>`."""
+        for pos, fn in enumerate(self.filenames()):
+            yield fn, dict(hash=bytesToHash(self.fileHashes[pos]), size=int(self.fileSizes[pos]),
+                           timestamp=float(self.fileTimes[pos]))
+
+    def hashesSet(self):
+        """Returns the set of hashes of the files.
+
+        :rtype: HashSet
+        """
+        return HashSet.fromKeys(uniqueKeys(self.fileHashes))
+
+    def calcDuplicates(self):
+        """Return dict hash: [files] for which there are at least two files."""
+        order = numpy.argsort(self.fileHashes, kind='stable')
+        sortedHashes = self.fileHashes[order]
+        repeated = numpy.zeros(len(order), dtype=bool)
+        if len(order) > 1:
+            same = sortedHashes[1:] == sortedHashes[:-1]
+            repeated[1:] |= same
+            repeated[:-1] |= same
+        wanted = numpy.sort(order[repeated])
+        dups = dict()
+        if len(wanted) == 0:
+            return dups
+        nextPos = 0
+        for pos, fn in enumerate(self.filenames()):
+            if pos == wanted[nextPos]:
+                dups.setdefault(bytesToHash(self.fileHashes[pos]), []).append(fn)
+                nextPos += 1
+                if nextPos == len(wanted):
+                    break
+        return dups
+
+    def volumeOfFiles(self):
+        """Returns, for each file, the index in ``volumes`` of the volume that backs it up, or -1.
+
+        :rtype: numpy.ndarray
+        """
+        if len(self.volHashes) == 0:
+            return numpy.full(len(self), -1, dtype=numpy.int32)
+        pos = HashSet.fromKeys(self.volHashes).positions(self.fileHashes)
+        return numpy.where(pos >= 0, self.volIndexes[pos], -1)
+
+    def summary(self, volOfFiles=None):
+        """Returns the summary of the backup status, see :mod:`backupStats <fsbackup.backupStats>`.
+
+        :param volOfFiles: the result of :meth:`volumeOfFiles`, if already computed.
+        :type volOfFiles: numpy.ndarray
+        :rtype: dict
+        """
+        if volOfFiles is None:
+            volOfFiles = self.volumeOfFiles()
+        nVols = len(self.volumes)
+
+        def sums(indexes, values, length):
+            total = numpy.zeros(length, dtype=numpy.int64)
+            numpy.add.at(total, indexes, values)
+            return total.tolist()
+
+        # For the files, position 0 is for those not backed-up, and the volumes are shifted
+        filesCount = numpy.bincount(volOfFiles + 1, minlength=nVols + 1).tolist()
+        filesSize = sums(volOfFiles + 1, self.fileSizes, nVols + 1)
+        deletable = ~self.hashesSet().contains(self.volHashes)
+        objectsCount = numpy.bincount(self.volIndexes, minlength=nVols).tolist()
+        objectsSize = sums(self.volIndexes, self.volSizes, nVols)
+        storedSize = sums(self.volIndexes, self.volStoredSizes, nVols)
+        deletableCount = numpy.bincount(self.volIndexes[deletable], minlength=nVols).tolist()
+        deletableSize = sums(self.volIndexes[deletable], self.volSizes[deletable], nVols)
+
+        summary = dict(missing=dict(files=filesCount[0], size=filesSize[0]), volumes=dict())
+        for index, vol in enumerate(self.volumes):
+            volStats = emptyVolumeStats()
+            volStats.update(files=filesCount[index + 1], size=filesSize[index + 1], deletableFiles=deletableCount[index],
+                            deletableSize=deletableSize[index], objects=objectsCount[index],
+                            objectsSize=objectsSize[index], storedSize=storedSize[index])
+            summary['volumes'][vol] = volStats
+        return summary
+
+    def reportStatusToFile(self, fnBase, reportFormat='txt', batchSize=10000):
+        """Creates the backup-status report files, like :meth:`FileDB.reportStatusToFile <fsbackup.fileDB.FileDB.reportStatusToFile>`.
+
+        :param fnBase: prefix of the report files to be created
+        :type fnBase: str
+        :param reportFormat: format of the lists of files, one of :data:`REPORT_FORMATS <fsbackup.reportWriters.REPORT_FORMATS>`.
+        :type reportFormat: str
+        :param batchSize: number of rows sent at once to each report file.
+        :type batchSize: int
+        :rtype: dict
+
+        Returns the summary of the backup status.
+        """
+        volOfFiles = self.volumeOfFiles()
+        writers = dict()
+        try:
+            writers[-1] = BackgroundWriter(createReportWriter(fnBase + "missing", reportFormat))
+            for index, vol in enumerate(self.volumes):
+                writers[index] = BackgroundWriter(createReportWriter(fnBase + "content_%s" % vol, reportFormat))
+            batches = {key: [] for key in writers}
+            sizes = self.fileSizes
+            for pos, fn in enumerate(self.filenames()):
+                key = int(volOfFiles[pos])
+                batches[key].append((fn, int(sizes[pos])))
+                if len(batches[key]) >= batchSize:
+                    writers[key].write(batches[key])
+                    batches[key] = []
+            for key, batch in batches.items():
+                if batch:
+                    writers[key].write(batch)
+        finally:
+            for writer in writers.values():
+                writer.close()
+        summary = self.summary(volOfFiles)
+        writeSummaryFile(fnBase + "summary.txt", summary)
+        return summary
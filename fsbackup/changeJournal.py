@@ -0,0 +1,106 @@
+#!/usr/bin/python3.6
+
+"""
+.. module:: changeJournal
+    :platform: Windows, linux
+    :synopsis: module for class :class:`ChangeJournal <changeJournal.ChangeJournal>`.
+
+.. moduleauthor:: Miguel Garcia <zeycus@gmail.com>
+"""
+
+
+import os
+import time
+
+
+class ChangeJournal(object):
+    """Local journal of the filesystem paths that changed, written by ``fsbck watch``.
+
+    The journal is a text file with a path (relative to the mountPoint) per line. The line ``*``
+    means that changes might have been missed, so that the next refresh must traverse the whole
+    filesystem. The watcher writes it when it starts, and when the kernel event queue overflows.
+
+    While the watcher runs, it touches a heartbeat file (the journal name followed by ``.alive``).
+    The journal is trusted only if the heartbeat is recent.
+
+    A refresh first claims the journal: it is renamed to the journal name followed by ``.processing``,
+    so that the watcher goes on recording in a new file. Only when the refresh is over, the claimed
+    paths are released. If the refresh is interrupted, they are claimed again by the next one.
+
+    """
+    fullScanMark = '*'
+
+    def __init__(self, filename):
+        """Constructor.
+
+        :param filename: location of the journal file.
+        :type filename: str
+
+        """
+        self.filename = filename
+        self.fnProcessing = filename + '.processing'
+        self.fnAlive = filename + '.alive'
+
+    def record(self, paths):
+        """Appends changed paths to the journal.
+
+        :param paths: paths relative to the mountPoint
+        :type paths: iterable of str
+
+        """
+        with open(self.filename, 'a', encoding='utf-8') as f:
+            for path in paths:
+                print(path, file=f)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def requestFullScan(self):
+        """Records that the whole filesystem must be traversed in the next refresh."""
+        self.record([self.fullScanMark])
+
+    def heartbeat(self):
+        """Tells that the watcher is alive."""
+        with open(self.fnAlive, 'a'):
+            pass
+        os.utime(self.fnAlive)
+
+    def isWatched(self, maxAge=120):
+        """Returns whether a watcher has recorded the changes recently.
+
+        :param maxAge: seconds since the last heartbeat to consider the watcher alive.
+        :type maxAge: float
+        :rtype: bool
+        """
+        try:
+            return time.time() - os.stat(self.fnAlive).st_mtime < maxAge
+        except FileNotFoundError:
+            return False
+
+    def claim(self):
+        """Takes the paths recorded so far.
+
+        Returns the pair (set of paths, flag telling if a full scan was requested).
+
+        :rtype: (set of str, bool)
+        """
+        if os.path.isfile(self.filename):
+            os.replace(self.filename, self.filename + '.claimed')  # Atomic: new changes go to a new journal
+            with open(self.filename + '.claimed', encoding='utf-8') as fIn, open(self.fnProcessing, 'a', encoding='utf-8') as fOut:
+                for line in fIn:
+                    fOut.write(line)
+            os.remove(self.filename + '.claimed')
+        paths = set()
+        if os.path.isfile(self.fnProcessing):
+            with open(self.fnProcessing, encoding='utf-8') as f:
+                for line in f:
+                    path = line.rstrip('\n')
+                    if path:
+                        paths.add(path)
+        fullScan = self.fullScanMark in paths
+        paths.discard(self.fullScanMark)
+        return paths, fullScan
+
+    def release(self):
+        """Forgets the claimed paths, once they are reflected in the DDBB."""
+        if os.path.isfile(self.fnProcessing):
+            os.remove(self.fnProcessing)
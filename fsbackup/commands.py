@@ -9,17 +9,38 @@
 """
 
 
-from fsbackup.miscTools import buildVolumeInfoList
-import pymongo
+import os
+import time
 
+from fsbackup.miscTools import buildVolumeInfoList, buildVolumeStoredSizes
+from fsbackup.restorePlanner import RestorePlanner, RestoreState
+from fsbackup.backupStats import writeSummaryFile, summaryDifferences
+from fsbackup.fileTools import sizeof_fmt
+from fsbackup.packStore import PackStore
+from fsbackup.volumeIdentity import VolumeIdentity
 
-def backupStatus(fDB, volDB, reportPref):
+# Modules that load numpy, the database drivers or ctypes are imported only by the commands that use them,
+# so that light commands start fast. Indexes are created with the same order values as pymongo's.
+ASCENDING = 1
+
+
+def backupStatus(fDB, volDB, reportPref, reportFormat='txt', stats=None, summaryOnly=False, logger=None, snapshotFile=None):
     """Generates the status report.
     
     Several files are created:
         * summary.txt: global summary.
         * missing.txt: list of files not yet backed-up.
         * content_<vol>.txt: the list of files backed-up in each volume.
+
+    With a reportFormat other than ``'txt'``, the lists of files have that extension instead.
+
+    With stats, the summary computed is stored as the cached one, and the differences with the previous
+    cached summary, that should be none, are logged as warnings. With summaryOnly, just summary.txt is
+    created, from the cached summary, so the catalogue is not traversed (unless there is no valid
+    cached summary yet).
+
+    With snapshotFile, the reports are built from that snapshot of the catalogue (see
+    :mod:`catalogueSnapshot <fsbackup.catalogueSnapshot>`) instead of the DDBB.
      
     :param fDB: the information regarding files
     :type fDB: FileDB
@@ -27,10 +48,51 @@ def backupStatus(fDB, volDB, reportPref):
     :type volDB: permanent-dict class
     :param reportPref: prefix that tells where to create reporting 
     :type reportPref: str
+    :param reportFormat: format of the lists of files, see :data:`REPORT_FORMATS <fsbackup.reportWriters.REPORT_FORMATS>`
+    :type reportFormat: str
+    :param stats: the cached summary of the backup status
+    :type stats: BackupStats
+    :param summaryOnly: whether only the summary is created
+    :type summaryOnly: bool
+    :param logger: for feedback
+    :param snapshotFile: the snapshot of the catalogue to be used, if any
+    :type snapshotFile: str
+    :rtype: dict
+
+    Returns the summary, see :mod:`backupStats <fsbackup.backupStats>`.
 
     """
+    if snapshotFile is not None:
+        from fsbackup.catalogueSnapshot import CatalogueSnapshot
+        snapshot = CatalogueSnapshot(snapshotFile)
+        if logger is not None:
+            logger.info("Using the snapshot of the catalogue taken at %s." % time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(snapshot.created)))
+        if summaryOnly:
+            summary = snapshot.summary()
+            writeSummaryFile(reportPref + "summary.txt", summary)
+            return summary
+        return snapshot.reportStatusToFile(reportPref, reportFormat=reportFormat)
+
+    if summaryOnly and (stats is not None):
+        summary = stats.summary()
+        if summary is None:
+            if logger is not None:
+                logger.info("No valid cached summary, computing it from scratch.")
+            summary = stats.recompute()
+            stats.store(summary)
+        writeSummaryFile(reportPref + "summary.txt", summary)
+        return summary
+
     volHashesInfo = buildVolumeInfoList(volDB)
-    fDB.reportStatusToFile(volHashesInfo, reportPref)
+    summary = fDB.reportStatusToFile(volHashesInfo, reportPref, volStoredSizes=buildVolumeStoredSizes(volDB),
+                                     reportFormat=reportFormat)
+    if stats is not None:
+        cached = stats.summary()
+        if (cached is not None) and (logger is not None):
+            for difference in summaryDifferences(cached, summary):
+                logger.warning("Cached summary of the backup status was wrong. %s" % difference)
+        stats.store(summary)
+    return summary
 
 
 def removeDuplicates(fDB, regexp):
@@ -63,25 +125,78 @@ def sievePath(fDB, path):
     return fDB.sievePath(path)
 
 
-def extractVolumeInfo(hashVol):
+def extractVolumeInfo(hashVol, fullScan=False):
     """Regenerates the DDBB information regarding the files contained in the present volume.
 
+    It is read from the volume manifest, unless it is incomplete or ``fullScan`` is set. In that
+    case the volume is traversed, and the manifest rebuilt. The volume gets an identity file, if it
+    had none, with the volume id used.
+
     :param hashVol: the information regarding volumes
     :type hashVol: HashVolume
+    :param fullScan: flag that forces the traversal of the volume files
+    :type fullScan: bool
 
     """
-    hashVol.recalculateContainer()
+    hashVol.recalculateContainer(fullScan=fullScan)
+    hashVol.updateIdentity()
 
-def showVolumeId(hashVol):
-    """Shows the volume id.
+def showVolumeId(logger, locationPath, volId=None):
+    """Shows the volume id, and returns it.
 
-    :param hashVol: the information regarding volumes
-    :type hashVol: HashVolume
+    It is read from the identity file of the volume, or obtained by the OS if there is none. Neither the DDBB
+    nor a :class:`HashVolume` is needed, so it is fast enough to be called from udev hooks.
+
+    :param logger: logger to be used
+    :type logger: logging.Logger
+    :param locationPath: root of the volume
+    :type locationPath: str
+    :param volId: the volume id, if forcing it is needed
+    :type volId: str
+    :rtype: str
 
     """
-    hashVol.logger.info("The volume has id '%s'." % hashVol.volId)
+    if volId is None:
+        volId = VolumeIdentity(locationPath).volId
+    if volId is None:
+        from fsbackup.diskTools import getVolumeId
+        volId = getVolumeId(locationPath)
+    logger.info("The volume has id '%s'." % volId)
+    return volId
+
+
+def initVolume(logger, locationPath, volId=None, forceFlag=False):
+    """Creates the identity file of a volume, and returns its volume id.
+
+    By default, the volume id is a random UUID for an empty volume. A volume that already holds objects keeps
+    the id obtained by the OS, the one it is recorded with in the DDBB.
+
+    :param logger: logger to be used
+    :type logger: logging.Logger
+    :param locationPath: root of the volume
+    :type locationPath: str
+    :param volId: the volume id, if forcing it is needed
+    :type volId: str
+    :param forceFlag: tells whether to replace the identity file, if it already exists
+    :type forceFlag: bool
+    :rtype: str
 
-def cleanVolume(fDB, hashVol):
+    """
+    identity = VolumeIdentity(locationPath)
+    if identity.exists() and not forceFlag:
+        raise Exception("The volume already has id '%s', aborted. Use --force to replace it "
+                        "(its information in the DDBB would be lost, unless the id is the same)." % identity.volId)
+    if volId is None:
+        holdsObjects = any(os.path.isdir(os.path.join(locationPath, d)) for d in "0123456789abcdef")
+        if holdsObjects or os.path.isdir(os.path.join(locationPath, PackStore.dirName)):
+            from fsbackup.diskTools import getVolumeId
+            volId = getVolumeId(locationPath)
+    identity.create(volId=volId)
+    logger.info("The volume has id '%s'." % identity.volId)
+    return identity.volId
+
+
+def cleanVolume(fDB, hashVol, dryRun=False):
     """Removes files from the volume that are not necessary anymore.
 
     Returns the number of deleted files.
@@ -90,16 +205,20 @@ def cleanVolume(fDB, hashVol):
     :type fDB: FileDB
     :param hashVol: the information regarding volumes
     :type hashVol: HashVolume
+    :param dryRun: if ``True``, nothing is removed, the number of files and bytes that would be is reported.
+    :type dryRun: bool
     :rtype: int
 
     """
     hashesNeeded = fDB.hashesSet()
-    nDeleted = hashVol.cleanOldHashes(totalHashesNeeded=hashesNeeded)
-    fDB.logger.debug("Deleted %s files from the volume." % nDeleted)
+    nDeleted = hashVol.cleanOldHashes(totalHashesNeeded=hashesNeeded, dryRun=dryRun)
+    if not dryRun:
+        fDB.logger.debug("Deleted %s files from the volume." % nDeleted)
+        hashVol.updateIdentity()
     return nDeleted
 
 
-def checkout(fDB, hashVol, sourcePath, destPath):
+def checkout(fDB, hashVol, sourcePath, destPath, filters=None, dryRun=False, linkMode='copy'):
     """Restores a given path from the volume, recursively.
 
     If sourcePath is the root of the backed-up filesystem, all the content would be restored.
@@ -112,9 +231,95 @@ def checkout(fDB, hashVol, sourcePath, destPath):
     :type sourcepath: str
     :param checkoutpath: path where we want the files to be created
     :type checkoutpath: str
+    :param filters: if provided, only files that match them are restored, see :meth:`FileDB.buildQuery <fsbackup.fileDB.FileDB.buildQuery>`
+    :type filters: dict
+    :param dryRun: if True, the files that would be restored are listed, but not restored.
+    :type dryRun: bool
+    :param linkMode: ``'copy'``, ``'hardlink'`` or ``'reflink'``: how files with the same content are created.
+    :type linkMode: str
+    :rtype: list of str
+
+    Returns the filenames restored, or that would be restored.
+
+    """
+    return fDB.checkout(hashVol, sourcePath, destPath, filters=filters, dryRun=dryRun, linkMode=linkMode)
+
+
+def restorePlan(fDB, volDB, sourcePath, destPath, filters=None, stateFile=None):
+    """Logs which volumes are needed to restore a given path, and in which order they should be inserted.
+
+    Files already restored into destPath, according to its restore state, are not considered.
+    If destPath is ``None``, the plan is for all the files.
+
+    :param fDB: the information regarding files
+    :type fDB: FileDB
+    :param volDB: the informating regarading volumes
+    :type volDB: permanent-dict class
+    :param sourcePath: path in the backed-up filesystem that needs to be restored
+    :type sourcePath: str
+    :param destPath: path where the files are restored
+    :type destPath: str
+    :param filters: if provided, only files that match them, see :meth:`FileDB.buildQuery <fsbackup.fileDB.FileDB.buildQuery>`
+    :type filters: dict
+    :param stateFile: file where the restore state is kept. By default, next to destPath, see :class:`RestoreState <fsbackup.restorePlanner.RestoreState>`.
+    :type stateFile: str
+    :rtype: pair (list of dict, list of str)
+
+    Returns the plan, see :meth:`RestorePlanner.plan <fsbackup.restorePlanner.RestorePlanner.plan>`.
+
+    """
+    state = None if destPath is None else RestoreState(destPath, filename=stateFile)
+    planner = RestorePlanner(fDB.logger, fDB, volDB, sourcePath=sourcePath, filters=filters, state=state)
+    steps, unavailable = planner.plan()
+    planner.logPlan(steps, unavailable)
+    return steps, unavailable
+
+
+def restore(fDB, hashVol, volDB, sourcePath, destPath, filters=None, dryRun=False, linkMode='copy', stateFile=None):
+    """Restores, from the volume inserted, the files of a given path that are still missing in destPath.
+
+    It is meant to be run once for each of the volumes given by :func:`restorePlan`. The files restored
+    are recorded in the restore state of destPath, so that the next volumes skip them. Afterwards,
+    the volumes that are still needed are logged. When none is, the restore state is removed.
+
+    :param fDB: the information regarding files
+    :type fDB: FileDB
+    :param hashVol: the information regarding volumes
+    :type hashVol: HashVolume
+    :param volDB: the informating regarading volumes
+    :type volDB: permanent-dict class
+    :param sourcePath: path in the backed-up filesystem that needs to be restored
+    :type sourcePath: str
+    :param destPath: path where the files are restored
+    :type destPath: str
+    :param filters: if provided, only files that match them, see :meth:`FileDB.buildQuery <fsbackup.fileDB.FileDB.buildQuery>`
+    :type filters: dict
+    :param dryRun: if True, the files that would be restored are listed, but not restored.
+    :type dryRun: bool
+    :param linkMode: ``'copy'``, ``'hardlink'`` or ``'reflink'``: how files with the same content are created.
+    :type linkMode: str
+    :param stateFile: file where the restore state is kept. By default, next to destPath, see :class:`RestoreState <fsbackup.restorePlanner.RestoreState>`.
+    :type stateFile: str
+    :rtype: pair (list of str, list of dict)
+
+    Returns the filenames restored (or that would be), and the volumes still needed.
 
     """
-    fDB.checkout(hashVol, sourcePath, destPath)
+    state = RestoreState(destPath, filename=stateFile)
+    try:
+        restored = fDB.checkout(hashVol, sourcePath, destPath, filters=filters, dryRun=dryRun, state=state,
+                                linkMode=linkMode)
+    finally:
+        state.close()
+    if dryRun:
+        fDB.logger.info("%d files would be restored from volume '%s'." % (len(restored), hashVol.volId))
+    else:
+        fDB.logger.info("%d files restored from volume '%s'." % (len(restored), hashVol.volId))
+    steps, _ = restorePlan(fDB, volDB, sourcePath, destPath, filters, stateFile=stateFile)
+    if (not steps) and (not dryRun):
+        fDB.logger.info("Restore complete, removing its state file '%s'." % state.filename)
+        state.remove()
+    return restored, steps
 
 
 def updateVolume(fDB, hashVol):
@@ -128,24 +333,113 @@ def updateVolume(fDB, hashVol):
     """
     logger = fDB.logger
     hashesNew, finished = hashVol.augmentWithFiles(fDB=fDB)
+    hashVol.updateIdentity()
     if finished:
         logger.info("With the present (%s) volume, the backup is complete." % hashVol.volId)
     else:
         logger.warning("Some files could *not* be backed-up due to lack of space in the volume. Update another volume.")
 
 
-def refreshFileInfo(fDB, forceRecalc):
+def refreshFileInfo(fDB, forceRecalc, journal=None, meta=None, fullScanDays=7, pruneDirs=False):
     """Updates the filename collection in the database, reflecting changes in the filesystem.
 
+    A full traversal of the filesystem takes place if the last one is older than ``fullScanDays`` days, or with
+    ``forceRecalc``. Otherwise, if a watcher keeps the change journal (see :func:`watch`), only the paths recorded
+    in it are checked. If not, and ``pruneDirs`` is set, folders whose timestamp did not change are skipped.
+
     :param fDB: the information regarding files
     :type fDB: FileDB
     :param forceRecalc: flag that tells if hashes & timestamps should be recalculated from the file always.
            If False (the default), recalculation happens always when the timestamp of the file is more recent than that
            in the database, or for new files. If True, we recalculate for every file.
     :type forceRecalc: bool
+    :param journal: journal with the paths that changed.
+    :type journal: ChangeJournal
+    :param meta: the collection ``meta``, where the time of the last full scan is kept.
+    :type meta: permanent-dict class
+    :param fullScanDays: maximum days between full scans.
+    :type fullScanDays: float
+    :param pruneDirs: flag that allows skipping unchanged folders, between full scans.
+    :type pruneDirs: bool
+
+    """
+    if meta is None:
+        return fDB.update(forceRecalc=forceRecalc)
+    paths, fullScanRequested = journal.claim() if journal is not None else (set(), False)
+    lastFullScan = meta['lastFullScan']['time'] if 'lastFullScan' in meta else None
+    if forceRecalc or fullScanRequested or (lastFullScan is None) or \
+            (time.time() - lastFullScan > fullScanDays * 86400):
+        isFullScan = True
+    elif (journal is not None) and journal.isWatched():
+        isFullScan = False
+        fDB.logger.debug("Checking only the %s paths in the change journal." % len(paths))
+        fDB.update(paths=sorted(paths))
+    elif pruneDirs:
+        isFullScan = False
+        fDB.update(pruneDirs=True)
+    else:
+        isFullScan = True
+    if isFullScan:
+        tStart = time.time()
+        fDB.update(forceRecalc=forceRecalc)
+        meta['lastFullScan'] = dict(time=tStart)
+    if journal is not None:
+        journal.release()
+
+
+def watch(fDB, journal, pollInterval=600, duration=None):
+    """Records in the journal the paths that change in the filesystem, until interrupted.
+
+    :param fDB: the information regarding files
+    :type fDB: FileDB
+    :param journal: journal where the paths that changed are recorded.
+    :type journal: ChangeJournal
+    :param pollInterval: seconds between traversals, if inotify is not available and polling is needed.
+    :type pollInterval: float
+    :param duration: if provided, seconds after which watching stops.
+    :type duration: float
+
+    """
+    from fsbackup.fsWatcher import createWatcher
+    logger = fDB.logger
+    watcher = createWatcher(logger, fDB.fsPathsComplete, pollInterval=pollInterval)
+    journal.requestFullScan()  # Changes before now were not watched
+    tEnd = None if duration is None else time.time() + duration
+    try:
+        while (tEnd is None) or (time.time() < tEnd):
+            journal.heartbeat()
+            changed, overflow = watcher.poll(timeout=5)
+            if overflow:
+                logger.warning("Filesystem events were lost, the next refresh will traverse the whole filesystem.")
+                journal.requestFullScan()
+            if changed:
+                journal.record(sorted(fDB.relativeFn(path) for path in changed))
+    except KeyboardInterrupt:
+        logger.info("Watching stopped.")
+    finally:
+        watcher.close()
+
+
+def snapshot(fDB, volDB, filename, logger):
+    """Writes a compact snapshot of the catalogue, for read-only commands (see :mod:`catalogueSnapshot <fsbackup.catalogueSnapshot>`).
+
+    :param fDB: the information regarding files
+    :type fDB: FileDB
+    :param volDB: the informating regarading volumes
+    :type volDB: permanent-dict class
+    :param filename: the snapshot file
+    :type filename: str
+    :param logger: for feedback
+    :rtype: tuple
+
+    Returns the number of files and of volume objects in the snapshot.
 
     """
-    return fDB.update(forceRecalc=forceRecalc)
+    from fsbackup.catalogueSnapshot import writeSnapshot
+    nFiles, nObjects = writeSnapshot(filename, fDB.container, volDB)
+    logger.info("Snapshot '%s' written with %s files and %s volume objects (%s)." % (
+        filename, nFiles, nObjects, sizeof_fmt(os.path.getsize(filename))))
+    return nFiles, nObjects
 
 
 def createDatabase(database, forceFlag, logger):
@@ -161,11 +455,23 @@ def createDatabase(database, forceFlag, logger):
         raise Exception("Found collections with content, aborted creation. Use --force to destroy current information.")
     logger.debug("Remove content of collection 'hashes', and create indexes.")
     database['files'].delete_many({})
-    database['files'].create_index([('filename', pymongo.ASCENDING)], unique=True)
-    database['files'].create_index([('hash', pymongo.ASCENDING)])
+    database['files'].create_index([('filename', ASCENDING)], unique=True)
+    database['files'].create_index([('hash', ASCENDING)])
+    database['files'].create_index([('timestamp', ASCENDING)])  # For filtered checkouts
+    database['files'].create_index([('size', ASCENDING)])
     logger.debug("Remove content of collection 'volumes', and create indexes.")
     database['volumes'].delete_many({})
-    database['volumes'].create_index([('hash', pymongo.ASCENDING)], unique=True)
+    database['volumes'].create_index([('hash', ASCENDING)], unique=True)
+    database['volumes'].create_index([('volume', ASCENDING)])  # For the queries of a single volume
+    logger.debug("Remove content of collection 'meta', and create indexes.")
+    database['meta'].delete_many({})
+    database['meta'].create_index([('key', ASCENDING)], unique=True)
+    logger.debug("Remove content of collection 'dirs', and create indexes.")
+    database['dirs'].delete_many({})
+    database['dirs'].create_index([('dirname', ASCENDING)], unique=True)
+    logger.debug("Remove content of collection 'stats', and create indexes.")
+    database['stats'].delete_many({})
+    database['stats'].create_index([('key', ASCENDING)], unique=True)
 
 
 def integrityCheck(fDB, hashVol):
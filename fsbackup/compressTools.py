@@ -0,0 +1,158 @@
+#!/usr/bin/python3.6
+
+"""
+.. module:: compressTools
+    :platform: Windows, linux
+    :synopsis: module for the compression of objects stored in volumes.
+
+.. moduleauthor:: Miguel Garcia <zeycus@gmail.com>
+
+Compression relies on the optional package `zstandard <https://pypi.org/project/zstandard/>`_.
+It is only required if compression is enabled, or if a volume with compressed objects is read.
+"""
+
+
+import os
+import math
+from collections import Counter
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# Extensions of files whose content is already compressed, there is nothing to gain with them.
+COMPRESSED_EXTENSIONS = frozenset((
+    '.7z', '.aac', '.avi', '.bz2', '.cab', '.docx', '.epub', '.flac', '.flv', '.gif', '.gz', '.heic',
+    '.jar', '.jpeg', '.jpg', '.lz', '.lz4', '.lzma', '.m4a', '.m4v', '.mkv', '.mov', '.mp3', '.mp4',
+    '.mpeg', '.mpg', '.ogg', '.opus', '.png', '.pptx', '.rar', '.tgz', '.webm', '.webp', '.wmv',
+    '.xlsx', '.xz', '.zip', '.zst',
+))
+
+
+def sampleEntropy(filename, sampleSize=2**16):
+    """Returns the Shannon entropy, in bits per byte, of the first bytes of a file.
+
+    Values close to 8 mean the content looks random, i.e. it is already compressed or encrypted.
+
+    :param filename: the file
+    :type filename: str
+    :param sampleSize: number of bytes read from the beginning of the file
+    :type sampleSize: int
+    :rtype: float
+
+    """
+    with open(filename, 'rb') as f:
+        sample = f.read(sampleSize)
+    if not sample:
+        return 0.0
+    n = len(sample)
+    return -sum(c / n * math.log2(c / n) for c in Counter(sample).values())
+
+
+def looksCompressible(filename, maxEntropy=7.5):
+    """Returns whether it is worth trying to compress a file.
+
+    Files with a well-known compressed extension are discarded right away, and for the rest
+    the entropy of a small sample of their content is checked.
+
+    :param filename: the file
+    :type filename: str
+    :param maxEntropy: files whose sample entropy (bits per byte) is above this are not compressed
+    :type maxEntropy: float
+    :rtype: bool
+
+    """
+    if os.path.splitext(filename)[1].lower() in COMPRESSED_EXTENSIONS:
+        return False
+    return sampleEntropy(filename) <= maxEntropy
+
+
+class ZstdCodec(object):
+    """Compression and decompression of volume objects with zstd.
+
+    Each object is a single zstd frame that records the original size in its header, so the
+    logical size of an object can be known without decompressing it.
+
+    """
+    suffix = '.zst'
+
+    def __init__(self, level=3, threads=0):
+        """Constructor.
+
+        :param level: zstd compression level
+        :type level: int
+        :param threads: number of threads used to compress each object. With 0 compression takes
+               place in the calling thread, with -1 as many threads as CPUs are used.
+        :type threads: int
+
+        """
+        if zstandard is None:
+            raise ImportError("Package 'zstandard' is required for zstd compression of volumes.")
+        self.level = level
+        self.threads = threads
+
+    def compressFile(self, src, dst, size):
+        """Creates dst, the compressed version of src. Returns the size of dst in bytes.
+
+        :param src: source file
+        :type src: str
+        :param dst: destiny file
+        :type dst: str
+        :param size: size in bytes of src
+        :type size: int
+        :rtype: int
+
+        """
+        cctx = zstandard.ZstdCompressor(level=self.level, threads=self.threads)
+        try:
+            with open(src, 'rb') as fIn, open(dst, 'wb') as fOut:
+                cctx.copy_stream(fIn, fOut, size=size)
+        except:
+            try:
+                os.remove(dst)
+            except:
+                pass
+            raise IOError("For some reason file '%s' could not be compressed to '%s'. Target was deleted." % (src, dst))
+        return os.stat(dst).st_size
+
+    def decompressFile(self, src, dst):
+        """Creates dst, the decompressed version of src. It is deleted if anything goes wrong.
+
+        :param src: source file
+        :type src: str
+        :param dst: destiny file
+        :type dst: str
+
+        """
+        try:
+            with open(dst, 'wb') as fOut:
+                for chunk in self.readChunks(src):
+                    fOut.write(chunk)
+        except:
+            try:
+                os.remove(dst)
+            except:
+                pass
+            raise IOError("For some reason file '%s' could not be decompressed to '%s'. Target was deleted." % (src, dst))
+
+    def readChunks(self, src, chunkSize=2**20):
+        """Iterator over the decompressed content of src, in chunks."""
+        dctx = zstandard.ZstdDecompressor()
+        with open(src, 'rb') as f:
+            yield from dctx.read_to_iter(f, read_size=chunkSize, write_size=chunkSize)
+
+    def contentSize(self, src):
+        """Returns the decompressed size of src, in bytes.
+
+        It is read from the frame header. Only if it is not there, the content is decompressed.
+
+        :rtype: int
+        """
+        with open(src, 'rb') as f:
+            header = f.read(18)  # Maximum size of a zstd frame header
+        size = zstandard.frame_content_size(header)
+        if size < 0:
+            size = sum(len(chunk) for chunk in self.readChunks(src))
+        return size
@@ -0,0 +1,73 @@
+#!/usr/bin/python3.6
+
+"""
+.. module:: dbBackends
+    :platform: Windows, linux
+    :synopsis: module with the functions that open the catalogue, in mongoDB or in a local SQLite file.
+
+.. moduleauthor:: Miguel Garcia <zeycus@gmail.com>
+
+The backend is chosen with the ``backend`` key in the config file: ``"mongodb"`` (the default) or ``"sqlite"``.
+Each backend module is imported only when it is used, so the SQLite backend does not require pymongo.
+"""
+
+
+import os
+import re
+
+
+def openDatabase(dbConf, confPath):
+    """Returns the database described in a config file.
+
+    :param dbConf: content of the config file
+    :type dbConf: dict
+    :param confPath: location of the config file. Relative paths in it that start with '.' are relative to it.
+    :type confPath: str
+    :rtype: pymongo.database.Database or SqliteDatabase
+
+    """
+    backend = dbConf.get('backend', 'mongodb')
+    if backend == 'mongodb':
+        import pymongo
+        client = pymongo.MongoClient(dbConf['connstr'])
+        databaseName = re.search(r"(\w*)$", dbConf['connstr']).group(1)  # The database name is the last part of the connection string.
+        return client[databaseName]
+    elif backend == 'sqlite':
+        from fsbackup.sqliteShelve import SqliteDatabase
+        return SqliteDatabase(confRelativePath(dbConf['sqlitefile'], confPath))
+    else:
+        raise ValueError("Backend '%s' not supported." % backend)
+
+
+def openShelve(database, collectionName, keyField):
+    """Returns a permanent dict for a collection of the database.
+
+    :param database: the database, as returned by :func:`openDatabase`
+    :param collectionName: name of the collection
+    :type collectionName: str
+    :param keyField: the name of the field used for look-up
+    :type keyField: str
+    :rtype: MongoShelve or SqliteShelve
+
+    """
+    from fsbackup.sqliteShelve import SqliteDatabase, SqliteShelve
+    if isinstance(database, SqliteDatabase):
+        return SqliteShelve(database[collectionName], keyField)
+    from fsbackup.mongoShelve import MongoShelve
+    return MongoShelve(database[collectionName], keyField)
+
+
+def dropDatabase(database):
+    """Deletes the database completely."""
+    from fsbackup.sqliteShelve import SqliteDatabase
+    if isinstance(database, SqliteDatabase):
+        database.drop()
+    else:
+        database.client.drop_database(database.name)
+
+
+def confRelativePath(path, confPath):
+    """Paths in config files that start with '.' are relative to the location of the file."""
+    if path[0] == '.':
+        return os.path.normpath(os.path.join(os.path.dirname(confPath), path))
+    return path
@@ -0,0 +1,221 @@
+#!/usr/bin/python3.6
+
+"""
+.. module:: devicePools
+    :platform: Windows, linux
+    :synopsis: module for classes :class:`DevicePools <devicePools.DevicePools>` and :class:`SequentialPool <devicePools.SequentialPool>`.
+
+.. moduleauthor:: Miguel Garcia <zeycus@gmail.com>
+
+Hashing, copying and verifying files are done in parallel, but each device gets its own number of
+workers: reading several files at once from a rotating drive just makes it seek, while SSDs and network
+shares only reach their throughput with several requests in flight. The filesystem paths usually span
+several devices, so the work for each of them proceeds independently.
+"""
+
+
+import os
+import queue
+import threading
+from collections import OrderedDict, deque
+
+
+class SequentialPool(object):
+    """Runs the work in the calling thread, one item after another.
+
+    It has the same interface as :class:`DevicePools`, and is used when no parallelism is wanted.
+
+    """
+    parallel = False
+
+    def run(self, func, items, deviceOf):
+        """Iterator over triplets (item, result, exception) of applying func to each item, in order.
+
+        :param func: the function applied to each item
+        :param items: the items
+        :type items: iterable
+        :param deviceOf: function that returns the device of an item. Not used.
+
+        """
+        for item in items:
+            try:
+                yield item, func(item), None
+            except Exception as exc:
+                yield item, None, exc
+
+    def semaphore(self, path):
+        """Returns a context manager that limits the concurrent use of the device of a path. Here, it does nothing."""
+        return _NoLimit()
+
+
+class _NoLimit(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+class DevicePools(object):
+    """Runs work in parallel, with a separate concurrency limit for each device.
+
+    The limit for a device depends on its kind: ``'hdd'``, ``'ssd'``, ``'network'`` (NFS, SMB, sshfs...) or
+    ``'unknown'``. In Linux the kind is told by ``/proc/self/mountinfo`` and ``/sys/dev/block``. The
+    limits per kind may be changed, and specific limits given for the device of a path, for instance:
+
+    .. code-block:: python
+
+        DevicePools(dict(hdd=1, ssd=8, network=4, unknown=2))
+        DevicePools({"ssd": 16, "/mnt/nas": 32})
+
+    """
+    parallel = True
+    defaultLimits = dict(hdd=1, ssd=8, network=4, unknown=2)
+    networkFsTypes = ('nfs', 'nfs4', 'cifs', 'smb3', 'smbfs', 'fuse.sshfs', '9p', 'ceph', 'glusterfs', 'afs')
+
+    def __init__(self, limits=None, mountInfo='/proc/self/mountinfo', sysBlock='/sys/dev/block'):
+        """Constructor.
+
+        :param limits: maximum concurrent workers. Keys are either device kinds, or paths whose device gets that limit.
+        :type limits: dict
+        :param mountInfo: location of the mountinfo file, in Linux.
+        :type mountInfo: str
+        :param sysBlock: location of the sysfs folder of block devices, in Linux.
+        :type sysBlock: str
+
+        """
+        self.mountInfo = mountInfo
+        self.sysBlock = sysBlock
+        self.limits = dict(self.defaultLimits)
+        self.deviceLimits = dict()
+        for key, limit in (limits or dict()).items():
+            if key in self.defaultLimits:
+                self.limits[key] = limit
+            else:
+                self.deviceLimits[self.deviceOf(key)] = limit
+        self.kinds = dict()
+        self.semaphores = dict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def deviceOf(path):
+        """Returns the device of a path, or -1 if it does not exist.
+
+        :rtype: int
+        """
+        try:
+            return os.stat(path).st_dev
+        except OSError:
+            return -1
+
+    def _mountFsType(self, dev):
+        """Returns the filesystem type of a device, according to mountinfo, or None."""
+        majMin = "%d:%d" % (os.major(dev), os.minor(dev))
+        try:
+            with open(self.mountInfo) as f:
+                for line in f:
+                    fields = line.split()
+                    if (len(fields) > 2) and (fields[2] == majMin) and (' - ' in line):
+                        return line.split(' - ', 1)[1].split()[0]
+        except OSError:
+            pass
+        return None
+
+    def _isRotational(self, dev):
+        """Returns whether a block device is rotational, or None if unknown."""
+        base = os.path.join(self.sysBlock, "%d:%d" % (os.major(dev), os.minor(dev)))
+        for fn in (os.path.join(base, 'queue', 'rotational'), os.path.join(base, '..', 'queue', 'rotational')):  # Disk, or partition
+            try:
+                with open(fn) as f:
+                    return f.read().strip() == '1'
+            except OSError:
+                continue
+        return None
+
+    def kindOf(self, dev):
+        """Returns the kind of a device: ``'hdd'``, ``'ssd'``, ``'network'`` or ``'unknown'``.
+
+        :rtype: str
+        """
+        if dev not in self.kinds:
+            kind = 'unknown'
+            if (dev >= 0) and hasattr(os, 'major'):
+                fsType = self._mountFsType(dev)
+                if (fsType is not None) and (fsType in self.networkFsTypes):
+                    kind = 'network'
+                else:
+                    rotational = self._isRotational(dev)
+                    if rotational is not None:
+                        kind = 'hdd' if rotational else 'ssd'
+            self.kinds[dev] = kind
+        return self.kinds[dev]
+
+    def limitFor(self, dev):
+        """Returns the maximum number of concurrent workers for a device.
+
+        :rtype: int
+        """
+        if dev in self.deviceLimits:
+            return self.deviceLimits[dev]
+        return self.limits[self.kindOf(dev)]
+
+    def semaphore(self, path):
+        """Returns a semaphore that limits the concurrent use of the device of a path, for instance a backup volume."""
+        dev = self.deviceOf(path)
+        with self.lock:
+            if dev not in self.semaphores:
+                self.semaphores[dev] = threading.BoundedSemaphore(self.limitFor(dev))
+            return self.semaphores[dev]
+
+    def run(self, func, items, deviceOf):
+        """Iterator over triplets (item, result, exception) of applying func to each item.
+
+        Items are grouped by device, and each device gets as many worker threads as its limit. Within
+        a device, items are started in the order given. Results are yielded as they are ready.
+
+        :param func: the function applied to each item
+        :param items: the items
+        :type items: iterable
+        :param deviceOf: function that returns the device of an item, for instance its ``st_dev``.
+
+        """
+        pending = OrderedDict()
+        for item in items:
+            pending.setdefault(deviceOf(item), deque()).append(item)
+        if not pending:
+            return
+        results = queue.Queue()
+        stop = threading.Event()
+
+        def worker(work):
+            try:
+                while not stop.is_set():
+                    try:
+                        item = work.popleft()  # Atomic: no lock needed
+                    except IndexError:
+                        return
+                    try:
+                        results.put((item, func(item), None))
+                    except Exception as exc:
+                        results.put((item, None, exc))
+            finally:
+                results.put(None)
+
+        threads = []
+        for dev, work in pending.items():
+            for _ in range(max(1, min(self.limitFor(dev), len(work)))):
+                threads.append(threading.Thread(target=worker, args=(work,), daemon=True))
+        for thread in threads:
+            thread.start()
+        nbRunning = len(threads)
+        try:
+            while nbRunning:
+                result = results.get()
+                if result is None:
+                    nbRunning -= 1
+                else:
+                    yield result
+        finally:
+            stop.set()  # If the consumer stops early, workers finish their current item and leave
+            for thread in threads:
+                thread.join()
@@ -12,10 +12,12 @@
 
 import os
 import re
-import subprocess
+from functools import lru_cache
+
 
 def genDrivesInfo():
     """Generator for drives information."""
+    import subprocess  # Only Windows needs it
     fields = dict(
         Index=int,
         Model=lambda x: x.replace(' ', '_'),
@@ -44,6 +46,7 @@ def genDrivesInfo():
 
 def genVolumesInfo():
     """Generator for volumes information."""
+    import subprocess  # Only Windows needs it
     fields = dict(
         DeviceID=lambda x: x,
         VolumeSerialNumber=lambda x: x.replace(' ', '_'),
@@ -85,25 +88,167 @@ def getAvailableLetter():
     raise Exception("No drive letter seems available")
 
 
-def getMountPointSerialNumberLinux(mp):
+def parseMountInfo(mountInfo='/proc/self/mountinfo'):
+    """Returns the mounts listed in a mountinfo file, as tuples (mountPoint, devNumber, source).
+
+    :param mountInfo: the mountinfo file
+    :type mountInfo: str
+    :rtype: list of tuple
+
+    ``devNumber`` is a string like ``'8:17'``, ``source`` is the device mounted, like ``'/dev/sdb1'``.
+    """
+    unescape = lambda x: re.sub(r'\\([0-7]{3})', lambda m: chr(int(m.group(1), 8)), x)  # Spaces are \040, and so on
+    mounts = []
+    with open(mountInfo) as f:
+        for line in f:
+            fields = line.split()
+            if ('-' in fields) and (len(fields) > 4):
+                sep = fields.index('-')  # Optional fields end with a '-', then come the fs type and the source
+                source = fields[sep + 2] if len(fields) > sep + 2 else ''
+                mounts.append((unescape(fields[4]), fields[2], unescape(source)))
+    return mounts
+
+
+def getMountPointDeviceLinux(mp, sysRoot='/sys', mountInfo='/proc/self/mountinfo'):
+    """Returns the number, like ``'8:17'``, of the block device where the given path is.
+
+    :param mp: mount point, or any path in it
+    :type mp: str
+    :param sysRoot: where sysfs is mounted
+    :type sysRoot: str
+    :param mountInfo: the mountinfo file
+    :type mountInfo: str
+    :rtype: str
+
+    It is the device of the path, if sysfs knows it. Filesystems like btrfs report an anonymous device
+    instead: then the device mounted is taken from mountinfo.
+    """
+    st = os.stat(mp)
+    devNumber = "%d:%d" % (os.major(st.st_dev), os.minor(st.st_dev))
+    if os.path.exists(os.path.join(sysRoot, 'dev', 'block', devNumber)):
+        return devNumber
+    path = os.path.realpath(mp)
+    best = None
+    for mountPoint, mountDevNumber, source in parseMountInfo(mountInfo):
+        if (path == mountPoint) or path.startswith(mountPoint.rstrip('/') + '/'):
+            if (best is None) or (len(mountPoint) >= len(best[0])):  # The last one wins, it hides the previous
+                best = (mountPoint, mountDevNumber, source)
+    if (best is None) or not best[2].startswith('/dev/'):
+        raise OSError("No block device found for '%s'." % mp)
+    devFile = os.path.join(sysRoot, 'class', 'block', os.path.basename(best[2]), 'dev')
+    try:
+        with open(devFile) as f:
+            return f.read().strip()
+    except OSError:
+        raise OSError("No block device found for '%s' (mounted from '%s')." % (mp, best[2]))
+
+
+def _readSerial(filename):
+    """Returns the content of a serial number file in sysfs, or None if it does not exist or is empty."""
+    try:
+        with open(filename, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return None
+    if os.path.basename(filename) == 'vpd_pg80':  # SCSI Unit Serial Number page: 4 bytes header, then the serial
+        data = data[4:4 + data[3]] if len(data) > 4 else b''
+    serial = re.sub(r'\s+', '_', data.decode('ascii', errors='replace').strip('\x00 \t\n'))
+    return serial or None
+
+
+def _serialFromDiskId(diskPath, devRoot):
+    """Returns the serial number of a disk from its links in /dev/disk/by-id, or None if there are none.
+
+    They are named after the bus, the model and the serial number, like ``ata-ST1000DM003_Z1D2ABCD``
+    or ``usb-WD_My_Passport_0820_575836314141-0:0``.
+    """
+    byIdPath = os.path.join(devRoot, 'disk', 'by-id')
+    try:
+        names = sorted(os.listdir(byIdPath))
+    except OSError:
+        return None
+    for name in names:
+        match = re.match(r"^(ata|usb|nvme|scsi|virtio|mmc|ieee1394)-(.*)_([^_]+?)(-\d+:\d+)?$", name)
+        if match and (os.path.realpath(os.path.join(byIdPath, name)) == diskPath):
+            return match.group(3)
+    return None
+
+
+@lru_cache(maxsize=None)
+def getBlockDeviceSerialLinux(devNumber, sysRoot='/sys', devRoot='/dev'):
+    """Returns the serial number of the disk of the block device with the given number.
+
+    :param devNumber: number of the device, like ``'8:17'``. If it is a partition, that of its disk is returned.
+    :type devNumber: str
+    :param sysRoot: where sysfs is mounted
+    :type sysRoot: str
+    :param devRoot: where devtmpfs is mounted
+    :type devRoot: str
+    :rtype: str
+
+    The serial number is looked for, in this order, in the disk itself (virtio), in the first device above it that
+    has one, stopping at the USB device (USB, NVMe), in its SCSI Unit Serial Number page (SATA, SAS), and in the
+    links in /dev/disk/by-id. Results are cached for each device.
+    """
+    diskPath = os.path.realpath(os.path.join(sysRoot, 'dev', 'block', devNumber))
+    if not os.path.isdir(diskPath):
+        raise OSError("Block device %s not found in %s." % (devNumber, sysRoot))
+    if os.path.exists(os.path.join(diskPath, 'partition')):
+        diskPath = os.path.dirname(diskPath)
+    serial = _readSerial(os.path.join(diskPath, 'serial'))
+    devicePath = os.path.realpath(os.path.join(diskPath, 'device'))
+    devicesRoot = os.path.realpath(os.path.join(sysRoot, 'devices'))
+    path = devicePath
+    while (serial is None) and path.startswith(devicesRoot + os.sep):
+        serial = _readSerial(os.path.join(path, 'serial'))
+        if os.path.exists(os.path.join(path, 'idVendor')):  # The USB device: above it are hubs and controllers
+            break
+        path = os.path.dirname(path)
+    if serial is None:
+        serial = _readSerial(os.path.join(devicePath, 'vpd_pg80'))
+    if serial is None:
+        serial = _serialFromDiskId(os.path.realpath(os.path.join(devRoot, os.path.basename(diskPath))), devRoot)
+    if serial is None:
+        raise OSError("No serial number found for block device %s." % devNumber)
+    return serial
+
+
+def getMountPointSerialNumberLinux(mp, sysRoot='/sys', devRoot='/dev', mountInfo='/proc/self/mountinfo'):
     """For the mount point of an external drive in Linux, returns the SerialNumber of the disk.
 
     :param mp: mount point
     :type mp: str
+    :param sysRoot: where sysfs is mounted
+    :type sysRoot: str
+    :param devRoot: where devtmpfs is mounted
+    :type devRoot: str
+    :param mountInfo: the mountinfo file
+    :type mountInfo: str
     :rtype: str
 
-    For instance, if /dev/sdb is mounted on /mnt/zeycus/E321-ABCD,
-    using getMountPointSerialNumberLinux('E321-ABCD') should return the disk's serialnumber.
+    For instance, if /dev/sdb1 is mounted on /mnt/zeycus/E321-ABCD,
+    using getMountPointSerialNumberLinux('/mnt/zeycus/E321-ABCD') should return the serialnumber of /dev/sdb,
+    the same as udev's ``ID_SERIAL_SHORT``. No external command is run.
+
+    """
+    devNumber = getMountPointDeviceLinux(mp, sysRoot=sysRoot, mountInfo=mountInfo)
+    return getBlockDeviceSerialLinux(devNumber, sysRoot=sysRoot, devRoot=devRoot)
+
 
+def getVolumeId(locationPath):
+    """Returns the id of the volume at the given location: the volume serial number in Windows, the disk
+    serial number in Linux.
+
+    :param locationPath: root of the volume, like 'H:\\' or a mount point
+    :type locationPath: str
+    :rtype: str
     """
-    lines = subprocess.check_output(["df" , "-h", mp]).decode("utf-8").split('\n')
-    if not (lines[0].startswith("Filesystem")):
-        raise OSError("Command df failed.")
-    device = re.search("^(.*?)\s", lines[1]).group(1)
-    udev = subprocess.Popen(["udevadm", "info", "--query=all", "--name=%s" % device],  stdout=subprocess.PIPE)
-    lines = subprocess.check_output(["grep", "ID_SERIAL_SHORT"], stdin=udev.stdout).decode("utf-8").split('\n')
-    udev.wait()
-    return re.search("ID_SERIAL_SHORT=(\w*)$", lines[0]).group(1)
+    if os.name == 'nt':
+        return getVolumeInfo(locationPath[0])['VolumeSerialNumber']
+    elif os.name == 'posix':
+        return getMountPointSerialNumberLinux(locationPath)
+    else:
+        raise OSError("OS '%s' not supported." % os.name)
 
 
 if __name__ == "__main__":
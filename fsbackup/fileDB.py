@@ -10,11 +10,21 @@
 
 import re
 import os
-import filecmp
+import time
 from collections import defaultdict
 
+import numpy
+
 from fsbackup.shaTools import sha256
-from fsbackup.fileTools import abspath2longabspath, sizeof_fmt
+from fsbackup.fileTools import abspath2longabspath, fileEqualsChunks
+from fsbackup.metrics import Metrics
+from fsbackup.progress import ProgressReporter
+from fsbackup.ioOrder import sortByPhysicalOrder
+from fsbackup.devicePools import SequentialPool
+from fsbackup.reportWriters import BackgroundWriter, createReportWriter
+from fsbackup.backupStats import writeSummaryFile
+from fsbackup.hashSet import HashSet
+from fsbackup.miscTools import iterBatches
 
 
 class FileDB(object):
@@ -24,7 +34,8 @@ class FileDB(object):
 
     """
 
-    def __init__(self, logger, mountPoint, fsPaths, container):
+    def __init__(self, logger, mountPoint, fsPaths, container, metrics=None, traceFiles=False, dirs=None, ioOrder='none',
+                 pools=None, stats=None):
         """Constructor.
 
         :param logger: internally stored logger, for feedback.
@@ -33,10 +44,32 @@ class FileDB(object):
         :param fsPaths: list of paths that we intend to be backed-up. Relative to the mountPoint.
         :type fsPaths: list of str
         :param container: database information regarding the files in the filesystem, its location, size and hash.
-        :type container: Mongo_shelve
+        :type container: MongoShelve or SqliteShelve
+        :param metrics: where timings and counters are gathered. If ``None``, a new one is created.
+        :type metrics: Metrics
+        :param traceFiles: if ``True``, a DEBUG line is logged for every file processed. Otherwise only the progress is shown.
+        :type traceFiles: bool
+        :param dirs: database information regarding the folders in the filesystem, their timestamp and content.
+               If provided, it is kept up-to-date while traversing the filesystem, and allows pruning unchanged folders.
+               It is loaded and written in every traversal, so it should be provided only when pruning is used.
+        :type dirs: MongoShelve or SqliteShelve
+        :param ioOrder: order in which files are read, one of :data:`IO_ORDERS <fsbackup.ioOrder.IO_ORDERS>`.
+               With ``'none'`` (the default) they are read by filename, otherwise by their physical location.
+        :type ioOrder: str
+        :param pools: runs hashing and verification in parallel, with a concurrency limit per device.
+               If ``None``, files are processed one after another.
+        :type pools: DevicePools or SequentialPool
+        :param stats: if provided, the cached summary of the backup status is updated as entries change.
+        :type stats: BackupStats
 
         """
         self.logger = logger
+        self.ioOrder = ioOrder
+        self.pools = SequentialPool() if pools is None else pools
+        self.stats = stats
+        self.metrics = Metrics() if metrics is None else metrics
+        self.dirs = dirs
+        self.traceFiles = traceFiles
         self.mountPoint = mountPoint
         self.fsPaths = []
         for path in fsPaths:  # Paths are gathered removing any '\\' at the end
@@ -58,27 +91,31 @@ class FileDB(object):
     def hashesSet(self):
         """Returns the set of hashes in the DDBB.
 
-        :rtype: set
+        :rtype: HashSet
         """
-        return set(info['hash'] for _, info in self)
+        return HashSet(doc['hash'] for doc in self.container.find({}, ['hash']))
 
     def calcDuplicates(self):
         """Return dict hash: [files] for which there are at least two files."""
+        return {sha: [fn for fn, _ in entries] for (sha, entries) in self._duplicateEntries().items()}
+
+    def _duplicateEntries(self):
+        """Return dict hash: [(file, info)] for which there are at least two files."""
         hashInfo = defaultdict(list)
         for fn, info in self:
-            hashInfo[info['hash']].append(fn)
-        return {sha: fns for (sha, fns) in hashInfo.items() if len(fns) >= 2}
+            hashInfo[info['hash']].append((fn, info))
+        return {sha: entries for (sha, entries) in hashInfo.items() if len(entries) >= 2}
 
     def removeDuplicates(self, regexp):
         """Removes entries matching the regexp"""
         nDeleted = 0
-        dups = self.calcDuplicates()
-        for fns in dups.values():
+        dups = self._duplicateEntries()
+        for entries in dups.values():
             # Check whether at least one file does match the regexp and another does not
-            deletables = [fn for fn in fns if re.search(regexp, fn) is not None]
-            if deletables and any(fn for fn in fns if re.search(regexp, fn) is None):
-                for fn in deletables:
-                    self.removeEntry(fn, delete=True)
+            deletables = [(fn, info) for fn, info in entries if re.search(regexp, fn) is not None]
+            if deletables and any(fn for fn, _ in entries if re.search(regexp, fn) is None):
+                for fn, info in deletables:
+                    self.removeEntry(fn, delete=True, info=info)
                     nDeleted += 1
         return nDeleted
 
@@ -98,21 +135,42 @@ class FileDB(object):
                     nDeleted += 1
         return nDeleted
 
-    def removeEntry(self, fn, delete=False):
+    def removeEntry(self, fn, delete=False, info=None):
         """Removes entry for a file.
         
         :param fn: file for which we want the entry deleted
         :type fn: str
         :param delete: flag that tells whether the file should be physically deleted
         :type delete: bool
+        :param info: the entry, if the caller has it. Otherwise it is read, for the summary of the backup status.
+        :type info: dict
         """
-        self.logger.debug('Removing %s' % fn)
-        del self.container[fn]
+        if (info is None) and (self.stats is not None):
+            info = self.container[fn]
+        self._deleteEntry(fn)
+        if self.stats is not None:
+            self.stats.fileChanges(added=[], removed=[(info['hash'], info['size'])])
         if delete:
             os.remove(self.compFn(fn))
 
+    def _deleteEntry(self, fn):
+        if self.traceFiles:
+            self.logger.debug('Removing %s' % fn)
+        with self.metrics.timer('dbWrite'):
+            del self.container[fn]
+
 
-    def update(self, forceRecalc=False):
+    def relativeFn(self, fnComp):
+        """Returns the filename relative to the mountPoint associated to an absolute filename."""
+        ## return os.path.relpath(fnComp, self.mountPoint)  # Relative paths do not work as expected for start like '\\ZEYCUS'.
+        # See https://stackoverflow.com/questions/47364579/unexpected-behaviour-of-pythons-os-path-relpath/47364931#47364931
+        # Instead, I do it manually:
+        fnAux = fnComp[len(self.mountPoint):]
+        while fnAux and fnAux[0] in ('\\', '/'):
+            fnAux = fnAux[1:]
+        return fnAux
+
+    def update(self, forceRecalc=False, paths=None, pruneDirs=False):
         """Updates the DDBB info traversing the actual filesystem.
 
         After execution, the DDBB reflects exactly the files currently in the filesystem,
@@ -122,63 +180,205 @@ class FileDB(object):
                If ``False`` (the default), recalculation happens only when the timestamp of the file is more recent than that
                in the database, or for new files. If ``True``, recalculation takes place for every file.
         :type forceRecalc: bool
+        :param paths: if provided, only these paths (relative to the mountPoint) are checked, instead of traversing
+               the whole filesystem. Each of them can be a file or a folder, existing or not. Used for incremental
+               updates with the paths recorded by a :class:`ChangeJournal <fsbackup.changeJournal.ChangeJournal>`.
+        :type paths: iterable of str
+        :param pruneDirs: if ``True``, folders whose timestamp did not change since the previous traversal are not
+               listed, and their files are not checked. It requires the ``dirs`` information.
+               Files modified in place do not change the timestamp of their folder, so they are missed
+               until a traversal without pruning.
+        :type pruneDirs: bool
 
         """
-        # Traverse actual files
-        self.logger.debug("Traversing the filesystem.")
-        currentFiles = []
-        for sourcePath in self.fsPathsComplete:
+        metrics = self.metrics
+        unchangedFiles = frozenset()
+        if paths is None:
+            # Traverse actual files
+            self.logger.debug("Traversing the filesystem%s." % (", pruning unchanged folders" if pruneDirs else ""))
+            if self.dirs is None:
+                with metrics.timer('scan'):
+                    currentFiles = set(self._walkFiles(self.fsPathsComplete))
+            else:
+                currentFiles, unchangedFiles = self._scanDirs(pruneDirs)
+            # Obtain files stored in the DDBB
+            with metrics.timer('dbRead'):
+                storedFiles = dict(self)  # We need to access so many times that it is convenient to build a dict with all the info
+        else:
+            self.logger.debug("Checking the paths that changed.")
+            currentFiles, storedFiles = self._changedFiles(paths)
+        metrics.count('filesScanned', len(currentFiles))
+        changes = ([], [])  # Entries added and removed, for the summary of the backup status
+        try:
+            self._reconcile(currentFiles, storedFiles, forceRecalc, unchangedFiles, changes)
+        finally:  # Also for the entries changed before an error
+            if self.stats is not None:
+                self.stats.fileChanges(*changes)
+
+    def _walkFiles(self, absPaths):
+        """Iterator over the relative filenames of the files under some absolute paths."""
+        for sourcePath in absPaths:
             for root, _, fns in os.walk(sourcePath):
                 for fn in fns:
-                    fnComp = os.path.join(root, fn)
-                    ## currentFiles.append(os.path.relpath(fnComp.self.mountPoint))  # Relative paths do not work as expected for start like '\\ZEYCUS'.
-                    # See https://stackoverflow.com/questions/47364579/unexpected-behaviour-of-pythons-os-path-relpath/47364931#47364931
-                    # Instead, I do it manually:
-                    fnAux = fnComp[len(self.mountPoint):]
-                    while fnAux[0] == '\\':
-                        fnAux = fnAux[1:]
-                    currentFiles.append(fnAux)
-        currentFiles = set(currentFiles)
-
-        # Obtain files stored in the DDBB
-        storedFiles = dict(self)  # We need to access so many times that it is convenient to build a dict with all the info
-        storedFilesSet = set(self.container)
+                    yield self.relativeFn(os.path.join(root, fn))
+
+    def _scanDirs(self, pruneDirs):
+        """Traverses the filesystem, keeping the ``dirs`` information up-to-date.
+
+        For each folder its content is stored, together with its timestamp in nanoseconds. Folders whose
+        timestamp did not change are not listed if ``pruneDirs`` is set: their stored content is used instead.
+        Folders modified in the last seconds get no timestamp, so that they are always listed next time:
+        otherwise a change in the same clock tick would go unnoticed.
+
+        Returns the pair (set of files, set of files in pruned folders), with filenames relative to the mountPoint.
+        """
+        metrics = self.metrics
+        with metrics.timer('dbRead'):
+            storedDirs = dict(self.dirs.items())
+        tScan = time.time()
+        currentFiles, unchangedFiles, visited = set(), set(), set()
+        pending = list(self.fsPathsComplete)
+        while pending:
+            absDir = pending.pop()
+            relDir = self.relativeFn(absDir)
+            with metrics.timer('scan'):
+                try:
+                    dirStat = os.stat(absDir)
+                except FileNotFoundError:
+                    continue
+            visited.add(relDir)
+            doc = storedDirs.get(relDir)
+            if pruneDirs and (doc is not None) and (doc['mtime'] == dirStat.st_mtime_ns):
+                files, subdirs = doc['files'], doc['subdirs']
+                unchangedFiles.update(os.path.join(relDir, fn) for fn in files)
+                metrics.count('dirsPruned')
+            else:
+                files, subdirs = [], []
+                with metrics.timer('scan'):
+                    for entry in os.scandir(absDir):
+                        # Like os.walk, symbolic links to folders are not followed
+                        if entry.is_dir() and not entry.is_symlink():
+                            subdirs.append(entry.name)
+                        elif entry.is_file():
+                            files.append(entry.name)
+                files.sort()
+                subdirs.sort()
+                mtime = dirStat.st_mtime_ns if (tScan - dirStat.st_mtime > 2) else None
+                if (doc is None) or (doc['mtime'] != mtime) or (doc['files'] != files) or (doc['subdirs'] != subdirs):
+                    with metrics.timer('dbWrite'):
+                        self.dirs[relDir] = dict(mtime=mtime, files=files, subdirs=subdirs)
+                metrics.count('dirsListed')
+            currentFiles.update(os.path.join(relDir, fn) for fn in files)
+            pending.extend(os.path.join(absDir, sub) for sub in subdirs)
+        with metrics.timer('dbWrite'):
+            for relDir in set(storedDirs) - visited:
+                del self.dirs[relDir]
+        return currentFiles, unchangedFiles
+
+    def _isBackedUp(self, fn):
+        """Tells whether a relative filename is under the paths that are backed-up."""
+        return any((fn == path) or fn.startswith(path + os.sep) for path in self.fsPaths)
+
+    def _changedFiles(self, paths):
+        """For the given relative paths, returns the files that exist and the DDBB info stored for them.
+
+        Returns a pair (set of files that exist, dict {filename: info} with the files known to the DDBB).
+        For folders, all the files under them are considered.
+        """
+        currentFiles = set()
+        storedFiles = dict()
+        for path in paths:
+            if not self._isBackedUp(path):
+                continue
+            fnComp = os.path.join(self.mountPoint, path)
+            with self.metrics.timer('scan'):
+                if os.path.isdir(fnComp):
+                    currentFiles.update(self._walkFiles([fnComp]))
+                elif os.path.isfile(fnComp):
+                    currentFiles.add(path)
+            with self.metrics.timer('dbRead'):
+                if path not in storedFiles:
+                    try:
+                        storedFiles[path] = self.container[path]
+                    except KeyError:
+                        pass
+                # The path might be a folder, or have been one before it was removed. A range of filenames
+                # is looked up, so that the index is used.
+                for doc in self.container.find(self.buildQuery(sourcePath=path)):
+                    storedFiles[doc['filename']] = {k: v for k, v in doc.items() if k not in ('_id', 'filename')}
+        return currentFiles, storedFiles
+
+    def _reconcile(self, currentFiles, storedFiles, forceRecalc, unchangedFiles=frozenset(), changes=None):
+        """Updates the DDBB so that the files in storedFiles are replaced by those in currentFiles.
+
+        Files in unchangedFiles are assumed not modified, unless forceRecalc is set. The pairs (hash, size)
+        of the entries added and removed are appended to the lists in changes, as they are written.
+        """
+        metrics = self.metrics
+        storedFilesSet = set(storedFiles)
+        added, removed = ([], []) if changes is None else changes
 
         # Delete DDBB entries for files that longer exist.
         self.logger.debug("Removing outdated entries.")
         for fn in sorted(storedFilesSet - currentFiles):
-            self.removeEntry(fn)
+            self._deleteEntry(fn)
+            removed.append((storedFiles[fn]['hash'], storedFiles[fn]['size']))
 
         # Update information for files with a newer timestamp, or a modified size.
         if forceRecalc:
             self.logger.debug("Updating entries with --force. All %s of them will be recalculated." % len(storedFilesSet & currentFiles))
         else:
             self.logger.debug("Updating entries. Files to check: %s." % len(storedFilesSet & currentFiles))
+        progress = ProgressReporter(self.logger, 'Refreshing', totalFiles=len(currentFiles))
+        toHash = []  # Pairs (fn, stat) of the files whose hash is needed
         for fn in sorted(storedFilesSet & currentFiles):
-            fnStat = os.stat(self.compFn(fn))
-            timestamp = fnStat.st_mtime
-            size = fnStat.st_size
-            if forceRecalc or (timestamp > storedFiles[fn]['timestamp']) or (size != storedFiles[fn]['size']):
-                self.logger.debug('Modifying %s' % fn)
-                self.container[fn] = dict(
-                   timestamp=timestamp,
-                   size=size,
-                   hash=sha256(self.compFn(fn)),
-                )
+            if (fn in unchangedFiles) and not forceRecalc:
+                progress.update()
+                continue
+            with metrics.timer('stat'):
+                fnStat = os.stat(self.compFn(fn))
+            if forceRecalc or (fnStat.st_mtime > storedFiles[fn]['timestamp']) or (fnStat.st_size != storedFiles[fn]['size']):
+                if self.traceFiles:
+                    self.logger.debug('Modifying %s' % fn)
+                toHash.append((fn, fnStat))
+            else:
+                progress.update()
 
         # Include information for new files
         self.logger.debug("Inserting new entries.")
         for fn in sorted(currentFiles - storedFilesSet):
-            self.logger.debug('Adding %s' % fn)
-            fnStat = os.stat(self.compFn(fn))
-            self.container[fn] = dict(
-                timestamp=fnStat.st_mtime,
-                size=fnStat.st_size,
-                hash=sha256(self.compFn(fn)),
-            )
+            if self.traceFiles:
+                self.logger.debug('Adding %s' % fn)
+            with metrics.timer('stat'):
+                toHash.append((fn, os.stat(self.compFn(fn))))
+
+        # Hashes are calculated in parallel for each device, in the physical order of the files if requested
+        toHash = sortByPhysicalOrder(toHash, lambda pair: self.compFn(pair[0]), self.ioOrder, statOf=lambda pair: pair[1])
+        hashed = self.pools.run(lambda pair: self._hashFile(pair[0], pair[1].st_size), toHash, lambda pair: pair[1].st_dev)
+        for (fn, fnStat), sha, exc in hashed:
+            if exc is not None:
+                raise exc
+            with metrics.timer('dbWrite'):
+                self.container[fn] = dict(
+                    timestamp=fnStat.st_mtime,
+                    size=fnStat.st_size,
+                    hash=sha,
+                )
+            if fn in storedFiles:
+                removed.append((storedFiles[fn]['hash'], storedFiles[fn]['size']))
+            added.append((sha, fnStat.st_size))
+            progress.update(nbytes=fnStat.st_size)
+        progress.close()
 
+    def _hashFile(self, fn, size):
+        """Returns the hash of a file. It may run in a worker thread."""
+        with self.metrics.timer('hash'):
+            sha = sha256(self.compFn(fn))
+        self.metrics.count('bytesHashed', size)
+        return sha
 
-    def checkout(self, vol, sourcePath, destPath):
+
+    def checkout(self, vol, sourcePath, destPath, filters=None, dryRun=False, state=None, linkMode='copy'):
         """Rebuilds the filesystem, or a subfolder, from the backup content.
 
         We just invoke the chekout method of the volume.
@@ -189,71 +389,160 @@ class FileDB(object):
         :type sourcePath: str
         :param destPath: location where you want the files created
         :type destPath: str
+        :param filters: if provided, only the files that match them are restored. Keys are the
+               keyword arguments of :meth:`buildQuery`.
+        :type filters: dict
+        :param dryRun: if True, the files that would be restored are just listed.
+        :type dryRun: bool
+        :param state: if provided, files already restored are skipped, and the rest recorded as they are restored.
+        :type state: RestoreState
+        :param linkMode: how files with the same content are created, see :meth:`HashVolume.checkout <fsbackup.hashVolume.HashVolume.checkout>`.
+        :type linkMode: str
         :rtype: list of str
 
         """
-        return vol.checkout(self, sourcePath, destPath)
+        return vol.checkout(self, sourcePath, destPath, filters=filters, dryRun=dryRun, state=state, linkMode=linkMode)
+
+    def buildQuery(self, sourcePath=None, regexp=None, minTime=None, maxTime=None, minSize=None, maxSize=None,
+                   hashes=None):
+        """Returns the DDBB filter for the files that match the given conditions.
 
+        All of them are evaluated by the DDBB, on indexed fields. Files below a path are found with
+        a range of filenames, so that the index is used.
+
+        :param sourcePath: if provided, only files under this path, relative to the mountPoint.
+        :type sourcePath: str
+        :param regexp: if provided, only files whose name (relative to the mountPoint) matches it.
+        :type regexp: str
+        :param minTime: if provided, only files modified at this time or later, in seconds since the epoch.
+        :type minTime: float
+        :param maxTime: if provided, only files modified before this time, in seconds since the epoch.
+        :type maxTime: float
+        :param minSize: if provided, only files at least this big, in bytes.
+        :type minSize: int
+        :param maxSize: if provided, only files at most this big, in bytes.
+        :type maxSize: int
+        :param hashes: if provided, only files with one of these hashes.
+        :type hashes: iterable of str
+        :rtype: dict
 
-    def reportStatusToFile(self, volHashesInfo, fnBase):
+        """
+        query = dict()
+        fnCond = dict()
+        if sourcePath not in (None, '', '.'):
+            prefix = sourcePath.rstrip('\\/') + os.sep
+            fnCond.update({'$gte': prefix, '$lt': prefix[:-1] + chr(ord(os.sep) + 1)})
+        if regexp is not None:
+            fnCond['$regex'] = regexp
+        if fnCond:
+            query['filename'] = fnCond
+        timeCond = {op: value for op, value in (('$gte', minTime), ('$lt', maxTime)) if value is not None}
+        if timeCond:
+            query['timestamp'] = timeCond
+        sizeCond = {op: value for op, value in (('$gte', minSize), ('$lte', maxSize)) if value is not None}
+        if sizeCond:
+            query['size'] = sizeCond
+        if hashes is not None:
+            query['hash'] = {'$in': sorted(set(hashes))}
+        return query
+
+    def findFiles(self, query):
+        """Iterator over pairs (fn, Info) for the files that match a DDBB filter, see :meth:`buildQuery`."""
+        for doc in self.container.find(query, ['filename', 'timestamp', 'size', 'hash']):
+            yield doc['filename'], {field: doc[field] for field in ('timestamp', 'size', 'hash')}
+
+
+    def reportStatusToFile(self, volHashesInfo, fnBase, volStoredSizes=None, reportFormat='txt', batchSize=10000):
         """Creates backup-status report files.
 
+        Files are read from the DDBB sorted by name, and each of them is sent right away to the report
+        files it belongs to, in batches. Every report file is written by its own background thread.
+
         :param volHashesInfo: for each volume, associates the hash of each file with its size.
         :type volHashesInfo: dict {vol: {hash: size}}
         :param fnBase: prefix of the report files to be created
         :type fnBase: str
+        :param volStoredSizes: for each volume, the pair (size of the original files, room they take in the volume).
+               They differ for volumes with compressed objects. If provided, it is included in the summary.
+        :type volStoredSizes: dict {vol: (int, int)}
+        :param reportFormat: format of the lists of files, one of :data:`REPORT_FORMATS <fsbackup.reportWriters.REPORT_FORMATS>`.
+        :type reportFormat: str
+        :param batchSize: number of rows sent at once to each report file.
+        :type batchSize: int
+        :rtype: dict
+
+        Returns the summary of the backup status, see :mod:`backupStats <fsbackup.backupStats>`.
         """
-        volumes = [vol for vol, _ in volHashesInfo]
+        volumes = sorted(vol for vol, _ in volHashesInfo)
 
-        # Set of hashes for each volume
-        hashesVols = {vol: set(shaSizes) for vol, shaSizes in volHashesInfo}
+        # Set of hashes for each volume, and of all of them
+        hashesVols = {vol: HashSet(shaSizes) for vol, shaSizes in volHashesInfo}
+        hashesStored = HashSet().union(*hashesVols.values())
+
+        # For each hash stored, the position of its volume in volumes, or -2 if there are several
+        owners = numpy.full(len(hashesStored), -1, dtype=numpy.int32)
+        for index, vol in enumerate(volumes):
+            pos = hashesStored.positions(hashesVols[vol].keys)
+            owners[pos] = numpy.where(owners[pos] == -1, index, -2)
 
         # For each sha, its size
         volShaSizes = dict()
         for _, shaSizes in volHashesInfo:
             volShaSizes.update(shaSizes)
 
-        # Set of hashes needed
-        hashesNeeded = set()
-        for path, info in self:
-            hashesNeeded.add(info['hash'])
-
-        notBacked = dict()
-        # Detailed information per volume
-        volsInfo = {vol: dict() for vol in volumes}
-        for path, info in self:
-            sha = info['hash']
-            found = False
-            for vol, hashesInfo in volHashesInfo:
-                if sha in hashesInfo:
-                    volsInfo[vol][path] = info['size']
-                    found = True
-            if not found:
-                notBacked[path] = info['size']
-
-        with open(fnBase + "missing.txt", 'w', encoding="utf-8") as f:
-            for fn, size in sorted(notBacked.items()):
-                print("%s (%s)" % (fn, sizeof_fmt(size)), file=f)
-
-        # Content of each volume
-        for vol, fnSizes in sorted(volsInfo.items()):
-            self.logger.debug("Creating file contents for volume '%s'" % vol)
-            with open(fnBase + "content_%s.txt" % vol, 'w', encoding="utf-8") as f:
-                for fn, size in sorted(fnSizes.items()):
-                    print("%s (%s)" % (fn, sizeof_fmt(size)), file=f)
+        # Hashes stored that are needed, and number of files and bytes in each report
+        needed = numpy.zeros(len(hashesStored), dtype=bool)
+        counts = {key: [0, 0] for key in volumes + [None]}  # None is for the files not backed-up
+
+        writers = dict()
+        try:
+            writers[None] = BackgroundWriter(createReportWriter(fnBase + "missing", reportFormat))
+            for vol in volumes:
+                self.logger.debug("Creating file contents for volume '%s'" % vol)
+                writers[vol] = BackgroundWriter(createReportWriter(fnBase + "content_%s" % vol, reportFormat))
+            batches = {key: [] for key in writers}
+            docs = self.container.find({}, ['filename', 'size', 'hash'], sort=[('filename', 1)])
+            for docsBatch in iterBatches(docs, batchSize):
+                pos = hashesStored.positions([doc['hash'] for doc in docsBatch])
+                needed[pos[pos >= 0]] = True
+                docOwners = numpy.where(pos >= 0, owners[pos], -1).tolist() if len(owners) else [-1] * len(docsBatch)
+                for doc, owner in zip(docsBatch, docOwners):
+                    if owner >= 0:
+                        keys = [volumes[owner]]
+                    elif owner == -1:
+                        keys = [None]
+                    else:
+                        keys = [vol for vol in volumes if doc['hash'] in hashesVols[vol]]
+                    for key in keys:
+                        batches[key].append((doc['filename'], doc['size']))
+                        counts[key][0] += 1
+                        counts[key][1] += doc['size']
+                        if len(batches[key]) >= batchSize:
+                            writers[key].write(batches[key])
+                            batches[key] = []
+            for key, batch in batches.items():
+                if batch:
+                    writers[key].write(batch)
+        finally:
+            for writer in writers.values():
+                writer.close()
 
         # Summary
-        with open(fnBase + "summary.txt", 'w') as f:
-            print("Missing files: %s (%s)\n" % (len(notBacked), sizeof_fmt(sum(notBacked.values()))), file=f)
-
-            for vol, fnSizes in sorted(volsInfo.items()):
-                print("Information volume '%s':" % vol, file=f)
-                print("\tBackup up %s files (%s)" % (len(fnSizes), sizeof_fmt(sum(fnSizes.values()))), file=f)
-
-                shaDelet = hashesVols[vol] - hashesNeeded
-                sizeDelet = sum(volShaSizes[sha] for sha in shaDelet)
-                print("\tDeletable %s files (%s)" % (len(shaDelet), sizeof_fmt(sizeDelet)), file=f)
-                print("", file=f)
+        summary = dict(missing=dict(files=counts[None][0], size=counts[None][1]), volumes=dict())
+        hashesNeeded = HashSet.fromKeys(hashesStored.keys[needed])
+        for vol, shaSizes in volHashesInfo:
+            shaDelet = hashesVols[vol] - hashesNeeded
+            summary['volumes'][vol] = dict(
+                files=counts[vol][0],
+                size=counts[vol][1],
+                deletableFiles=len(shaDelet),
+                deletableSize=sum(volShaSizes[sha] for sha in shaDelet),
+                objects=len(shaSizes),
+                objectsSize=sum(shaSizes.values()),
+                storedSize=volStoredSizes[vol][1] if (volStoredSizes is not None) and (vol in volStoredSizes) else None,
+            )
+        writeSummaryFile(fnBase + "summary.txt", summary)
+        return summary
 
 
     def volumeIntegrityCheck(self, vol):
@@ -271,41 +560,22 @@ class FileDB(object):
 
         """
         shaSizes = {sha: size for (sha, size) in vol}
-        shaNeededSet = set(shaSizes)
         problems = []
-        for fn, info in sorted(self):
-            sha = info['hash']
-            if sha in shaNeededSet:
-                fnComp = self.compFn(fn)
-                # Check file sizes
-                size_fs_db = info['size']
-                size_fs_real = os.stat(fnComp).st_size
-                if size_fs_db != size_fs_real:
-                    msg = "In filesystem, file sizes disagree for '%s': %s in ddbb and %s actual file size." % (
-                    fn, size_fs_db, size_fs_real)
-                    self.logger.warning(msg)
-                    problems.append(msg)
-                fnVol = vol.fnForHash(sha)
-                size_vol_db = shaSizes[sha]
-                size_vol_real = os.stat(fnVol).st_size
-                if size_vol_db != size_vol_real:
-                    msg = "In volume, file sizes disagree for '%s': %s in ddbb and %s actual file size." % (
-                    fn, size_vol_db, size_vol_real)
-                    self.logger.warning(msg)
-                    problems.append(msg)
-
-                # Check file content is equal
-                self.logger.debug("Errors so far: %s. Comparing '%s' and '%s'." % (len(problems), fn, fnVol))
-                try:
-                    areEqual = filecmp.cmp(fnComp, fnVol, shallow=False)  # This might fail there are I/O reading problems.
-                    if not areEqual:
-                        msg = "File '%s' in filesystem is not equal to file '%s' in volume." % (fn, fnVol)
-                        self.logger.warning(msg)
-                        problems.append(msg)
-                except:
-                    msg = "Files '%s' in filesystem and '%s' in volume could not be compared. I/O error?." % (fn, fnVol)
-                    self.logger.warning(msg)
-                    problems.append(msg)
+        toCheck = [(fn, info) for fn, info in sorted(self) if info['hash'] in shaSizes]
+        progress = ProgressReporter(self.logger, 'Verifying', totalFiles=len(toCheck),
+                                    totalBytes=sum(info['size'] for _, info in toCheck))
+        checked = self.pools.run(lambda pair: self._checkFile(vol, pair[0], pair[1], shaSizes[pair[1]['hash']]),
+                                 toCheck, lambda pair: self.pools.deviceOf(self.compFn(pair[0])))
+        for (fn, info), fileProblems, exc in checked:
+            if exc is not None:
+                fileProblems = ["File '%s' could not be checked: %s" % (fn, exc)]
+            for msg in fileProblems:
+                self.logger.warning(msg)
+            problems.extend(fileProblems)
+            if self.traceFiles:
+                self.logger.debug("Errors so far: %s. Compared '%s'." % (len(problems), fn))
+            progress.update(nbytes=info['size'])
+        progress.close()
         if problems:
             self.logger.warning("Unfortunately, some problems were found:")
             for msg in problems:
@@ -314,6 +584,37 @@ class FileDB(object):
             self.logger.info("No single problem was detected.")
 
 
+    def _checkFile(self, vol, fn, info, size_vol_db):
+        """Compares a file with its copy in the volume. Returns the list of problems found.
+
+        It may run in a worker thread.
+        """
+        problems = []
+        sha = info['hash']
+        fnComp = self.compFn(fn)
+        # Check file sizes
+        size_fs_db = info['size']
+        size_fs_real = os.stat(fnComp).st_size
+        if size_fs_db != size_fs_real:
+            problems.append("In filesystem, file sizes disagree for '%s': %s in ddbb and %s actual file size." % (
+                fn, size_fs_db, size_fs_real))
+        fnVol = vol.objectLocation(sha)
+        size_vol_real = vol.contentSize(sha)
+        if size_vol_db != size_vol_real:
+            problems.append("In volume, file sizes disagree for '%s': %s in ddbb and %s actual file size." % (
+                fn, size_vol_db, size_vol_real))
+
+        # Check file content is equal
+        try:
+            with self.metrics.timer('verify'), self.pools.semaphore(vol.locationPath):
+                areEqual = fileEqualsChunks(fnComp, vol.readChunks(sha))  # This might fail there are I/O reading problems.
+            self.metrics.count('bytesVerified', size_fs_real)
+            if not areEqual:
+                problems.append("File '%s' in filesystem is not equal to file '%s' in volume." % (fn, fnVol))
+        except:
+            problems.append("Files '%s' in filesystem and '%s' in volume could not be compared. I/O error?." % (fn, fnVol))
+        return problems
+
     def __iter__(self):
         """Iterator for pairs (fn, Info). For each file, its size and hash."""
         yield from self.container.items()
@@ -15,6 +15,17 @@ import shutil
 import uuid
 from datetime import datetime
 
+from fsbackup.ioHints import copyFile, sequentialFile
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+LINK_MODES = ('copy', 'hardlink', 'reflink')
+FICLONE = 0x40049409  # Linux ioctl that makes a file share the extents of another (btrfs, XFS...)
+
 
 def sizeof_fmt(num, suffix='B'):
     """Returns a human-readable string for a file size.
@@ -37,6 +48,45 @@ def sizeof_fmt(num, suffix='B'):
     return "%.1f%s%s" % (num, 'Yi', suffix)
 
 
+def parseSize(text):
+    """Returns the number of bytes for a size like ``'1500'``, ``'20Ki'``, ``'3.5Gi'`` or ``'3.5G'``.
+
+    Units are powers of 1024, as in :func:`sizeof_fmt`. A trailing ``'B'`` is allowed.
+
+    :param text: the size
+    :type text: str
+    :rtype: int
+
+    """
+    units = ['', 'K', 'M', 'G', 'T', 'P']
+    value = text.strip().upper()
+    if value.endswith('B'):
+        value = value[:-1]
+    if value.endswith('I'):
+        value = value[:-1]
+    exponent = 0
+    if value and (value[-1] in units[1:]):
+        exponent = units.index(value[-1])
+        value = value[:-1]
+    return int(float(value) * 1024 ** exponent)
+
+
+def parseTimestamp(text):
+    """Returns the seconds since the epoch for a local date, like ``'2017-11-30'`` or ``'2017-11-30 18:05'``.
+
+    :param text: the date, optionally with time (minutes or seconds precision)
+    :type text: str
+    :rtype: float
+
+    """
+    for fmt in ('%Y-%m-%d', '%Y-%m-%d %H:%M', '%Y-%m-%d %H:%M:%S'):
+        try:
+            return datetime.strptime(text.strip(), fmt).timestamp()
+        except ValueError:
+            pass
+    raise ValueError("Date '%s' not understood, use 'YYYY-MM-DD' or 'YYYY-MM-DD HH:MM[:SS]'." % text)
+
+
 def abspath2longabspath(abspath):
     """Returns an absolute filepath than works for longer than 260 chars in Windows.
 
@@ -66,6 +116,8 @@ def abspath2longabspath(abspath):
 def safeFileCopy(src, dst):
     """Copies a file but removes the target file if anything went wrong, before failing.
 
+    Both files are dropped from the page cache afterwards (see :mod:`ioHints <fsbackup.ioHints>`).
+
     :param src: source file
     :type src: str
     :param dst: destiny file
@@ -73,10 +125,84 @@ def safeFileCopy(src, dst):
 
     """
     try:
-        shutil.copy(src, dst)
+        copyFile(src, dst)
     except:
         try:
             os.remove(dst)
         except:
             pass
         raise IOError("For some reason file '%s' could not be copied to '%s'. Target was deleted." % (src, dst))
+
+
+def reflinkFile(src, dst):
+    """Creates dst as a copy-on-write clone of src: it shares its extents, so no data is copied.
+
+    Raises OSError where clones are not supported (other filesystems, other OS, or different filesystems).
+
+    :param src: source file
+    :type src: str
+    :param dst: destiny file
+    :type dst: str
+
+    """
+    if fcntl is None:
+        raise OSError("Reflinks are not supported in this platform.")
+    with open(src, 'rb') as fSrc:
+        try:
+            with open(dst, 'wb') as fDst:
+                fcntl.ioctl(fDst.fileno(), FICLONE, fSrc.fileno())
+        except OSError:
+            os.remove(dst)
+            raise
+    shutil.copymode(src, dst)
+
+
+def linkFile(src, dst, linkMode):
+    """Creates dst with the same content as the existing file src, sharing its storage if possible.
+
+    With ``'hardlink'``, dst becomes another name of src: a later change in one of them changes both.
+    With ``'reflink'``, they share the extents until one of them is modified. If that is not
+    possible (for instance, they are in different filesystems), src is just copied.
+
+    Returns whether the storage is shared.
+
+    :param src: source file
+    :type src: str
+    :param dst: destiny file. If it exists, it is replaced.
+    :type dst: str
+    :param linkMode: one of :data:`LINK_MODES`
+    :type linkMode: str
+    :rtype: bool
+
+    """
+    if linkMode not in LINK_MODES:
+        raise ValueError("Link mode '%s' not supported." % linkMode)
+    if linkMode != 'copy':
+        if os.path.lexists(dst):
+            os.remove(dst)
+        try:
+            if linkMode == 'hardlink':
+                os.link(src, dst)
+            else:
+                reflinkFile(src, dst)
+            return True
+        except OSError:
+            pass
+    safeFileCopy(src, dst)
+    return False
+
+
+def fileEqualsChunks(filename, chunks):
+    """Returns whether the content of a file is exactly the concatenation of the given chunks.
+
+    :param filename: the file to compare
+    :type filename: str
+    :param chunks: iterable of bytes, for instance the content of a volume object
+    :rtype: bool
+
+    """
+    with sequentialFile(filename) as f:
+        for chunk in chunks:
+            if f.read(len(chunk)) != chunk:
+                return False
+        return f.read(1) == b''
@@ -0,0 +1,208 @@
+#!/usr/bin/python3.6
+
+"""
+.. module:: fsWatcher
+    :platform: Windows, linux
+    :synopsis: watchers that tell which filesystem paths change, used by ``fsbck watch``.
+
+.. moduleauthor:: Miguel Garcia <zeycus@gmail.com>
+
+Two watchers are provided, with the same interface: :class:`InotifyWatcher` uses the Linux inotify API
+(through :mod:`ctypes`, no extra package is needed), and :class:`PollingWatcher` traverses the filesystem
+periodically, comparing timestamps and sizes. Use :func:`createWatcher` to get the best available.
+"""
+
+
+import os
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+
+
+# Constants from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+              IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+EVENT_HEADER = struct.Struct('iIII')  # wd, mask, cookie, len
+
+
+class InotifyWatcher(object):
+    """Watcher based on Linux inotify.
+
+    A watch is added for every folder under the given paths, and for the folders created later.
+    The number of watches is limited by ``/proc/sys/fs/inotify/max_user_watches``: if it is
+    exceeded, an :class:`OSError` is raised by the constructor.
+
+    """
+    def __init__(self, logger, paths):
+        """Constructor.
+
+        :param logger: internally stored logger, for feedback.
+        :param paths: absolute paths of the folders to watch.
+        :type paths: list of str
+
+        """
+        self.logger = logger
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, "inotify_init1: %s" % os.strerror(err))
+        self.wdPaths = dict()
+        try:
+            for path in paths:
+                self._addTree(path)
+        except OSError:
+            self.close()
+            raise
+        self.logger.debug("Watching %s folders with inotify." % len(self.wdPaths))
+
+    def _addWatch(self, path):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err in (errno.ENOENT, errno.ENOTDIR):  # Removed in the meanwhile
+                return
+            raise OSError(err, "inotify_add_watch '%s': %s" % (path, os.strerror(err)))
+        self.wdPaths[wd] = path
+
+    def _addTree(self, path):
+        for root, _, _ in os.walk(path):
+            self._addWatch(root)
+
+    def poll(self, timeout):
+        """Waits for changes, at most timeout seconds.
+
+        Returns the pair (set of absolute paths that changed, flag telling if events were lost).
+
+        :param timeout: seconds to wait.
+        :type timeout: float
+        :rtype: (set of str, bool)
+        """
+        changed = set()
+        overflow = False
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return changed, overflow
+        data = os.read(self.fd, 2**20)
+        pos = 0
+        while pos < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, pos)
+            pos += EVENT_HEADER.size
+            name = os.fsdecode(data[pos:pos + length].rstrip(b'\0'))
+            pos += length
+            if mask & IN_Q_OVERFLOW:
+                overflow = True
+                continue
+            if mask & IN_IGNORED:
+                self.wdPaths.pop(wd, None)
+                continue
+            folder = self.wdPaths.get(wd)
+            if folder is None:
+                continue
+            path = os.path.join(folder, name) if name else folder
+            changed.add(path)
+            if (mask & IN_ISDIR) and (mask & (IN_CREATE | IN_MOVED_TO)):
+                self._addTree(path)  # Files created in it before the watch was added are covered by its path
+        return changed, overflow
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher(object):
+    """Watcher that traverses the filesystem periodically.
+
+    It is the fallback when inotify is not available. It is much more expensive, but it does its
+    job in the background, instead of during the refresh.
+
+    """
+    def __init__(self, logger, paths, interval=600):
+        """Constructor.
+
+        :param logger: internally stored logger, for feedback.
+        :param paths: absolute paths of the folders to watch.
+        :type paths: list of str
+        :param interval: seconds between traversals.
+        :type interval: float
+
+        """
+        self.logger = logger
+        self.paths = paths
+        self.interval = interval
+        self.state = self._snapshot()
+        self.tNext = time.time() + interval
+        self.logger.debug("Watching %s files by polling every %s seconds." % (len(self.state), interval))
+
+    def _snapshot(self):
+        state = dict()
+        for path in self.paths:
+            for root, _, fns in os.walk(path):
+                for fn in fns:
+                    fnComp = os.path.join(root, fn)
+                    try:
+                        st = os.stat(fnComp)
+                    except OSError:
+                        continue
+                    state[fnComp] = (st.st_mtime_ns, st.st_size)
+        return state
+
+    def poll(self, timeout):
+        """Waits at most timeout seconds, traversing the filesystem if it is time to.
+
+        Returns the pair (set of absolute paths that changed, flag telling if events were lost).
+
+        :param timeout: seconds to wait.
+        :type timeout: float
+        :rtype: (set of str, bool)
+        """
+        wait = self.tNext - time.time()
+        if wait > timeout:
+            time.sleep(timeout)
+            return set(), False
+        time.sleep(max(wait, 0))
+        state = self._snapshot()
+        changed = set(fn for fn in state.keys() ^ self.state.keys())
+        changed.update(fn for fn in state.keys() & self.state.keys() if state[fn] != self.state[fn])
+        self.state = state
+        self.tNext = time.time() + self.interval
+        return changed, False
+
+    def close(self):
+        pass
+
+
+def createWatcher(logger, paths, pollInterval=600):
+    """Returns the best watcher available for the given paths.
+
+    :param logger: logger, for feedback.
+    :param paths: absolute paths of the folders to watch.
+    :type paths: list of str
+    :param pollInterval: seconds between traversals, if polling is needed.
+    :type pollInterval: float
+    :rtype: InotifyWatcher or PollingWatcher
+
+    """
+    if os.name == 'posix':
+        try:
+            return InotifyWatcher(logger, paths)
+        except (OSError, AttributeError) as exc:  # AttributeError: no inotify in the libc
+            logger.warning("inotify not available (%s), falling back to polling." % exc)
+    return PollingWatcher(logger, paths, interval=pollInterval)
@@ -14,13 +14,18 @@ import os
 import re
 import argparse
 import json
-import pymongo
 import logging
 
-from fsbackup.fileDB import FileDB
-from fsbackup.hashVolume import HashVolume
 from fsbackup.funcsLogger import loggingStdout
-from mongo_shelve import Mongo_shelve
+from fsbackup.fileTools import parseSize, parseTimestamp, LINK_MODES
+from fsbackup.metrics import Metrics
+from fsbackup.changeJournal import ChangeJournal
+from fsbackup.writeBehind import WriteBehindShelve, closeAll
+import fsbackup.ioHints as ioHints
+from fsbackup.ioOrder import IO_ORDERS
+from fsbackup.devicePools import DevicePools
+from fsbackup.backupStats import BackupStats
+from fsbackup.dbBackends import openDatabase, openShelve, confRelativePath
 
 import fsbackup.commands as comms
 
@@ -42,7 +47,8 @@ def fsbck_wrapper(arg_list):
     )
     parser.add_argument('command', help="task to perform", type=lambda s:s.lower(),
                         choices=("backupstatus", "extractvolumeinfo", "cleanvolume", "updatevolume", "refreshhashes", "processdrive",
-                                 "createdatabase", "checkout", "integritycheck", "showvolumeid", "removeduplicates", "sievepath", ))
+                                 "createdatabase", "checkout", "integritycheck", "showvolumeid", "removeduplicates", "sievepath",
+                                 "watch", "restoreplan", "restore", "snapshot", "initvolume", ))
     parser.add_argument('-db', '--dbfile', required=True, help="jsonfile whose filesystem/database is to be managed")
     if os.name == 'nt':
         parser.add_argument('-dr', '--drive', help="Windows drive (letter) where the volume is mounted")
@@ -56,6 +62,25 @@ def fsbck_wrapper(arg_list):
     parser.add_argument('--loglevel', help="logging level.", choices=("CRITICAL", "ERROR", "WARNING", "INFO", "DEBUG"), default="DEBUG")
     parser.add_argument('--volumeid', help="Volume id to be used, if forcing it is needed", default=None)
     parser.add_argument('--regexp', help="Regular Expression to be used")
+    parser.add_argument('--mintime', help="Checkout only files modified at this local date or later (YYYY-MM-DD[ HH:MM[:SS]])")
+    parser.add_argument('--maxtime', help="Checkout only files modified before this local date (YYYY-MM-DD[ HH:MM[:SS]])")
+    parser.add_argument('--minsize', help="Checkout only files at least this big, like 1500, 20Ki or 3Gi")
+    parser.add_argument('--maxsize', help="Checkout only files at most this big, like 1500, 20Ki or 3Gi")
+    parser.add_argument('--linkmode', help="How restored files with the same content are created: copied, or as hard links or reflinks of the first one",
+                        choices=LINK_MODES, default='copy')
+    parser.add_argument('--restorestate', help="File where restore keeps track of the files already restored. By default, next to destpath")
+    parser.add_argument('--hashfile', help="Checkout only files whose hash is listed in this file, one per line")
+    parser.add_argument('--fullscan', help="Traverse the volume files instead of reading its manifest", action='store_true')
+    parser.add_argument('--tracefiles', help="Log a line for every file processed, instead of just the progress", action='store_true')
+    parser.add_argument('--summaryonly', help="Write just the summary of the backup status, from the one kept up to date in the database", action='store_true')
+    parser.add_argument('--fromsnapshot', help="Build the backup status from the snapshot of the catalogue, instead of the database", action='store_true')
+    parser.add_argument('--dryrun', help="Report what would be done, without doing it", action='store_true')
+    parser.add_argument('--ioorder', help="Order in which files are read: by name (none), or by physical location (inode, fiemap)",
+                        choices=IO_ORDERS, default='none')
+    parser.add_argument('--noiohints', help="Do not tell the kernel that files are read sequentially, nor drop them from the page cache", action='store_true')
+    parser.add_argument('--writebehind', help="Send database writes in batches from a background thread, overlapping them with disk I/O", action='store_true')
+    parser.add_argument('--metricsjson', help="File where the timings and counters of the command are written, as JSON")
+    parser.add_argument('--metricsprom', help="File where the timings and counters of the command are written, in Prometheus text format")
 
     args = parser.parse_args(arg_list)
 
@@ -63,71 +88,183 @@ def fsbck_wrapper(arg_list):
     logger = loggingStdout(lev=getattr(logging, args.loglevel))
 
     # ***** Building custom objects *****
+    ioHints.setEnabled(not args.noiohints)
+    metrics = Metrics(command=args.command)
     with open(args.dbfile) as f:
         dbConf = json.load(f)
-    client = pymongo.MongoClient(dbConf['connstr'])
-    databaseName = re.search("(\w*)$", dbConf['connstr']).group(1)  # The database name is the last part of the connection string.
-    db = client[databaseName]
-    if dbConf['mountPoint'][0] == '.':  # Relative path to the json location are allowed, if they start with '.'
-        mountPoint = os.path.normpath(os.path.join(os.path.dirname(args.dbfile), dbConf['mountPoint']))
+    if ('drive' in args) and (args.drive is not None):  # Drive for Windows
+        volLocation = "%s:\\" % args.drive
+    elif ('drivemountpoint' in args) and (args.drivemountpoint is not None):  # Drive for Linux
+        volLocation = args.drivemountpoint
     else:
-        mountPoint = dbConf['mountPoint']
+        volLocation = None
+    snapshotFile = confRelativePath(dbConf.get('snapshotfile', os.path.splitext(args.dbfile)[0] + '_snapshot.bin'), args.dbfile)
+
+    # ***** Commands that do not need the DDBB *****
+    # They neither connect to it nor import the database drivers and numpy, so they start fast.
+    infoReturned = dict(db=None, metrics=metrics)
+    if args.command.lower() == 'showvolumeid':
+        infoReturned['volId'] = comms.showVolumeId(logger=logger, locationPath=volLocation, volId=args.volumeid)
+        reportMetrics(args, metrics, logger)
+        return infoReturned
+    if args.command.lower() == 'initvolume':
+        infoReturned['volId'] = comms.initVolume(logger=logger, locationPath=volLocation, volId=args.volumeid,
+                                                 forceFlag=args.force)
+        reportMetrics(args, metrics, logger)
+        return infoReturned
+    if (args.command.lower() == 'backupstatus') and args.fromsnapshot:
+        infoReturned['summary'] = comms.backupStatus(fDB=None, volDB=None, reportPref=dbConf['reportpref'],
+                                                     reportFormat=dbConf.get('reportFormat', 'txt'), summaryOnly=args.summaryonly,
+                                                     logger=logger, snapshotFile=snapshotFile)
+        reportMetrics(args, metrics, logger)
+        return infoReturned
+
+    from fsbackup.fileDB import FileDB
+    from fsbackup.hashVolume import HashVolume
+    db = openDatabase(dbConf, args.dbfile)
+    mountPoint = confRelativePath(dbConf['mountPoint'], args.dbfile)  # Relative path to the json location are allowed, if they start with '.'
+    filesDB = openShelve(db, 'files', "filename")
+    dirsDB = openShelve(db, 'dirs', 'dirname')
+    volDB = openShelve(db, 'volumes', 'hash')
+    if args.writebehind:
+        filesDB, dirsDB, volDB = [WriteBehindShelve(shelve, metrics=metrics) for shelve in (filesDB, dirsDB, volDB)]
+    pools = DevicePools(dbConf.get('deviceConcurrency'))
+    stats = BackupStats(openShelve(db, 'stats', 'key'), filesContainer=filesDB, volContainer=volDB)
     fDB = FileDB(
         logger=logger,
         mountPoint=mountPoint,
         fsPaths=dbConf['paths'],
-        container=Mongo_shelve(db['files'], "filename"),
+        container=filesDB,
+        metrics=metrics,
+        traceFiles=args.tracefiles,
+        dirs=dirsDB if dbConf.get('pruneDirs', False) else None,  # Kept only if it is going to be used
+        ioOrder=args.ioorder,
+        pools=pools,
+        stats=stats,
     )
-    volDB = Mongo_shelve(db['volumes'], 'hash')
-    if ('drive' in args) and (args.drive is not None):  # Drive for Windows
+    meta = openShelve(db, 'meta', 'key')
+    journal = ChangeJournal(confRelativePath(dbConf.get('journalfile', os.path.splitext(args.dbfile)[0] + '_journal.txt'), args.dbfile))
+    if volLocation is not None:
         hashVol = HashVolume(
             logger=logger,
-            locationPath="%s:\\" % args.drive,
-            container=volDB,
-            volId=args.volumeid,
-        )
-    elif ('drivemountpoint' in args) and (args.drivemountpoint is not None):  # Drive for Linux
-        hashVol = HashVolume(
-            logger=logger,
-            locationPath=args.drivemountpoint,
+            locationPath=volLocation,
             container=volDB,
             volId=args.volumeid,
+            packThreshold=dbConf.get('packThreshold'),
+            compression=dbConf.get('compression'),
+            compressionLevel=dbConf.get('compressionLevel', 3),
+            compressionThreads=dbConf.get('compressionThreads', 0),
+            metrics=metrics,
+            traceFiles=args.tracefiles,
+            ioOrder=args.ioorder,
+            pools=pools,
+            stats=stats,
         )
 
     # ***** Invoke the function that performs the given command *****
-    infoReturned = dict(db=db)
-    if args.command.lower() == 'backupstatus':
-        comms.backupStatus(fDB=fDB, volDB=volDB, reportPref=dbConf['reportpref'])
-    elif args.command.lower() == 'removeduplicates':
-        nDeleted = comms.removeDuplicates(fDB=fDB, regexp=args.regexp)
-        infoReturned['nDeleted'] = nDeleted
-    elif args.command.lower() == 'sievepath':
-        nDeleted = comms.removeDuplicates(fDB=fDB, path=args.sourcepath)
-        infoReturned['nDeleted'] = nDeleted
-    elif args.command.lower() == 'extractvolumeinfo':
-        comms.extractVolumeInfo(hashVol=hashVol)
-    elif args.command.lower() == 'showvolumeid':
-        comms.showVolumeId(hashVol=hashVol)
-    elif args.command.lower() == 'cleanvolume':
-        nDeleted = comms.cleanVolume(fDB=fDB, hashVol=hashVol)
-        infoReturned['nDeleted'] = nDeleted
-    elif args.command.lower() == 'updatevolume':
-        comms.updateVolume(fDB=fDB, hashVol=hashVol)
-    elif args.command.lower() == 'integritycheck':
-        comms.integrityCheck(fDB=fDB, hashVol=hashVol)
-    elif args.command.lower() == 'refreshhashes':
-        comms.refreshFileInfo(fDB=fDB, forceRecalc=args.force)
-    elif args.command.lower() == 'createdatabase':
-        comms.createDatabase(database=db, forceFlag=args.force, logger=logger)
-    elif args.command.lower() == 'checkout':
-        comms.checkout(fDB=fDB, hashVol=hashVol,
-                       sourcePath=args.sourcepath, destPath=args.destpath)
-    elif args.command.lower() == 'processdrive':  # Clean + update + backupStatus
-        comms.cleanVolume(fDB=fDB, hashVol=hashVol)
-        comms.updateVolume(fDB=fDB, hashVol=hashVol)
-        comms.backupStatus(fDB=fDB, volDB=volDB, reportPref=dbConf['reportpref'])
-    else:
-        raise Exception("Command '%s' not supported" % args.command)
+    infoReturned['db'] = db
+    completed = False  # Whether the command ended without errors
+    try:
+        if args.command.lower() == 'backupstatus':
+            infoReturned['summary'] = comms.backupStatus(fDB=fDB, volDB=volDB, reportPref=dbConf['reportpref'],
+                                                         reportFormat=dbConf.get('reportFormat', 'txt'), stats=stats,
+                                                         summaryOnly=args.summaryonly, logger=logger)
+        elif args.command.lower() == 'removeduplicates':
+            nDeleted = comms.removeDuplicates(fDB=fDB, regexp=args.regexp)
+            infoReturned['nDeleted'] = nDeleted
+        elif args.command.lower() == 'sievepath':
+            nDeleted = comms.removeDuplicates(fDB=fDB, path=args.sourcepath)
+            infoReturned['nDeleted'] = nDeleted
+        elif args.command.lower() == 'extractvolumeinfo':
+            comms.extractVolumeInfo(hashVol=hashVol, fullScan=args.fullscan)
+        elif args.command.lower() == 'cleanvolume':
+            nDeleted = comms.cleanVolume(fDB=fDB, hashVol=hashVol, dryRun=args.dryrun)
+            infoReturned['nDeleted'] = nDeleted
+        elif args.command.lower() == 'updatevolume':
+            comms.updateVolume(fDB=fDB, hashVol=hashVol)
+        elif args.command.lower() == 'integritycheck':
+            comms.integrityCheck(fDB=fDB, hashVol=hashVol)
+        elif args.command.lower() == 'refreshhashes':
+            comms.refreshFileInfo(fDB=fDB, forceRecalc=args.force, journal=journal, meta=meta,
+                                  fullScanDays=dbConf.get('fullScanDays', 7), pruneDirs=dbConf.get('pruneDirs', False))
+        elif args.command.lower() == 'watch':
+            comms.watch(fDB=fDB, journal=journal, pollInterval=dbConf.get('pollInterval', 600))
+        elif args.command.lower() == 'snapshot':
+            infoReturned['nFiles'], infoReturned['nObjects'] = comms.snapshot(fDB=fDB, volDB=volDB, filename=snapshotFile, logger=logger)
+        elif args.command.lower() == 'createdatabase':
+            comms.createDatabase(database=db, forceFlag=args.force, logger=logger)
+        elif args.command.lower() in ('checkout', 'restoreplan', 'restore'):
+            filters = dict(
+                regexp=args.regexp,
+                minTime=None if args.mintime is None else parseTimestamp(args.mintime),
+                maxTime=None if args.maxtime is None else parseTimestamp(args.maxtime),
+                minSize=None if args.minsize is None else parseSize(args.minsize),
+                maxSize=None if args.maxsize is None else parseSize(args.maxsize),
+            )
+            if args.hashfile is not None:
+                with open(args.hashfile) as f:
+                    filters['hashes'] = [line.strip().lower() for line in f if line.strip()]
+            if args.command.lower() == 'checkout':
+                infoReturned['restored'] = comms.checkout(fDB=fDB, hashVol=hashVol, sourcePath=args.sourcepath,
+                                                          destPath=args.destpath, filters=filters, dryRun=args.dryrun,
+                                                          linkMode=args.linkmode)
+            elif args.command.lower() == 'restoreplan':
+                infoReturned['plan'], infoReturned['unavailable'] = comms.restorePlan(
+                    fDB=fDB, volDB=volDB, sourcePath=args.sourcepath, destPath=args.destpath, filters=filters,
+                    stateFile=args.restorestate)
+            else:
+                infoReturned['restored'], infoReturned['plan'] = comms.restore(
+                    fDB=fDB, hashVol=hashVol, volDB=volDB, sourcePath=args.sourcepath, destPath=args.destpath,
+                    filters=filters, dryRun=args.dryrun, linkMode=args.linkmode, stateFile=args.restorestate)
+        elif args.command.lower() == 'processdrive':  # Clean + update + backupStatus
+            comms.cleanVolume(fDB=fDB, hashVol=hashVol)
+            comms.updateVolume(fDB=fDB, hashVol=hashVol)
+            infoReturned['summary'] = comms.backupStatus(fDB=fDB, volDB=volDB, reportPref=dbConf['reportpref'],
+                                                         reportFormat=dbConf.get('reportFormat', 'txt'), stats=stats,
+                                                         summaryOnly=args.summaryonly, logger=logger)
+        else:
+            raise Exception("Command '%s' not supported" % args.command)
+        completed = True
+    finally:
+        # Also on errors, so that the writes of the work done are not lost: objects already copied to a volume
+        # would be missing from the DDBB otherwise. Errors in them are raised only if the command succeeded.
+        writeError = None
+        if args.writebehind:
+            with metrics.timer('dbWrite'):
+                writeError = closeAll((filesDB, dirsDB, volDB), logger=logger, raiseErrors=False)
+        # The changes to the summary of the backup status are applied at once, when they are all in the DDBB.
+        # If some writes were lost, the summary can no longer be trusted, and the next backupStatus recomputes it.
+        try:
+            with metrics.timer('dbWrite'):
+                if writeError is None:
+                    stats.flush()
+                else:
+                    stats.invalidate()
+        except Exception as exc:
+            if completed:
+                raise
+            logger.error("The summary of the backup status could not be updated: %s" % exc)
+        if completed and (writeError is not None):
+            raise writeError
+    reportMetrics(args, metrics, logger)
 
     # Return information, useful for now only for testing.
     return infoReturned
+
+
+def reportMetrics(args, metrics, logger):
+    """Logs the summary of the metrics, and writes them to the files given in the arguments.
+
+    :param args: the parsed arguments
+    :type args: argparse.Namespace
+    :param metrics: timings and counters of the command
+    :type metrics: Metrics
+    :param logger: logger to be used
+    :type logger: logging.Logger
+
+    """
+    metrics.logSummary(logger)
+    if args.metricsjson:
+        metrics.writeJson(args.metricsjson)
+    if args.metricsprom:
+        metrics.writePrometheus(args.metricsprom)
@@ -0,0 +1,196 @@
+#!/usr/bin/python3.6
+
+"""
+.. module:: hashSet
+    :platform: Windows, linux
+    :synopsis: module for class :class:`HashSet <hashSet.HashSet>`.
+
+.. moduleauthor:: Miguel Garcia <zeycus@gmail.com>
+
+A Python set of hexadecimal SHA-256 hashes takes about 150 bytes per element, and set operations on millions of
+them run element by element. A :class:`HashSet` keeps the 32 bytes of each hash in a sorted ``numpy`` array, so it
+takes 40 bytes per element, and looks up batches of hashes at once.
+
+Comparing 32-byte keys is slow in numpy, but hashes are uniformly distributed: their first 8 bytes, as an integer,
+are almost always enough to tell them apart, and their top bits tell roughly where they are in the array. A table
+with the position where each value of the top bits starts is built, with about one key for each value. Lookups go
+straight to that position, advance while the prefix is smaller, and finally compare the whole key.
+"""
+
+
+import numpy
+
+
+KEY_DTYPE = 'S32'
+
+
+def hashToBytes(sha):
+    """Returns the 32 bytes of a hash given as an hexadecimal string."""
+    return bytes.fromhex(sha)
+
+
+def bytesToHash(value):
+    """Returns the hexadecimal string of a hash taken from a ``'S32'`` array.
+
+    Numpy drops the trailing zero bytes of the elements, they are restored.
+    """
+    return value.ljust(32, b'\x00').hex()
+
+
+def toKeys(shas, chunkSize=65536):
+    """Returns the hashes as an array of 32-byte keys, in the same order.
+
+    :param shas: hexadecimal hashes, or an array of keys (returned as is).
+    :type shas: iterable
+    :param chunkSize: number of hashes converted at once.
+    :type chunkSize: int
+    :rtype: numpy.ndarray
+    """
+    if isinstance(shas, numpy.ndarray):
+        return shas
+    data = bytearray()
+    chunk = []
+    for sha in shas:
+        chunk.append(sha)
+        if len(chunk) >= chunkSize:
+            data += bytes.fromhex(''.join(chunk))
+            chunk = []
+    data += bytes.fromhex(''.join(chunk))
+    return numpy.frombuffer(bytes(data), dtype=KEY_DTYPE)
+
+
+def keyPrefixes(keys):
+    """Returns the first 8 bytes of each key, as unsigned integers. They are sorted if the keys are.
+
+    :param keys: the 32-byte keys
+    :type keys: numpy.ndarray
+    :rtype: numpy.ndarray
+    """
+    return numpy.ascontiguousarray(keys).view('>u8')[::4].astype(numpy.uint64)
+
+
+def uniqueKeys(keys):
+    """Returns the keys sorted, without repetitions. Faster than ``numpy.unique`` for byte strings.
+
+    :param keys: the 32-byte keys
+    :type keys: numpy.ndarray
+    :rtype: numpy.ndarray
+    """
+    keys = numpy.sort(keys)
+    if len(keys) > 1:
+        keys = keys[numpy.concatenate(([True], keys[1:] != keys[:-1]))]
+    return keys
+
+
+class HashSet(object):
+    """Immutable set of hashes, backed by a sorted array of 32-byte keys.
+
+    Besides the usual set operations (``|``, ``&``, ``-``, ``in``), :meth:`contains` and :meth:`positions`
+    look up a whole batch of hashes at once: that is where the speed comes from.
+
+    """
+    def __init__(self, shas=()):
+        """Constructor.
+
+        :param shas: hexadecimal hashes, repetitions allowed. They are read just once, so a generator over
+               the DDBB documents does not need to be kept in memory.
+        :type shas: iterable
+
+        """
+        self.keys = uniqueKeys(toKeys(shas))
+        self._index = None
+
+    @classmethod
+    def fromKeys(cls, keys):
+        """Returns the set with the given keys, that must be sorted and without repetitions.
+
+        :param keys: the 32-byte keys
+        :type keys: numpy.ndarray
+        :rtype: HashSet
+        """
+        hashSet = cls.__new__(cls)
+        hashSet.keys = keys
+        hashSet._index = None
+        return hashSet
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __iter__(self):
+        """Iterator over the hashes, as hexadecimal strings, sorted."""
+        for key in self.keys:
+            yield bytesToHash(key)
+
+    def __contains__(self, sha):
+        return bool(self.contains([sha])[0])
+
+    def _buildIndex(self):
+        """Builds the prefixes of the keys, and the table with the position where each value of their top bits starts."""
+        prefixes = keyPrefixes(self.keys)
+        bits = max(1, min(len(self.keys).bit_length() - 1, 32))
+        shift = numpy.uint64(64 - bits)
+        starts = numpy.searchsorted(prefixes, numpy.arange(2 ** bits, dtype=numpy.uint64) << shift)
+        self._index = prefixes, shift, numpy.append(starts, len(prefixes))
+
+    def positions(self, shas):
+        """Returns, for each hash, its position in :attr:`keys`, or -1 if it is not in the set.
+
+        :param shas: hexadecimal hashes, or an array of keys.
+        :type shas: iterable
+        :rtype: numpy.ndarray
+        """
+        keys = toKeys(shas)
+        if (len(self.keys) == 0) or (len(keys) == 0):
+            return numpy.full(len(keys), -1, dtype=numpy.int64)
+        if self._index is None:
+            self._buildIndex()
+        prefixes, shift, starts = self._index
+        keyPrefix = keyPrefixes(keys)
+        bucket = (keyPrefix >> shift).astype(numpy.int64)
+        pos, end = starts[bucket], starts[bucket + 1]
+        # Advance to the first prefix not smaller, within the bucket. Buckets hold one or two keys on average.
+        pending = numpy.flatnonzero(pos < end)
+        while len(pending):
+            pending = pending[prefixes[pos[pending]] < keyPrefix[pending]]
+            pos[pending] += 1
+            pending = pending[pos[pending] < end[pending]]
+        pos[pos == len(self.keys)] = 0
+        found = self.keys[pos] == keys
+        # Keys sharing the prefix with others, almost never: their position is searched comparing whole keys
+        clash = ~found & (prefixes[pos] == keyPrefix)
+        if clash.any():
+            posClash = numpy.searchsorted(self.keys, keys[clash])
+            posClash[posClash == len(self.keys)] = 0
+            pos[clash] = posClash
+            found[clash] = self.keys[posClash] == keys[clash]
+        return numpy.where(found, pos, -1)
+
+    def contains(self, shas):
+        """Returns, for each hash, whether it is in the set.
+
+        :param shas: hexadecimal hashes, or an array of keys.
+        :type shas: iterable
+        :rtype: numpy.ndarray of bool
+        """
+        return self.positions(shas) >= 0
+
+    def union(self, *others):
+        return HashSet.fromKeys(uniqueKeys(numpy.concatenate([self.keys] + [other.keys for other in others])))
+
+    def intersection(self, other):
+        return HashSet.fromKeys(numpy.intersect1d(self.keys, other.keys, assume_unique=True))
+
+    def difference(self, other):
+        return HashSet.fromKeys(self.keys[~other.contains(self.keys)])
+
+    def __or__(self, other):
+        return self.union(other)
+
+    def __and__(self, other):
+        return self.intersection(other)
+
+    def __sub__(self, other):
+        return self.difference(other)
+
+    def __eq__(self, other):
+        return isinstance(other, HashSet) and numpy.array_equal(self.keys, other.keys)
@@ -14,10 +14,23 @@ import re
 import shutil
 import bisect
 import random
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 from fsbackup.shaTools import sha256
-from fsbackup.fileTools import sizeof_fmt, abspath2longabspath, safeFileCopy
-from fsbackup.diskTools import getVolumeInfo
+from fsbackup.fileTools import sizeof_fmt, abspath2longabspath, safeFileCopy, linkFile
+from fsbackup.packStore import PackStore
+from fsbackup.compressTools import ZstdCodec, looksCompressible
+from fsbackup.volumeManifest import VolumeManifest
+from fsbackup.volumeIdentity import VolumeIdentity
+from fsbackup.metrics import Metrics
+from fsbackup.progress import ProgressReporter
+from fsbackup.ioHints import sequentialFile
+from fsbackup.ioOrder import sortByPhysicalOrder
+from fsbackup.devicePools import SequentialPool
+from fsbackup.hashSet import HashSet
+from fsbackup.miscTools import iterBatches
 
 
 class HashVolume(object):
@@ -25,42 +38,110 @@ class HashVolume(object):
 
 
     """
-    def __init__(self, logger, locationPath, container, volId=None):
+    ioBatchLen = 1000  # Files backed-up in each batch, when an I/O order is used
+    lookupBatchLen = 65536  # Hashes looked up at once in a HashSet
+    def __init__(self, logger, locationPath, container, volId=None, packThreshold=None,
+                 compression=None, compressionLevel=3, compressionThreads=0, metrics=None,
+                 traceFiles=False, ioOrder='none', pools=None, stats=None):
         """Constructor.
 
         :param logger: internally stored logger, for feedback.
         :param locationPath: root path for the volume. Usually something like ``'G:\'``
         :type locationPath: str
         :param container: database information regarding which hashes are stored in which volume.
-        :type container: Mongo_shelve
-        :param volId: volume id. Currently, the volume SerialNumber, but the hard-drive SerialNumber might be a better choice.
-               It is optional, if ``None``, it is obtained by the OS.
+        :type container: MongoShelve or SqliteShelve
+        :param volId: volume id. It is optional, if ``None``, it is read from the identity file of the volume
+               (see :class:`VolumeIdentity <fsbackup.volumeIdentity.VolumeIdentity>`) or, if there is none yet,
+               obtained by the OS: the volume SerialNumber in Windows, the disk SerialNumber in Linux.
         :type volId: str
+        :param packThreshold: files smaller than this size in bytes are appended to pack files, instead of
+               being stored individually. If ``None`` (the default), pack files are not used for new files.
+        :type packThreshold: int
+        :param compression: if ``'zstd'``, new files are stored compressed, unless their content does not
+               look compressible. If ``None`` (the default), they are stored raw.
+        :type compression: str
+        :param compressionLevel: zstd compression level.
+        :type compressionLevel: int
+        :param compressionThreads: number of threads used by zstd to compress each file (0 means the calling thread).
+        :type compressionThreads: int
+        :param metrics: where timings and counters are gathered. If ``None``, a new one is created.
+        :type metrics: Metrics
+        :param traceFiles: if ``True``, a DEBUG line is logged for every file processed. Otherwise only the progress is shown.
+        :type traceFiles: bool
+        :param ioOrder: order in which files are read, one of :data:`IO_ORDERS <fsbackup.ioOrder.IO_ORDERS>`.
+               If not ``'none'``, files are backed-up in batches sorted by their physical location, and
+               checkouts read the volume in the order of the hash folders.
+        :type ioOrder: str
+        :param pools: runs copies in parallel, with a concurrency limit per device.
+               If ``None``, files are copied one after another.
+        :type pools: DevicePools or SequentialPool
+        :param stats: if provided, the cached summary of the backup status is updated as objects are added or removed.
+        :type stats: BackupStats
 
         """
         self.logger = logger
+        self.ioOrder = ioOrder
+        self.pools = SequentialPool() if pools is None else pools
+        self.stats = stats
+        self.metrics = Metrics() if metrics is None else metrics
+        self.traceFiles = traceFiles
         self.locationPath = locationPath
         self.container = container
-        if volId is None:
-            if os.name == 'nt':
-                self.volId = getVolumeInfo(locationPath[0])['VolumeSerialNumber']
-            elif os.name == 'posix':
-                from fsbackup.diskTools import getMountPointSerialNumberLinux
-                self.volId = getMountPointSerialNumberLinux(self.locationPath)
-            else:
-                raise OSError("OS '%s' not supported." % os.name)
+        self.packThreshold = packThreshold
+        self.packs = PackStore(locationPath)
+        self.manifest = VolumeManifest(locationPath)
+        self._manifestChecked = False
+        if compression is None:
+            self.codec = None
+        elif compression == 'zstd':
+            self.codec = ZstdCodec(level=compressionLevel, threads=compressionThreads)
         else:
+            raise ValueError("Compression '%s' not supported." % compression)
+        self._decoder = None
+        self.identity = VolumeIdentity(locationPath)
+        if volId is not None:
             self.volId = volId
+            if self.identity.exists() and (self.identity.volId != volId):
+                logger.warning("Using volume id '%s', but the volume identity file says '%s'." % (volId, self.identity.volId))
+        elif self.identity.exists():
+            self.volId = self.identity.volId
+        else:
+            from fsbackup.diskTools import getVolumeId
+            self.volId = getVolumeId(self.locationPath)
+
+    def updateIdentity(self):
+        """Refreshes the capacity stats in the identity file of the volume.
+
+        Volumes without one get it, with their current volume id, so from then on it does not depend on the OS.
+        """
+        if self.identity.exists():
+            self.identity.refreshCapacity()
+        else:
+            self.logger.info("Creating the identity file of volume '%s'." % self.volId)
+            self.identity.create(volId=self.volId)
 
     def allVolumesHashes(self):
         """Returns the set of all hashes in any volume, according to the DDBB.
 
-        :rtype: set
+        :rtype: HashSet
         """
-        return set(self.container)
+        return HashSet(self.container)
+
+    def recalculateContainer(self, fullScan=False, batchSize=10000):
+        """Rebuilds the DDBB volume information from the volume manifest.
+
+        If the volume has no complete manifest, or ``fullScan`` is set, the files in the volume
+        are traversed instead, and the manifest is rebuilt on the way.
+
+        Documents are sent to the DDBB in batches, so memory usage is bounded, and then replace the previous
+        ones (see ``replaceWhere`` in :class:`MongoShelve <fsbackup.mongoShelve.MongoShelve>`). With mongoDB, an
+        interruption may leave the volume partially described; running it again repairs it. If a hash in the
+        volume is recorded under another volume, ``ValueError`` is raised and the information is not modified.
 
-    def recalculateContainer(self):
-        """Rebuilds the DDBB volume information, traversing the files in the volume.
+        :param fullScan: flag that forces the traversal of the actual files in the volume.
+        :type fullScan: bool
+        :param batchSize: number of documents sent to the DDBB in each insertion.
+        :type batchSize: int
 
         .. note::
             This is something ordinarily you don't need to do, because the DDBB
@@ -68,10 +149,20 @@ class HashVolume(object):
             in case for some reason the synchronization was broken.
         """
         self.logger.debug("Rebuilding DDBB info for volume '%s'." % self.volId)
-        result = self.container.delete_many(dict(volume=self.volId))
-        self.logger.debug("Removed all (%s) documents." % result.deleted_count)
-        result = self.container.insert([dict(volume=self.volId, hash=fn, size=size) for (fn, size) in self.traverseFiles()])
-        self.logger.debug("Created %s new documents." % len(result))
+        if fullScan or not self.manifest.isComplete():
+            self.logger.debug("Traversing the volume files.")
+            triplets = self.manifest.rewriting(self.traverseFiles())
+        else:
+            self.logger.debug("Reading the volume manifest.")
+            triplets = ((sha, size, storedSize) for (sha, size, storedSize, _) in self.manifest.entries())
+        nbCreated, nbRemoved = self.container.replaceWhere(
+            dict(volume=self.volId),
+            (dict(volume=self.volId, hash=sha, size=size, storedsize=storedSize) for (sha, size, storedSize) in triplets),
+            batchSize=batchSize,
+        )
+        self.logger.debug("Created %s new documents, removed %s outdated ones." % (nbCreated, nbRemoved))
+        if self.stats is not None:
+            self.stats.invalidate()  # Recomputed by the next backupStatus
 
     def fnForHash(self, sha):
         """Returns the absolute path of the file for a given hash.
@@ -88,6 +179,31 @@ class HashVolume(object):
         """
         return os.path.join(self.locationPath, sha[0], sha[1], sha[2], sha)
 
+    def _looseLocation(self, sha):
+        """Returns the pair (filename, isCompressed) for an object stored as an individual file."""
+        fn = abspath2longabspath(self.fnForHash(sha))
+        if os.path.exists(fn):
+            return fn, False
+        return fn + ZstdCodec.suffix, True
+
+    def _objectOrderKey(self, sha):
+        """Sorting key that follows the layout of the objects in the volume."""
+        if sha in self.packs:
+            pack, offset, _ = self.packs.index[sha]
+            return (0, pack, offset)
+        return (1, sha, 0)
+
+    def _removeLoose(self, sha):
+        os.remove(self._looseLocation(sha)[0])
+
+    def _readCodec(self):
+        """Returns the codec used to read compressed objects, even if compression is disabled for new ones."""
+        if self.codec is not None:
+            return self.codec
+        if self._decoder is None:
+            self._decoder = ZstdCodec()
+        return self._decoder
+
     def storeFilename(self, filename, size, sha=None):
         """Creates a file in the volume.
 
@@ -98,18 +214,60 @@ class HashVolume(object):
         :param size: size in bytes of the original file
         :type size: int
         :param sha: the hash for the file. If not provided, it is calculated now
+        :rtype: int
+
+        Files smaller than ``packThreshold`` are appended to a pack file instead. If compression is
+        enabled, the file is stored compressed unless its content does not look compressible, or
+        compression does not make it smaller.
+
+        Returns the number of bytes the file takes in the volume.
 
         """
         filename = abspath2longabspath(filename)
         if sha is None:
             sha = sha256(filename)
-        fn_dest = self.fnForHash(sha)
-        os.makedirs(os.path.dirname(fn_dest), exist_ok=True)  # Si el directorio no existe, lo crea.
-        safeFileCopy(
-            src=filename,
-            dst=fn_dest,
-        )
-        self.container[sha] = dict(volume=self.volId, size=size)
+        storedSize = self._storeObject(filename, size, sha)
+        self._recordObject(sha, size, storedSize)
+        if self.stats is not None:
+            self.stats.volumeChanges(self.volId, added=[(sha, size, storedSize)], removed=[])
+        return storedSize
+
+    def _storeObject(self, filename, size, sha):
+        """Copies a file into the volume, without recording it. Returns its stored size.
+
+        It may run in a worker thread.
+        """
+        storedSize = size
+        with self.metrics.timer('copy'), self.pools.semaphore(self.locationPath):
+            if (self.packThreshold is not None) and (size < self.packThreshold):
+                self.packs.append(sha, filename, size)
+            else:
+                fn_dest = self.fnForHash(sha)
+                os.makedirs(os.path.dirname(fn_dest), exist_ok=True)  # Si el directorio no existe, lo crea.
+                if (self.codec is not None) and looksCompressible(filename):
+                    fn_dest += ZstdCodec.suffix
+                    storedSize = self.codec.compressFile(src=filename, dst=fn_dest, size=size)
+                    if storedSize >= size:  # Nothing gained, the file is stored raw.
+                        os.remove(fn_dest)
+                        fn_dest = self.fnForHash(sha)
+                        storedSize = size
+                if storedSize == size:
+                    safeFileCopy(
+                        src=filename,
+                        dst=fn_dest,
+                    )
+        self.metrics.count('bytesCopied', size)
+        return storedSize
+
+    def _recordObject(self, sha, size, storedSize):
+        """Records in the manifest and in the DDBB that an object was stored."""
+        if not self._manifestChecked:
+            if not self.manifest.isComplete() and not any(True for _ in self):  # A brand new volume
+                self.manifest.initialize()
+            self._manifestChecked = True
+        self.manifest.add(sha, size, storedSize)
+        with self.metrics.timer('dbWrite'):
+            self.container[sha] = dict(volume=self.volId, size=size, storedsize=storedSize)
 
     def retrieveFilename(self, sha, filename):
         """Extracts a file from the volume, given its hash.
@@ -120,22 +278,105 @@ class HashVolume(object):
         :type filename: str
 
         """
-        fn_source = abspath2longabspath(self.fnForHash(sha))
         os.makedirs(os.path.dirname(filename), exist_ok=True)  # Si el directorio no existe, lo crea.
-        safeFileCopy(
-            src=fn_source,
-            dst=filename,
-        )
+        with self.metrics.timer('copy'):
+            if sha in self.packs:
+                self.packs.extract(sha, filename)
+            else:
+                fn_source, isCompressed = self._looseLocation(sha)
+                if isCompressed:
+                    self._readCodec().decompressFile(src=fn_source, dst=filename)
+                else:
+                    safeFileCopy(
+                        src=fn_source,
+                        dst=filename,
+                    )
+        self.metrics.count('bytesRestored', os.stat(filename).st_size)
+
+    def readChunks(self, sha, chunkSize=2**20):
+        """Iterator over the content stored in the volume for a given hash, in chunks.
+
+        :param sha: the given hash
+        :type sha: str
+
+        Compressed objects are decompressed on the fly.
+
+        """
+        if sha in self.packs:
+            yield from self.packs.readChunks(sha, chunkSize)
+            return
+        fn, isCompressed = self._looseLocation(sha)
+        if isCompressed:
+            yield from self._readCodec().readChunks(fn, chunkSize)
+        else:
+            with sequentialFile(fn) as f:
+                yield from iter(lambda: f.read(chunkSize), b'')
+
+    def storedSize(self, sha):
+        """Returns the size in bytes of the object actually stored in the volume for a given hash.
+
+        :param sha: the given hash
+        :type sha: str
+        :rtype: int
+        """
+        if sha in self.packs:
+            return self.packs.index[sha][2]
+        return os.stat(self._looseLocation(sha)[0]).st_size
+
+    def contentSize(self, sha):
+        """Returns the size in bytes of the original file for a given hash, according to the volume.
+
+        It differs from :meth:`storedSize` only for compressed objects.
+
+        :param sha: the given hash
+        :type sha: str
+        :rtype: int
+        """
+        if sha in self.packs:
+            return self.packs.index[sha][2]
+        fn, isCompressed = self._looseLocation(sha)
+        if isCompressed:
+            return self._readCodec().contentSize(fn)
+        return os.stat(fn).st_size
+
+    def objectLocation(self, sha):
+        """Returns a human-readable description of where the object for a given hash is stored.
+
+        :param sha: the given hash
+        :type sha: str
+        :rtype: str
+        """
+        if sha in self.packs:
+            pack, offset, length = self.packs.index[sha]
+            return "%s (%s bytes at offset %s)" % (os.path.join(self.packs.path, pack), length, offset)
+        return self._looseLocation(sha)[0]
 
-    def remove(self, sha):
+    def remove(self, sha, size=None, storedSize=None):
         """Deletes the file with a given hash.
 
         :param sha: the given hash
         :type sha: str
+        :param size: its size, if the caller knows it. Otherwise it is read, for the summary of the backup status.
+        :type size: int
+        :param storedSize: the room it takes in the volume, if the caller knows it.
+        :type storedSize: int
+
+        Packed objects are just discarded from the pack index, the room they take
+        is recovered when the packs are compacted.
 
         """
-        os.remove(self.fnForHash(sha))
-        del self.container[sha]
+        if sha in self.packs:
+            self.packs.discard(sha)
+        else:
+            os.remove(self._looseLocation(sha)[0])
+        self.manifest.discard(sha)
+        if (size is None) and (self.stats is not None):
+            info = self.container[sha]
+            size, storedSize = info['size'], info.get('storedsize', info['size'])
+        with self.metrics.timer('dbWrite'):
+            del self.container[sha]
+        if self.stats is not None:
+            self.stats.volumeChanges(self.volId, added=[], removed=[(sha, size, size if storedSize is None else storedSize)])
 
     def getAvailableSpace(self):
         """Returns the available free space in the volume drive, in bytes.
@@ -172,88 +413,273 @@ class HashVolume(object):
 
 
         """
-        shasStored = self.allVolumesHashes()
-        filesizes = [(info['size'], fn, info['hash']) for (fn, info) in fDB if info['hash'] not in shasStored]
-        filesizes.sort()
+        with self.metrics.timer('dbRead'):
+            shasStored = self.allVolumesHashes()
+            filesizes = dict()  # Only one file for each hash, the rest have the same content
+            for batch in iterBatches(fDB, self.lookupBatchLen):
+                stored = shasStored.contains([info['hash'] for _, info in batch])
+                for (fn, info), isStored in zip(batch, stored):
+                    if not isStored:
+                        filesizes.setdefault(info['hash'], (info['size'], fn, info['hash']))
+        filesizes = sorted(filesizes.values())
         shasAugmented = []
+        sizeAugmented, storedAugmented = 0, 0
         avail = self.getAvailableSpace()
+        progress = ProgressReporter(self.logger, 'Backing-up', totalFiles=len(filesizes),
+                                    totalBytes=sum(size for size, _, _ in filesizes))
+        # With an I/O order or parallel copies, files are chosen in batches. Each batch is copied
+        # in the physical order of the files, in parallel for each device.
+        batchLen = self.ioBatchLen if (self.ioOrder != 'none') or self.pools.parallel else 1
         while filesizes:
             if avail < filesizes[0][0] + 100000:  # Avoiding to use the very last free byte, just in case.
+                progress.close()
+                self._logAugmented(shasAugmented, sizeAugmented, storedAugmented)
                 return shasAugmented, False
-            # Choice of file to backup.
-            if (avail > 20 * 2**30) and (avail > filesizes[-1][0]):
-                pos = random.randint(0, len(filesizes) - 1)
-            else:
-                pos = bisect.bisect_right(filesizes, (avail, '', '') ) - 1  # The biggest file that fits
-            if not (0 <= pos < len(filesizes)):  # Just checking, this should never happen
-                raise Exception("File chosen out of range")
-            sizeFound, fnFound, shaFound = filesizes[pos]
-            self.logger.debug("Including new file '%s (%s)'. Available: %s" % (fnFound, sizeof_fmt(sizeFound), sizeof_fmt(avail)))
-            self.storeFilename(
-                filename=fDB.compFn(fnFound),
-                size=sizeFound,
-                sha=shaFound,
-            )
+            batch = []
+            while filesizes and (len(batch) < batchLen) and (avail >= filesizes[0][0] + 100000):
+                # Choice of file to backup.
+                if (avail > 20 * 2**30) and (avail > filesizes[-1][0]):
+                    pos = random.randint(0, len(filesizes) - 1)
+                else:
+                    pos = bisect.bisect_right(filesizes, (avail, '', '') ) - 1  # The biggest file that fits
+                if not (0 <= pos < len(filesizes)):  # Just checking, this should never happen
+                    raise Exception("File chosen out of range")
+                batch.append(filesizes[pos])
+                del filesizes[pos]
+                avail -= batch[-1][0] + 4096  # Estimate, taking into account the last block of the file
+            batch = sortByPhysicalOrder(batch, lambda item: fDB.compFn(item[1]), self.ioOrder)
+            copied = self.pools.run(
+                lambda item: self._storeObject(abspath2longabspath(fDB.compFn(item[1])), item[0], item[2]),
+                batch, lambda item: self.pools.deviceOf(fDB.compFn(item[1])))
+            recorded = []
+            try:
+                for (sizeFound, fnFound, shaFound), storedSize, exc in copied:
+                    if exc is not None:
+                        raise exc
+                    if self.traceFiles:
+                        self.logger.debug("Included new file '%s (%s)'." % (fnFound, sizeof_fmt(sizeFound)))
+                    self._recordObject(shaFound, sizeFound, storedSize)
+                    recorded.append((shaFound, sizeFound, storedSize))
+                    storedAugmented += storedSize
+                    sizeAugmented += sizeFound
+                    shasAugmented.append(shaFound)
+                    progress.update(nbytes=sizeFound)
+            finally:  # Also for the objects recorded before an error
+                if self.stats is not None:
+                    self.stats.volumeChanges(self.volId, added=recorded, removed=[])
             avail = self.getAvailableSpace()
-            del filesizes[pos]
-            shasAugmented.append(shaFound)
+        progress.close()
+        self._logAugmented(shasAugmented, sizeAugmented, storedAugmented)
         return shasAugmented, True
 
-    def cleanOldHashes(self, totalHashesNeeded):
+    def _logAugmented(self, shasAugmented, sizeAugmented, storedAugmented):
+        self.logger.debug("Backed-up %s files (%s), taking %s in the volume." % (
+            len(shasAugmented), sizeof_fmt(sizeAugmented), sizeof_fmt(storedAugmented)))
+
+    def staleObjects(self, totalHashesNeeded):
+        """Returns the objects in the volume that are no longer necessary.
+
+        The volume information is streamed from the DDBB once, only the stale objects are kept.
+
+        :param totalHashesNeeded: hashes of files that need to be backed-up.
+        :type totalHashesNeeded: HashSet
+        :rtype: list of triplets (hash, size, storedSize)
+
+        """
+        stale = []
+        with self.metrics.timer('dbRead'):
+            for batch in iterBatches(self.container.find(dict(volume=self.volId)), self.lookupBatchLen):
+                needed = totalHashesNeeded.contains([doc['hash'] for doc in batch])
+                stale.extend((doc['hash'], doc['size'], doc.get('storedsize', doc['size']))
+                             for doc, isNeeded in zip(batch, needed) if not isNeeded)
+        return stale
+
+    def cleanOldHashes(self, totalHashesNeeded, dryRun=False, batchSize=1000, nbThreads=8):
         """Removes files that are no longer necessary.
 
-        Returns the number of files removed.
+        Returns the number of files removed. Packs are compacted afterwards, if
+        any packed object was removed.
+
+        Objects are removed in batches: first their DDBB entries, with a single query, then they are
+        recorded in the manifest, and finally the files are deleted by a pool of threads. An interruption
+        leaves at worst some orphan files, that the volume information does not mention.
 
         :param totalHashesNeeded: hashes of files that need to be backed-up.
-        :type totalHashesNeeded: set
+        :type totalHashesNeeded: HashSet
+        :param dryRun: if ``True``, nothing is removed: the files that would be, and the room they take, are just reported.
+        :type dryRun: bool
+        :param batchSize: number of objects removed at once.
+        :type batchSize: int
+        :param nbThreads: number of threads deleting files.
+        :type nbThreads: int
         :rtype: int
 
         """
-        nbDeleted = 0
-        for sha, _ in self:
-            if sha not in totalHashesNeeded:
-                self.remove(sha)
-                nbDeleted += 1
-        return nbDeleted
-
-    def checkout(self, fDB, sourcePath, destPath):
+        stale = self.staleObjects(totalHashesNeeded)
+        reclaimable = sum(storedSize for _, _, storedSize in stale)
+        if dryRun:
+            self.logger.info("Dry run: %s files could be removed from the volume, reclaiming %s." % (
+                len(stale), sizeof_fmt(reclaimable)))
+            return len(stale)
+        nbPackedDeleted = 0
+        with ThreadPoolExecutor(max_workers=nbThreads) as executor:
+            for start in range(0, len(stale), batchSize):
+                batch = [sha for sha, _, _ in stale[start:start + batchSize]]
+                with self.metrics.timer('dbWrite'):
+                    self.container.delete_many({'hash': {'$in': batch}})
+                if self.stats is not None:
+                    self.stats.volumeChanges(self.volId, added=[], removed=stale[start:start + batchSize])
+                self.manifest.discardMany(batch)
+                packed = [sha for sha in batch if sha in self.packs]
+                if packed:
+                    self.packs.discardMany(packed)
+                    nbPackedDeleted += len(packed)
+                packedSet = set(packed)
+                # list() waits for the deletions, and raises any error found
+                list(executor.map(self._removeLoose, [sha for sha in batch if sha not in packedSet]))
+        if nbPackedDeleted:
+            reclaimed = self.packs.compact()
+            self.logger.debug("Compacted packs, %s reclaimed." % sizeof_fmt(reclaimed))
+        self.logger.debug("Removed %s files from the volume, %s reclaimed." % (len(stale), sizeof_fmt(reclaimable)))
+        return len(stale)
+
+    def checkout(self, fDB, sourcePath, destPath, filters=None, dryRun=False, state=None, linkMode='copy'):
         """Rebuilds the filesystem, or a subfolder, from the backup content.
 
         Returns a list of the filenames (in the original filesystem) that were restored.
 
+        The files to restore are selected by the DDBB (see :meth:`FileDB.buildQuery <fsbackup.fileDB.FileDB.buildQuery>`),
+        and then which of them are in this volume, in batches of hashes. The volume is only read for those.
+
         :param fDB: filesystem information in DDBB.
         :type fDB: FileDB
         :param sourcePath: path in the filesystem that you want restored
         :type sourcePath: str
         :param destPath: location where you want the files created
         :type destPath: str
+        :param filters: if provided, only the files that match them are restored. Keys are the keyword
+               arguments of :meth:`FileDB.buildQuery <fsbackup.fileDB.FileDB.buildQuery>`.
+        :type filters: dict
+        :param dryRun: if True, the files that would be restored are just logged, with the bytes to copy.
+        :type dryRun: bool
+        :param state: if provided, files it contains are skipped, and those restored are recorded in it.
+        :type state: RestoreState
+        :param linkMode: one of :data:`LINK_MODES <fsbackup.fileTools.LINK_MODES>`. Unless it is ``'copy'``
+               (the default), only the first file for each hash is extracted from the volume, and the
+               rest are hard links or reflinks to it.
+        :type linkMode: str
         :rtype: list of str
 
         """
-        hashesVolume = set(sha for sha, size in self)
+        query = fDB.buildQuery(sourcePath=sourcePath, **(filters or dict()))
+        prefixLen = 0 if sourcePath in (None, '', '.') else len(sourcePath.rstrip('\\/')) + 1
+        with self.metrics.timer('dbRead'):
+            candidates = [(fn, info) for fn, info in fDB.findFiles(query) if (state is None) or (fn not in state)]
+            hashesVolume = set()
+            shas = sorted(set(info['hash'] for _, info in candidates))
+            for pos in range(0, len(shas), self.ioBatchLen):
+                batch = shas[pos:pos + self.ioBatchLen]
+                hashesVolume.update(doc['hash'] for doc in self.container.find(
+                    {'hash': {'$in': batch}, 'volume': self.volId}, ['hash']))
+        toRestore = [(fn, info, os.path.join(destPath, fn[prefixLen:]))
+                     for fn, info in candidates if info['hash'] in hashesVolume]
+        if dryRun:
+            for fn, info, destFn in sorted(toRestore):
+                self.logger.info("Would restore '%s' (%s) to '%s'." % (fn, sizeof_fmt(info['size']), destFn))
+            self.logger.info("%d files would be restored, %s would be copied." % (
+                len(toRestore), sizeof_fmt(sum(info['size'] for _, info, _ in toRestore))))
+            return sorted(fn for fn, _, _ in toRestore)
         filesFound = []
-        nbFilesToCheck = len(fDB)  # Numero total ficheros en fDB, no todos estaran en sourcePath.
-        for ind, (fn, info) in enumerate(fDB):
-            if info['hash'] in hashesVolume:  # Este volumen contiene el fichero buscado
-                relP = os.path.relpath(fn, sourcePath)
-                if relP[0] != '.':  # fn esta en el path del que hacemos checkout
-                    destFn = os.path.join(destPath, relP)
-                    self.logger.debug("File %d of %d, copying '%s' to '%s'" % (ind+1, nbFilesToCheck, fn, destFn))
-                    self.retrieveFilename(
-                        sha=info['hash'],
-                        filename=destFn,
-                    )
-                    filesFound.append(fn)
+        progress = ProgressReporter(self.logger, 'Restoring', totalFiles=len(toRestore),
+                                    totalBytes=sum(info['size'] for _, info, _ in toRestore))
+        if self.ioOrder != 'none':  # The volume is read in the order objects are laid out: by pack and offset, then by hash.
+            toRestore.sort(key=lambda item: self._objectOrderKey(item[1]['hash']))
+        firstRestored = dict()  # For each hash, the first file restored with it
+        for fn, info, destFn in toRestore:
+            sha = info['hash']
+            if (linkMode != 'copy') and (sha in firstRestored):
+                if self.traceFiles:
+                    self.logger.debug("Linking '%s' to '%s'" % (destFn, firstRestored[sha]))
+                os.makedirs(os.path.dirname(destFn), exist_ok=True)
+                with self.metrics.timer('copy'):
+                    if linkFile(firstRestored[sha], destFn, linkMode):
+                        self.metrics.count('bytesLinked', info['size'])
+            else:
+                if self.traceFiles:
+                    self.logger.debug("Copying '%s' to '%s'" % (fn, destFn))
+                self.retrieveFilename(
+                    sha=sha,
+                    filename=destFn,
+                )
+                firstRestored[sha] = destFn
+            if state is not None:
+                state.record(fn)
+            filesFound.append(fn)
+            progress.update(nbytes=info['size'])
+        progress.close()
         return filesFound
 
-    def traverseFiles(self):
-        """Iterator over pairs (hash, size) for the present volume, checking which actual files are stored in it."""
-        for root, _, files in os.walk(self.locationPath):
-            for fn in files:
-                if re.match(r"^[a-fA-F0-9]{64}$", fn):  # Por filtrar los tipicos ficheros que crea el SO y no son de SHA-256
-                    fnComp = os.path.join(root, fn)
-                    fnStat = os.stat(abspath2longabspath(fnComp))
-                    yield fn, fnStat.st_size
+    def traverseFiles(self, nbThreads=16):
+        """Iterator over triplets (hash, size, storedSize) for the present volume, checking which actual files are stored in it.
+
+        The 16 top-level hash folders are traversed in parallel, and results are handed over through
+        a bounded queue, so memory usage does not depend on the size of the volume.
+        Objects in pack files are taken from the pack index. For compressed objects, the original
+        size is read from their header.
+
+        :param nbThreads: number of folders traversed simultaneously.
+        :type nbThreads: int
+        """
+        results = queue.Queue(maxsize=64)
+        done = object()  # Sentinel put by each worker when it finishes
+        stop = threading.Event()  # Set if the consumer stops early, so that workers do not block forever
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    results.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    pass
+
+        def traverseBucket(bucket):
+            try:
+                batch = []
+                for root, _, files in os.walk(os.path.join(self.locationPath, bucket)):
+                    for fn in files:
+                        match = re.match(r"^([a-fA-F0-9]{64})(\.zst)?$", fn)  # Por filtrar los tipicos ficheros que crea el SO y no son de SHA-256
+                        if match:
+                            fnComp = abspath2longabspath(os.path.join(root, fn))
+                            storedSize = os.stat(fnComp).st_size
+                            size = self._readCodec().contentSize(fnComp) if match.group(2) else storedSize
+                            batch.append((match.group(1), size, storedSize))
+                            if len(batch) >= 1000:
+                                put(batch)
+                                batch = []
+                put(batch)
+            except Exception as exc:
+                put(exc)
+            finally:
+                put(done)
+
+        buckets = [d for d in "0123456789abcdef" if os.path.isdir(os.path.join(self.locationPath, d))]
+        with ThreadPoolExecutor(max_workers=nbThreads) as executor:
+            for bucket in buckets:
+                executor.submit(traverseBucket, bucket)
+            nbPending = len(buckets)
+            try:
+                while nbPending:
+                    item = results.get()
+                    if item is done:
+                        nbPending -= 1
+                    elif isinstance(item, Exception):
+                        raise item
+                    else:
+                        yield from item
+            finally:
+                stop.set()
+        for sha, size in self.packs:
+            yield sha, size, size
 
     def __iter__(self):
         """Iterator over pairs (hash, size) for the present volume in the DDBB"""
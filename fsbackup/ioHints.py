@@ -0,0 +1,132 @@
+#!/usr/bin/python3.6
+
+"""
+.. module:: ioHints
+    :platform: Windows, linux
+    :synopsis: module with the functions that tell the kernel how files are going to be read.
+
+.. moduleauthor:: Miguel Garcia <zeycus@gmail.com>
+
+Files are always read from beginning to end, once. Telling it to the kernel (``posix_fadvise``) makes it
+read ahead more aggressively, and allows dropping the pages once they are read: otherwise a backup of
+terabytes evicts from the page cache everything that was useful to the rest of the system.
+
+Hints are only available where ``os.posix_fadvise`` is (Linux and most Unixes). Elsewhere, or when
+disabled with :func:`setEnabled`, the functions here do nothing.
+"""
+
+
+import os
+import shutil
+from contextlib import contextmanager
+
+
+_enabled = hasattr(os, 'posix_fadvise')
+
+READ_CHUNK = 2**20  # Bytes read at once while streaming files
+WILLNEED_MIN_SIZE = 2**26  # For files at least this big, the first window is prefetched at once
+WILLNEED_WINDOW = 2**25
+
+
+def setEnabled(enabled):
+    """Enables or disables the hints. They cannot be enabled where ``os.posix_fadvise`` is not available."""
+    global _enabled
+    _enabled = enabled and hasattr(os, 'posix_fadvise')
+
+
+def isEnabled():
+    """Returns whether the hints are given.
+
+    :rtype: bool
+    """
+    return _enabled
+
+
+def _advise(fd, offset, length, advice):
+    try:
+        os.posix_fadvise(fd, offset, length, advice)
+    except OSError:  # Some filesystems (FUSE, some network ones) do not support it. They are just hints.
+        pass
+
+
+def adviseSequential(f):
+    """Tells the kernel that an open file is going to be read sequentially.
+
+    For big files, the reading of the first window starts right away.
+
+    :param f: the open file
+    """
+    if _enabled:
+        fd = f.fileno()
+        _advise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        if os.fstat(fd).st_size >= WILLNEED_MIN_SIZE:
+            _advise(fd, 0, WILLNEED_WINDOW, os.POSIX_FADV_WILLNEED)
+
+
+def adviseDone(f):
+    """Tells the kernel that the pages of an open file will not be needed again.
+
+    Pages not yet written to disk are not dropped, so for files just written it is a best effort.
+
+    :param f: the open file
+    """
+    if _enabled:
+        _advise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+
+@contextmanager
+def sequentialFile(filename):
+    """Context manager that opens a file for reading it sequentially once, dropping its pages afterwards.
+
+    Usage example:
+
+    .. code-block:: python
+
+        with sequentialFile(fn) as f:
+            for chunk in iter(lambda: f.read(READ_CHUNK), b''):
+                process(chunk)
+
+    """
+    with open(filename, 'rb') as f:
+        adviseSequential(f)
+        try:
+            yield f
+        finally:
+            adviseDone(f)
+
+
+def copyFile(src, dst):
+    """Copies a file with its permission bits, like :func:`shutil.copy`, giving hints for both files.
+
+    When the hints are disabled, :func:`shutil.copy` is used.
+
+    :param src: source file
+    :type src: str
+    :param dst: destiny file
+    :type dst: str
+
+    """
+    if not _enabled:
+        shutil.copy(src, dst)
+        return
+    with sequentialFile(src) as fSrc, open(dst, 'wb') as fDst:
+        _copyContent(fSrc, fDst)
+        fDst.flush()
+        adviseDone(fDst)
+    shutil.copymode(src, dst)
+
+
+def _copyContent(fSrc, fDst):
+    """Copies the content with sendfile where available, so that it does not go through user space."""
+    if hasattr(os, 'sendfile'):
+        offset = 0
+        try:
+            while True:
+                sent = os.sendfile(fDst.fileno(), fSrc.fileno(), offset, 8 * READ_CHUNK)
+                if sent == 0:
+                    return
+                offset += sent
+        except OSError:  # Not supported for these files: go on the usual way
+            fSrc.seek(offset)
+            fDst.seek(offset)
+    shutil.copyfileobj(fSrc, fDst, READ_CHUNK)
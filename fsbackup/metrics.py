@@ -0,0 +1,150 @@
+#!/usr/bin/python3.6
+
+"""
+.. module:: metrics
+    :platform: Windows, linux
+    :synopsis: module for class :class:`Metrics <metrics.Metrics>`.
+
+.. moduleauthor:: Miguel Garcia <zeycus@gmail.com>
+"""
+
+
+import os
+import json
+import time
+import threading
+from collections import defaultdict
+
+
+class _Timer(object):
+    """Context manager that adds the time spent in its block to a phase of a :class:`Metrics`."""
+    __slots__ = ('metrics', 'phase', 't0')
+
+    def __init__(self, metrics, phase):
+        self.metrics = metrics
+        self.phase = phase
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.metrics.addTime(self.phase, time.perf_counter() - self.t0)
+
+
+class Metrics(object):
+    """Counters and timers gathered while a command runs.
+
+    Time is accumulated per phase (see :attr:`phases`), together with the number of times each
+    phase was entered. Counters are free-form, for instance the bytes hashed or copied.
+    Updates are cheap and thread-safe, so they can be done for every file.
+
+    Usage example:
+
+    .. code-block:: python
+
+        with metrics.timer('hash'):
+            sha = sha256(fn)
+        metrics.count('bytesHashed', size)
+
+    """
+    phases = ('scan', 'stat', 'hash', 'dbRead', 'dbWrite', 'copy', 'verify')
+
+    def __init__(self, command=None):
+        """Constructor.
+
+        :param command: name of the command being measured, used as a label in the exports.
+        :type command: str
+
+        """
+        self.command = command
+        self.times = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.counters = defaultdict(int)
+        self.lock = threading.Lock()
+        self.t0 = time.perf_counter()
+
+    def timer(self, phase):
+        """Returns a context manager that measures the time spent in a phase."""
+        return _Timer(self, phase)
+
+    def addTime(self, phase, secs, calls=1):
+        with self.lock:
+            self.times[phase] += secs
+            self.calls[phase] += calls
+
+    def count(self, name, n=1):
+        """Increments a counter."""
+        with self.lock:
+            self.counters[name] += n
+
+    def toDict(self):
+        """Returns all the metrics as a dict, ready to be dumped as JSON.
+
+        :rtype: dict
+        """
+        return dict(
+            command=self.command,
+            elapsedSecs=time.perf_counter() - self.t0,
+            phases={phase: dict(secs=self.times[phase], calls=self.calls[phase]) for phase in sorted(self.times)},
+            counters=dict(self.counters),
+        )
+
+    def summaryLines(self):
+        """Returns the lines of a human-readable summary table.
+
+        :rtype: list of str
+        """
+        lines = ["%-10s %12s %12s" % ("phase", "seconds", "calls")]
+        phases = [phase for phase in self.phases if phase in self.times]
+        phases += sorted(phase for phase in self.times if phase not in self.phases)
+        for phase in phases:
+            lines.append("%-10s %12.3f %12d" % (phase, self.times[phase], self.calls[phase]))
+        lines.append("%-10s %12.3f" % ("total", time.perf_counter() - self.t0))
+        for name, value in sorted(self.counters.items()):
+            lines.append("%-23s %12d" % (name, value))
+        return lines
+
+    def logSummary(self, logger):
+        """Sends the summary table to the logger, with level INFO."""
+        logger.info("Metrics summary for command '%s':" % self.command)
+        for line in self.summaryLines():
+            logger.info(line)
+
+    def writeJson(self, filename):
+        """Writes the metrics to a JSON file."""
+        with open(filename, 'w') as f:
+            json.dump(self.toDict(), f, indent=2)
+
+    def writePrometheus(self, filename):
+        """Writes the metrics in the Prometheus text format, for instance for the node_exporter textfile collector.
+
+        The file is written under a temporary name and then renamed, so that it is never read half-written.
+        """
+        label = 'command="%s"' % self.command
+        lines = [
+            "# HELP fsbck_phase_seconds_total Time spent in each phase of the command.",
+            "# TYPE fsbck_phase_seconds_total counter",
+        ]
+        for phase in sorted(self.times):
+            lines.append('fsbck_phase_seconds_total{%s,phase="%s"} %f' % (label, phase, self.times[phase]))
+        lines += [
+            "# HELP fsbck_phase_calls_total Number of times each phase of the command was entered.",
+            "# TYPE fsbck_phase_calls_total counter",
+        ]
+        for phase in sorted(self.calls):
+            lines.append('fsbck_phase_calls_total{%s,phase="%s"} %d' % (label, phase, self.calls[phase]))
+        for name, value in sorted(self.counters.items()):
+            lines += [
+                "# TYPE fsbck_%s_total counter" % name,
+                "fsbck_%s_total{%s} %d" % (name, label, value),
+            ]
+        lines += [
+            "# TYPE fsbck_elapsed_seconds gauge",
+            "fsbck_elapsed_seconds{%s} %f" % (label, time.perf_counter() - self.t0),
+            "# TYPE fsbck_last_run_timestamp_seconds gauge",
+            "fsbck_last_run_timestamp_seconds{%s} %f" % (label, time.time()),
+        ]
+        with open(filename + '.tmp', 'w') as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(filename + '.tmp', filename)
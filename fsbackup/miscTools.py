@@ -11,6 +11,7 @@
 
 
 from collections import defaultdict
+from itertools import islice
 
 def buildVolumeInfoList(container):
     """Returns, for each volume, the association {file-hash: file-size}.
@@ -24,3 +25,38 @@ def buildVolumeInfoList(container):
     for hsh, docum in container.items():
         info[docum['volume']][hsh] = docum['size']
     return sorted(info.items())
+
+
+def buildVolumeStoredSizes(container):
+    """Returns, for each volume, the size of the files it backs-up and the room they take in it.
+
+    Both differ for volumes with compressed objects. Entries created before compression
+    was supported have no ``storedsize`` field, their size is used instead.
+
+    :param container: a MongoAsDict with the volume information
+    :type container: MongoAsDict
+    :rtype: dict {volId: (size, storedSize)}
+
+    """
+    info = defaultdict(lambda: [0, 0])
+    for _, docum in container.items():
+        sizes = info[docum['volume']]
+        sizes[0] += docum['size']
+        sizes[1] += docum.get('storedsize', docum['size'])
+    return {vol: tuple(sizes) for vol, sizes in info.items()}
+
+
+def iterBatches(iterable, batchSize):
+    """Iterator over lists with the consecutive items of an iterable, batchSize of them at most.
+
+    :param iterable: the items
+    :param batchSize: maximum number of items in each list
+    :type batchSize: int
+
+    """
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, batchSize))
+        if not batch:
+            return
+        yield batch
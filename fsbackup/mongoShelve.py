@@ -0,0 +1,116 @@
+#!/usr/bin/python3.6
+
+"""
+.. module:: mongoShelve
+    :platform: Windows, linux
+    :synopsis: module for class :class:`MongoShelve <mongoShelve.MongoShelve>`.
+
+.. moduleauthor:: Miguel Garcia <zeycus@gmail.com>
+"""
+
+
+import uuid
+
+from pymongo import UpdateOne, DeleteOne, ASCENDING
+from mongo_shelve import Mongo_shelve
+
+
+class MongoShelve(Mongo_shelve):
+    """:class:`mongo_shelve.Mongo_shelve` extended with the bulk operations fsbackup needs.
+
+    :class:`SqliteShelve <fsbackup.sqliteShelve.SqliteShelve>` provides the same interface for the SQLite backend.
+
+    """
+    def applyBatch(self, ops):
+        """Applies a list of operations, in order, with a single bulk write.
+
+        :param ops: operations, either ``('set', key, value)`` or ``('del', key)``.
+               Deleting an absent key is not an error.
+        :type ops: list of tuple
+
+        """
+        requests = []
+        for op in ops:
+            if op[0] == 'set':
+                value = dict(op[2])
+                value[self.keyField] = op[1]
+                requests.append(UpdateOne({self.keyField: op[1]}, {'$set': value}, upsert=True))
+            else:
+                requests.append(DeleteOne({self.keyField: op[1]}))
+        if requests:
+            self.col.bulk_write(requests, ordered=True)
+
+    def replaceWhere(self, selector, docs, batchSize=10000):
+        """Replaces all the documents matching the selector with the given documents.
+
+        Documents are inserted in batches in a staging collection (the name of the collection
+        followed by ``_staging``), tagged with a rebuild token in field ``rebuild``. Once they are all
+        there, they are merged server-side into the collection, without the token, and then the documents
+        matching the selector that were not among the new ones are removed. That way the memory used is bounded.
+
+        The merge is not atomic: if the process is interrupted during or after it, the collection may keep
+        a mix of new and outdated documents. Running the replacement again repairs it.
+
+        If a new document has the key of an existing one that does not match the selector, a ``ValueError``
+        is raised before the collection is modified, as :class:`SqliteShelve <fsbackup.sqliteShelve.SqliteShelve>` does.
+        The merge requires mongoDB 4.2 or later.
+
+        Returns the pair (number of documents inserted, number removed).
+
+        :param selector: filter of the documents to replace
+        :type selector: dict
+        :param docs: iterable of the new documents, all of them should match the selector
+        :param batchSize: number of documents sent to the DDBB in each insertion
+        :type batchSize: int
+        :rtype: pair of int
+
+        """
+        token = uuid.uuid4().hex
+        staging = self.col.database[self.col.name + '_staging']
+        staging.create_index([(self.keyField, ASCENDING)])  # For the look-up of the outdated documents
+        staging.delete_many(selector)  # Leftovers of an interrupted replacement
+        nbInserted = 0
+        batch = []
+        try:
+            for doc in docs:
+                batch.append(dict(doc, rebuild=token))
+                if len(batch) >= batchSize:
+                    self._stageBatch(staging, selector, batch)
+                    nbInserted += len(batch)
+                    batch = []
+            if batch:
+                self._stageBatch(staging, selector, batch)
+                nbInserted += len(batch)
+        except:
+            staging.delete_many(dict(rebuild=token))
+            raise
+        staging.aggregate([
+            {'$match': dict(rebuild=token)},
+            {'$project': {'_id': 0, 'rebuild': 0}},
+            {'$merge': {'into': self.col.name, 'on': self.keyField, 'whenMatched': 'replace', 'whenNotMatched': 'insert'}},
+        ])
+        outdated = self.col.aggregate([
+            {'$match': selector},
+            {'$lookup': {'from': staging.name, 'localField': self.keyField, 'foreignField': self.keyField, 'as': 'new'}},
+            {'$match': {'new': {'$size': 0}}},
+            {'$project': {'_id': 1}},
+        ])
+        nbRemoved = 0
+        ids = []
+        for doc in outdated:
+            ids.append(doc['_id'])
+            if len(ids) >= batchSize:
+                nbRemoved += self.col.delete_many({'_id': {'$in': ids}}).deleted_count
+                ids = []
+        if ids:
+            nbRemoved += self.col.delete_many({'_id': {'$in': ids}}).deleted_count
+        staging.delete_many(dict(rebuild=token))
+        return nbInserted, nbRemoved
+
+    def _stageBatch(self, staging, selector, batch):
+        """Inserts a batch in the staging collection, once checked that its keys are not taken outside the selector."""
+        keys = [doc[self.keyField] for doc in batch]
+        taken = self.col.find_one({'$and': [{self.keyField: {'$in': keys}}, {'$nor': [selector]}]})
+        if taken is not None:
+            raise ValueError("Key '%s' already belongs to a document not being replaced: %s" % (taken[self.keyField], taken))
+        staging.insert_many(batch, ordered=False)
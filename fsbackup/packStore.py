@@ -0,0 +1,261 @@
+#!/usr/bin/python3.6
+
+"""
+.. module:: packStore
+    :platform: Windows, linux
+    :synopsis: module for class :class:`PackStore <packStore.PackStore>`.
+
+.. moduleauthor:: Miguel Garcia <zeycus@gmail.com>
+"""
+
+
+import os
+import re
+import threading
+
+
+class PackStore(object):
+    """Class that handles the pack files of a backup volume.
+
+    Small files are not stored as individual files in the volume, they are appended to big
+    pack files instead. All of them live in the :file:`packs` folder at the root of the volume,
+    together with an index that associates each hash to a triplet (pack, offset, length).
+
+    The index file is append-only: a line ``<sha> <pack> <offset> <length>`` is written when
+    an object is added, and a line ``<sha> -`` when it is discarded. Discarded objects still
+    take room in their pack until :meth:`compact` is invoked.
+
+    """
+    dirName = 'packs'
+    indexName = 'index.txt'
+
+    def __init__(self, locationPath, maxPackSize=2**30):
+        """Constructor.
+
+        :param locationPath: root path of the volume.
+        :type locationPath: str
+        :param maxPackSize: new objects are appended to the last pack only while it stays below this size, in bytes.
+        :type maxPackSize: int
+
+        """
+        self.path = os.path.join(locationPath, self.dirName)
+        self.maxPackSize = maxPackSize
+        self._index = None  # Loaded the first time it is needed
+        self.lock = threading.Lock()
+
+    @property
+    def index(self):
+        """Dict {sha: (pack, offset, length)} of the objects currently in the packs."""
+        if self._index is None:
+            self._index = self._loadIndex()
+        return self._index
+
+    def _loadIndex(self):
+        """Replays the index file, returning the dict of live objects."""
+        index = dict()
+        fnIndex = os.path.join(self.path, self.indexName)
+        if os.path.isfile(fnIndex):
+            with open(fnIndex) as f:
+                for line in f:
+                    parts = line.split()
+                    if len(parts) == 4:
+                        index[parts[0]] = (parts[1], int(parts[2]), int(parts[3]))
+                    elif (len(parts) == 2) and (parts[1] == '-'):
+                        index.pop(parts[0], None)
+                    # Anything else is a line truncated by an interrupted write: it is ignored.
+        return index
+
+    def _appendIndexLines(self, lines):
+        with open(os.path.join(self.path, self.indexName), 'a') as f:
+            for line in lines:
+                print(line, file=f)
+
+    def packNames(self):
+        """Returns the sorted list of pack filenames (without path)."""
+        if not os.path.isdir(self.path):
+            return []
+        return sorted(fn for fn in os.listdir(self.path) if re.match(r"^pack-\d{6}\.pack$", fn))
+
+    def _packForAppend(self, length):
+        """Returns the name of the pack where an object of the given length should be appended."""
+        names = self.packNames()
+        if names:
+            last = names[-1]
+            if os.path.getsize(os.path.join(self.path, last)) + length <= self.maxPackSize:
+                return last
+            nextNumber = int(last[5:11]) + 1
+        else:
+            nextNumber = 0
+        return "pack-%06d.pack" % nextNumber
+
+    def _copyRange(self, fIn, fOut, length, chunkSize=2**20):
+        """Copies exactly length bytes from fIn to fOut."""
+        remaining = length
+        while remaining > 0:
+            chunk = fIn.read(min(chunkSize, remaining))
+            if not chunk:
+                raise IOError("Unexpected end of file, %s bytes were missing." % remaining)
+            fOut.write(chunk)
+            remaining -= len(chunk)
+
+    def append(self, sha, filename, length):
+        """Appends the content of a file to a pack.
+
+        :param sha: hash of the file
+        :type sha: str
+        :param filename: location of the original file
+        :type filename: str
+        :param length: size in bytes of the file
+        :type length: int
+
+        """
+        with self.lock:  # Objects are appended one at a time, even if files are copied in parallel
+            self._append(sha, filename, length)
+
+    def _append(self, sha, filename, length):
+        os.makedirs(self.path, exist_ok=True)
+        pack = self._packForAppend(length)
+        with open(os.path.join(self.path, pack), 'ab') as fOut:
+            offset = fOut.seek(0, os.SEEK_END)
+            with open(filename, 'rb') as fIn:
+                try:
+                    self._copyRange(fIn, fOut, length)
+                except:
+                    fOut.truncate(offset)
+                    raise IOError("For some reason file '%s' could not be appended to pack '%s'." % (filename, pack))
+            fOut.flush()
+            os.fsync(fOut.fileno())
+        # Only after the data is safely in the pack, the object is made visible in the index.
+        self._appendIndexLines(["%s %s %d %d" % (sha, pack, offset, length)])
+        self.index[sha] = (pack, offset, length)
+
+    def readChunks(self, sha, chunkSize=2**20):
+        """Iterator over the content of a packed object, in chunks.
+
+        :param sha: the given hash
+        :type sha: str
+
+        """
+        pack, offset, length = self.index[sha]
+        with open(os.path.join(self.path, pack), 'rb') as f:
+            f.seek(offset)
+            remaining = length
+            while remaining > 0:
+                chunk = f.read(min(chunkSize, remaining))
+                if not chunk:
+                    raise IOError("Pack '%s' is truncated, object '%s' is incomplete." % (pack, sha))
+                yield chunk
+                remaining -= len(chunk)
+
+    def extract(self, sha, filename):
+        """Creates a file with the content of a packed object.
+
+        The target file is deleted if anything went wrong.
+
+        :param sha: the given hash
+        :type sha: str
+        :param filename: the filename of the file to be created
+        :type filename: str
+
+        """
+        try:
+            with open(filename, 'wb') as fOut:
+                for chunk in self.readChunks(sha):
+                    fOut.write(chunk)
+        except:
+            try:
+                os.remove(filename)
+            except:
+                pass
+            raise IOError("For some reason object '%s' could not be extracted to '%s'. Target was deleted." % (sha, filename))
+
+    def discard(self, sha):
+        """Removes an object from the index. The room it takes is recovered by :meth:`compact`.
+
+        :param sha: the given hash
+        :type sha: str
+
+        """
+        if sha not in self.index:
+            raise KeyError("Object '%s' is not packed." % sha)
+        self._appendIndexLines(["%s -" % sha])
+        del self.index[sha]
+
+    def discardMany(self, shas):
+        """Removes several objects from the index, with a single write to it.
+
+        :param shas: the given hashes, all of them packed.
+        :type shas: list of str
+
+        """
+        missing = [sha for sha in shas if sha not in self.index]
+        if missing:
+            raise KeyError("Object '%s' is not packed." % missing[0])
+        self._appendIndexLines(["%s -" % sha for sha in shas])
+        for sha in shas:
+            del self.index[sha]
+
+    def deadBytes(self):
+        """Returns dict {pack: bytes} with the room taken in each pack by discarded objects."""
+        live = {pack: 0 for pack in self.packNames()}
+        for pack, _, length in self.index.values():
+            live[pack] = live.get(pack, 0) + length
+        return {pack: os.path.getsize(os.path.join(self.path, pack)) - liveBytes for pack, liveBytes in live.items()}
+
+    def compact(self, minDeadRatio=0.25):
+        """Rewrites the packs in which discarded objects take too much room.
+
+        Live objects in those packs are copied to new packs, then the index is rewritten
+        with a single line per live object, and finally the old packs are deleted. An interruption
+        at any point leaves the store readable, at worst with some orphan pack that the next
+        compaction removes.
+
+        Returns the number of bytes reclaimed.
+
+        :param minDeadRatio: packs are rewritten only if at least this fraction of their size is dead.
+        :type minDeadRatio: float
+        :rtype: int
+
+        """
+        sizes = {pack: os.path.getsize(os.path.join(self.path, pack)) for pack in self.packNames()}
+        dead = self.deadBytes()
+        toRewrite = set(pack for pack, size in sizes.items() if (size == 0) or (dead[pack] >= minDeadRatio * size))
+        if not toRewrite:
+            return 0
+        newIndex = dict()
+        for sha, (pack, offset, length) in sorted(self.index.items(), key=lambda item: item[1]):
+            if pack not in toRewrite:
+                newIndex[sha] = (pack, offset, length)
+                continue
+            newPack = self._packForAppend(length)
+            while newPack in toRewrite:  # Never append to a pack that is about to be deleted
+                newPack = "pack-%06d.pack" % (int(newPack[5:11]) + 1)
+            with open(os.path.join(self.path, pack), 'rb') as fIn, open(os.path.join(self.path, newPack), 'ab') as fOut:
+                newOffset = fOut.seek(0, os.SEEK_END)
+                fIn.seek(offset)
+                self._copyRange(fIn, fOut, length)
+                fOut.flush()
+                os.fsync(fOut.fileno())
+            newIndex[sha] = (newPack, newOffset, length)
+        fnIndex = os.path.join(self.path, self.indexName)
+        with open(fnIndex + '.tmp', 'w') as f:
+            for sha, (pack, offset, length) in sorted(newIndex.items()):
+                print("%s %s %d %d" % (sha, pack, offset, length), file=f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(fnIndex + '.tmp', fnIndex)
+        self._index = newIndex
+        for pack in toRewrite:
+            os.remove(os.path.join(self.path, pack))
+        return sum(sizes.values()) - sum(os.path.getsize(os.path.join(self.path, pack)) for pack in self.packNames())
+
+    def __contains__(self, sha):
+        return sha in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        """Iterator over pairs (hash, size) of the packed objects."""
+        for sha, (_, _, length) in self.index.items():
+            yield sha, length
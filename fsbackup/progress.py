@@ -0,0 +1,141 @@
+#!/usr/bin/python3.6
+
+"""
+.. module:: progress
+    :platform: Windows, linux
+    :synopsis: module for class :class:`ProgressReporter <progress.ProgressReporter>`.
+
+.. moduleauthor:: Miguel Garcia <zeycus@gmail.com>
+"""
+
+
+import sys
+import time
+import datetime
+
+from fsbackup.fileTools import sizeof_fmt
+
+
+class ProgressReporter(object):
+    """Rate-limited report of the progress of a long loop.
+
+    It shows files and bytes done (and their totals, if known), the current throughput
+    and the estimated time left. If the output stream is a terminal, a single status line
+    is refreshed every ``interval`` seconds. Otherwise, for instance when the output is
+    redirected to a log file, a line is logged with level INFO every ``logInterval`` seconds.
+
+    Calling :meth:`update` for every file is cheap: the line is only built when it is shown.
+
+    Usage example:
+
+    .. code-block:: python
+
+        progress = ProgressReporter(logger, 'Hashing', totalFiles=len(fns), totalBytes=sum(sizes))
+        for fn, size in zip(fns, sizes):
+            sha256(fn)
+            progress.update(nbytes=size)
+        progress.close()
+
+    """
+    def __init__(self, logger, description, totalFiles=None, totalBytes=None, interval=0.25, logInterval=30, stream=None):
+        """Constructor.
+
+        :param logger: logger used when the stream is not a terminal.
+        :param description: text that starts every status line.
+        :type description: str
+        :param totalFiles: number of files to be processed, if known.
+        :type totalFiles: int
+        :param totalBytes: number of bytes to be processed, if known.
+        :type totalBytes: int
+        :param interval: seconds between refreshes of the status line, in a terminal.
+        :type interval: float
+        :param logInterval: seconds between logged lines, when the stream is not a terminal.
+        :type logInterval: float
+        :param stream: where the status line is written. By default, ``sys.stderr``.
+
+        """
+        self.logger = logger
+        self.description = description
+        self.totalFiles = totalFiles
+        self.totalBytes = totalBytes
+        self.stream = sys.stderr if stream is None else stream
+        self.isTerminal = hasattr(self.stream, 'isatty') and self.stream.isatty()
+        self.interval = interval if self.isTerminal else logInterval
+        self.files = 0
+        self.bytes = 0
+        self.t0 = time.perf_counter()
+        self.tLast = self.t0
+        self.bytesLast = 0
+        self.rate = 0.0
+        self.lineLength = 0
+
+    def update(self, files=1, nbytes=0):
+        """Records that some more work was done, showing the status if it is time to.
+
+        :param files: number of files just processed.
+        :type files: int
+        :param nbytes: number of bytes just processed.
+        :type nbytes: int
+
+        """
+        self.files += files
+        self.bytes += nbytes
+        now = time.perf_counter()
+        if now - self.tLast >= self.interval:
+            # Throughput is measured since the previous refresh, so that it tells the current speed.
+            self.rate = (self.bytes - self.bytesLast) / (now - self.tLast)
+            self.tLast = now
+            self.bytesLast = self.bytes
+            self._show(self.statusLine(now))
+
+    def eta(self, now):
+        """Returns the estimated seconds left, or ``None`` if it cannot be estimated.
+
+        Bytes are a better estimate than files, so they are used when their total is known.
+
+        :rtype: float
+        """
+        elapsed = now - self.t0
+        if self.totalBytes and self.bytes:
+            return elapsed * (self.totalBytes - self.bytes) / self.bytes
+        if self.totalFiles and self.files:
+            return elapsed * (self.totalFiles - self.files) / self.files
+        return None
+
+    def statusLine(self, now=None):
+        """Returns the text describing the current status.
+
+        :rtype: str
+        """
+        if now is None:
+            now = time.perf_counter()
+        parts = ["%s files" % (self.files if self.totalFiles is None else "%d/%d" % (self.files, self.totalFiles))]
+        if self.totalBytes is None:
+            parts.append(sizeof_fmt(self.bytes))
+        else:
+            parts.append("%s/%s" % (sizeof_fmt(self.bytes), sizeof_fmt(self.totalBytes)))
+        parts.append("%s/s" % sizeof_fmt(self.rate))
+        eta = self.eta(now)
+        if eta is not None:
+            parts.append("ETA %s" % datetime.timedelta(seconds=int(eta)))
+        return "%s: %s" % (self.description, ", ".join(parts))
+
+    def _show(self, line):
+        if self.isTerminal:
+            self.stream.write("\r" + line.ljust(self.lineLength))
+            self.stream.flush()
+            self.lineLength = len(line)
+        else:
+            self.logger.info(line)
+
+    def close(self):
+        """Shows the final status, with the average throughput."""
+        now = time.perf_counter()
+        self.rate = self.bytes / max(now - self.t0, 1e-9)
+        line = "%s: %d files, %s in %s (%s/s)." % (
+            self.description, self.files, sizeof_fmt(self.bytes),
+            datetime.timedelta(seconds=int(now - self.t0)), sizeof_fmt(self.rate))
+        if self.isTerminal:
+            self.stream.write("\r" + " " * self.lineLength + "\r")
+            self.stream.flush()
+        self.logger.info(line)
@@ -0,0 +1,189 @@
+#!/usr/bin/python3.6
+
+"""
+.. module:: reportWriters
+    :platform: Windows, linux
+    :synopsis: module with the writers of the backup-status report files.
+
+.. moduleauthor:: Miguel Garcia <zeycus@gmail.com>
+
+The lists of files in the backup-status report take several GB for catalogues with tens of millions
+of files. Writers receive the rows (filename and size) in batches, as they are read from the DDBB, and
+write them in one of the :data:`REPORT_FORMATS`:
+
+    * ``'txt'``: a line per file with its name and human-readable size, as always.
+    * ``'csv'``: columns ``filename`` and ``size`` in bytes, for downstream analysis.
+    * ``'parquet'``: the same columns, compressed and columnar. Requires the optional package
+      `pyarrow <https://pypi.org/project/pyarrow/>`_.
+
+Text and CSV files can be compressed with gzip (``'txt.gz'``, ``'csv.gz'``) or zstd (``'txt.zst'``, ``'csv.zst'``,
+that requires the package ``zstandard``).
+"""
+
+
+import io
+import csv
+import gzip
+import queue
+import threading
+
+from fsbackup.fileTools import sizeof_fmt
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+REPORT_FORMATS = ('txt', 'txt.gz', 'txt.zst', 'csv', 'csv.gz', 'csv.zst', 'parquet')
+
+
+def openTextStream(filename, compression=None):
+    """Returns a text file open for writing, compressed on the fly if requested.
+
+    :param filename: the file
+    :type filename: str
+    :param compression: ``None``, ``'gz'`` or ``'zst'``
+    :type compression: str
+    """
+    if compression is None:
+        return open(filename, 'w', encoding='utf-8', newline='')
+    if compression == 'gz':
+        return gzip.open(filename, 'wt', encoding='utf-8', newline='', compresslevel=6)
+    if compression == 'zst':
+        if zstandard is None:
+            raise ImportError("Package 'zstandard' is required for zstd-compressed reports.")
+        fOut = open(filename, 'wb')
+        return io.TextIOWrapper(zstandard.ZstdCompressor(level=3).stream_writer(fOut, closefd=True),
+                                encoding='utf-8', newline='')
+    raise ValueError("Compression '%s' not supported." % compression)
+
+
+class TextReportWriter(object):
+    """Writes a line per file, with its name and its human-readable size."""
+    def __init__(self, filename, compression=None):
+        self.f = openTextStream(filename, compression)
+
+    def write(self, rows):
+        """Writes a batch of rows.
+
+        :param rows: pairs (filename, size)
+        :type rows: list
+        """
+        self.f.write("".join("%s (%s)\n" % (fn, sizeof_fmt(size)) for fn, size in rows))
+
+    def close(self):
+        self.f.close()
+
+
+class CsvReportWriter(object):
+    """Writes a CSV file with columns ``filename`` and ``size`` (in bytes)."""
+    def __init__(self, filename, compression=None):
+        self.f = openTextStream(filename, compression)
+        self.writer = csv.writer(self.f, lineterminator='\n')
+        self.writer.writerow(('filename', 'size'))
+
+    def write(self, rows):
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.f.close()
+
+
+class ParquetReportWriter(object):
+    """Writes a Parquet file with columns ``filename`` and ``size`` (in bytes). Each batch is a row group."""
+    def __init__(self, filename):
+        if pyarrow is None:
+            raise ImportError("Package 'pyarrow' is required for Parquet reports.")
+        self.schema = pyarrow.schema([('filename', pyarrow.string()), ('size', pyarrow.int64())])
+        self.writer = pyarrow.parquet.ParquetWriter(filename, self.schema, compression='zstd')
+
+    def write(self, rows):
+        fns, sizes = zip(*rows) if rows else ((), ())
+        self.writer.write_table(pyarrow.Table.from_arrays(
+            [pyarrow.array(fns, pyarrow.string()), pyarrow.array(sizes, pyarrow.int64())], schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+def createReportWriter(fnBase, reportFormat='txt'):
+    """Returns the writer for a report file. Its name is fnBase followed by the format as extension.
+
+    :param fnBase: filename of the report, without extension
+    :type fnBase: str
+    :param reportFormat: one of :data:`REPORT_FORMATS`
+    :type reportFormat: str
+    """
+    if reportFormat not in REPORT_FORMATS:
+        raise ValueError("Report format '%s' not supported." % reportFormat)
+    filename = "%s.%s" % (fnBase, reportFormat)
+    kind, _, compression = reportFormat.partition('.')
+    if kind == 'parquet':
+        return ParquetReportWriter(filename)
+    if kind == 'csv':
+        return CsvReportWriter(filename, compression or None)
+    return TextReportWriter(filename, compression or None)
+
+
+class BackgroundWriter(object):
+    """Wraps a report writer, so that batches are written (and compressed) by a background thread.
+
+    With a background writer per file, all the report files are written at the same time. The queue
+    is bounded, so memory does not grow if writing is slower than reading the DDBB. Errors are raised
+    by the next call to :meth:`write`, or by :meth:`close`. They are sticky: once a batch fails, the later
+    ones are discarded, and every call raises the error, so the file never has holes in the middle.
+
+    """
+    def __init__(self, writer, maxPending=16):
+        """Constructor.
+
+        :param writer: the writer that actually writes the rows.
+        :param maxPending: maximum number of batches in the queue.
+        :type maxPending: int
+
+        """
+        self.writer = writer
+        self.queue = queue.Queue(maxsize=maxPending)
+        self.error = None
+        self.thread = threading.Thread(target=self._worker, daemon=True)
+        self.thread.start()
+
+    def _worker(self):
+        while True:
+            rows = self.queue.get()
+            if rows is None:
+                return
+            if self.error is None:
+                try:
+                    self.writer.write(rows)
+                except Exception as exc:
+                    self.error = exc  # Raised in the main thread. Later batches are discarded.
+
+    def _checkError(self):
+        if self.error is not None:
+            raise self.error
+
+    def write(self, rows):
+        self._checkError()
+        self.queue.put(rows)
+
+    def close(self):
+        """Writes the pending batches, and closes the file. After an error, the pending batches are discarded."""
+        if self.thread.is_alive():
+            if self.error is not None:
+                try:
+                    while True:
+                        self.queue.get_nowait()
+                except queue.Empty:
+                    pass
+            self.queue.put(None)
+            self.thread.join()
+        self.writer.close()
+        self._checkError()
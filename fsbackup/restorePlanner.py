@@ -0,0 +1,195 @@
+#!/usr/bin/python3.6
+
+"""
+.. module:: restorePlanner
+    :platform: Windows, linux
+    :synopsis: module for classes :class:`RestorePlanner <restorePlanner.RestorePlanner>` and :class:`RestoreState <restorePlanner.RestoreState>`.
+
+.. moduleauthor:: Miguel Garcia <zeycus@gmail.com>
+
+Restoring a folder usually needs several volumes. The planner tells which of them, and in which order
+they should be inserted, from the DDBB alone. The restore state, kept next to the destination folder, allows
+restoring with one drive after another: each of them restores only the files still missing.
+"""
+
+
+import os
+import json
+from collections import defaultdict
+
+from fsbackup.fileTools import sizeof_fmt
+
+
+class RestoreState(object):
+    """Files already restored into a destination folder.
+
+    They are kept in a text file with a filename (as in the DDBB) per line, JSON-encoded. By default it is
+    next to the destination folder, not inside it, so that it does not mix with the files restored.
+    It is only appended to, right after each file is restored, so that an interrupted restore loses at
+    most the file being copied.
+
+    """
+    stateSuffix = '.fsbackup_restore_state.txt'
+
+    def __init__(self, destPath, filename=None):
+        """Constructor.
+
+        :param destPath: the destination folder of the restore.
+        :type destPath: str
+        :param filename: file where the state is kept. By default, the destination folder name plus :attr:`stateSuffix`.
+        :type filename: str
+
+        """
+        if filename is None:
+            filename = os.path.normpath(os.path.abspath(destPath)) + self.stateSuffix
+        self.filename = filename
+        self.restored = set()
+        self._file = None
+        try:
+            with open(self.filename, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        self.restored.add(json.loads(line))
+                    except ValueError:  # Last line half-written
+                        pass
+        except FileNotFoundError:
+            pass
+
+    def __contains__(self, fn):
+        return fn in self.restored
+
+    def __len__(self):
+        return len(self.restored)
+
+    def record(self, fn):
+        """Records that a file was restored.
+
+        :param fn: filename, relative to the mountPoint.
+        :type fn: str
+
+        """
+        if self._file is None:
+            os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+            self._file = open(self.filename, 'a', encoding='utf-8')
+        print(json.dumps(fn), file=self._file)
+        self._file.flush()
+        self.restored.add(fn)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def remove(self):
+        """Deletes the state file, once the restore is complete."""
+        self.close()
+        if os.path.isfile(self.filename):
+            os.remove(self.filename)
+        self.restored = set()
+
+
+class RestorePlanner(object):
+    """Works out which volumes are needed to restore some files, and the order in which to insert them.
+
+    Choosing the fewest volumes that contain all the hashes is a set cover problem. It is solved
+    greedily: the next volume is always the one that provides most of the hashes still missing
+    (with ties broken by bytes). In practice that is optimal or very close, and the first drives
+    inserted restore most of the content.
+
+    """
+    def __init__(self, logger, fDB, volContainer, sourcePath=None, filters=None, state=None, batchSize=1000):
+        """Constructor.
+
+        :param logger: internally stored logger, for feedback.
+        :type logger: logging.Logger
+        :param fDB: filesystem information in DDBB.
+        :type fDB: FileDB
+        :param volContainer: the volumes information in DDBB.
+        :type volContainer: MongoShelve or SqliteShelve
+        :param sourcePath: path in the filesystem that is to be restored. If ``None``, the whole filesystem.
+        :type sourcePath: str
+        :param filters: if provided, only files that match them, see :meth:`FileDB.buildQuery <fsbackup.fileDB.FileDB.buildQuery>`.
+        :type filters: dict
+        :param state: if provided, files already restored are not considered.
+        :type state: RestoreState
+        :param batchSize: number of hashes looked up in each query to the volumes information.
+        :type batchSize: int
+
+        """
+        self.logger = logger
+        self.fDB = fDB
+        self.volContainer = volContainer
+        self.sourcePath = sourcePath
+        self.filters = filters or dict()
+        self.state = state
+        self.batchSize = batchSize
+
+    def pendingFiles(self):
+        """Returns the files to restore, as a dict {hash: [(fn, size)]}.
+
+        :rtype: dict
+        """
+        pending = defaultdict(list)
+        query = self.fDB.buildQuery(sourcePath=self.sourcePath, **self.filters)
+        for fn, info in self.fDB.findFiles(query):
+            if (self.state is None) or (fn not in self.state):
+                pending[info['hash']].append((fn, info['size']))
+        return pending
+
+    def volumesOfHashes(self, shas):
+        """Returns the volumes that contain each hash, as a dict {hash: set of volIds}.
+
+        Hashes in no volume are absent.
+
+        :param shas: the hashes
+        :type shas: iterable of str
+        :rtype: dict
+        """
+        volumes = defaultdict(set)
+        shas = sorted(shas)
+        for pos in range(0, len(shas), self.batchSize):
+            batch = shas[pos:pos + self.batchSize]
+            for doc in self.volContainer.find({'hash': {'$in': batch}}, ['hash', 'volume']):
+                volumes[doc['hash']].add(doc['volume'])
+        return volumes
+
+    def plan(self):
+        """Returns the volumes to insert, in order, and the files that cannot be restored.
+
+        Each step is a dict with keys ``volume``, ``files`` (number of files restored from it) and ``size`` (their bytes).
+
+        :rtype: pair (list of dict, list of str)
+        """
+        pending = self.pendingFiles()
+        volumesOf = self.volumesOfHashes(pending)
+        unavailable = sorted(fn for sha, fns in pending.items() if sha not in volumesOf for fn, _ in fns)
+        hashesOf = defaultdict(set)
+        for sha, vols in volumesOf.items():
+            for vol in vols:
+                hashesOf[vol].add(sha)
+        shaBytes = {sha: sum(size for _, size in pending[sha]) for sha in volumesOf}
+        missing = set(volumesOf)
+        steps = []
+        while missing:
+            vol = max(sorted(hashesOf), key=lambda v: (len(hashesOf[v] & missing), sum(shaBytes[sha] for sha in hashesOf[v] & missing)))
+            provided = hashesOf.pop(vol) & missing
+            missing -= provided
+            steps.append(dict(
+                volume=vol,
+                files=sum(len(pending[sha]) for sha in provided),
+                size=sum(shaBytes[sha] for sha in provided),
+            ))
+        return steps, unavailable
+
+    def logPlan(self, steps, unavailable):
+        """Sends the plan to the logger, with level INFO."""
+        if steps:
+            self.logger.info("Insert the volumes in this order:")
+            for pos, step in enumerate(steps, 1):
+                self.logger.info("%3d. Volume '%s': %d files, %s." % (pos, step['volume'], step['files'], sizeof_fmt(step['size'])))
+        else:
+            self.logger.info("No volume is needed.")
+        if unavailable:
+            self.logger.warning("%d files are in no volume, they cannot be restored:" % len(unavailable))
+            for fn in unavailable:
+                self.logger.warning("  %s" % fn)
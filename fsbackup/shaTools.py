@@ -11,15 +11,19 @@
 
 import hashlib
 
+from fsbackup.ioHints import sequentialFile, READ_CHUNK
+
 
 def sha256(filename):
     """Returns the SHA-256 of a given file.
 
+    The file is read sequentially in big chunks, and its pages dropped from the cache afterwards (see :mod:`ioHints <fsbackup.ioHints>`).
+
     :rtype: str
 
     """
     hash_sha256 = hashlib.sha256()
-    with open(filename, 'rb') as f:
-        for chunk in iter(lambda: f.read(4096), b''):
+    with sequentialFile(filename) as f:
+        for chunk in iter(lambda: f.read(READ_CHUNK), b''):
             hash_sha256.update(chunk)
     return hash_sha256.hexdigest()
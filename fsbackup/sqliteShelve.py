@@ -0,0 +1,443 @@
+#!/usr/bin/python3.6
+
+"""
+.. module:: sqliteShelve
+    :platform: Windows, linux
+    :synopsis: module for the embedded SQLite catalogue: classes :class:`SqliteDatabase <sqliteShelve.SqliteDatabase>`,
+               :class:`SqliteCollection <sqliteShelve.SqliteCollection>` and :class:`SqliteShelve <sqliteShelve.SqliteShelve>`.
+
+.. moduleauthor:: Miguel Garcia <zeycus@gmail.com>
+
+The catalogue can be kept in a local SQLite file instead of a mongoDB database. Each collection is a table
+in which every document is stored as JSON, and indexes are built on the JSON fields. Only the small subset of
+mongoDB operations and query operators that fsbackup uses is supported:
+
+    * equality, and the operators ``$in``, ``$nin``, ``$ne``, ``$gt``, ``$gte``, ``$lt``, ``$lte``, ``$regex`` and ``$exists``.
+    * update documents with ``$set``.
+
+"""
+
+
+import os
+import re
+import sys
+import json
+import sqlite3
+import threading
+from collections import namedtuple
+
+
+DeleteResult = namedtuple('DeleteResult', ['deleted_count'])
+InsertManyResult = namedtuple('InsertManyResult', ['inserted_count'])
+
+
+def _regexp(pattern, value):
+    return (value is not None) and (re.search(pattern, value) is not None)
+
+
+def _fieldExpr(field):
+    """Returns the SQL expression that extracts a field from the JSON document."""
+    if not re.match(r"^\w+$", field):
+        raise ValueError("Field name '%s' not supported." % field)
+    return "json_extract(doc, '$.%s')" % field
+
+
+def translateFilter(filt):
+    """Translates a mongoDB-style filter into a SQL condition.
+
+    :param filt: the filter, for instance ``{'volume': '3EC0BECC', 'size': {'$gt': 1024}}``
+    :type filt: dict
+    :rtype: pair (condition, list of parameters)
+
+    """
+    clauses = []
+    params = []
+    for field, cond in sorted((filt or {}).items()):
+        expr = _fieldExpr(field)
+        if not isinstance(cond, dict):
+            cond = {'$eq': cond}
+        for op, val in sorted(cond.items()):
+            if (op == '$eq') and (val is None):
+                clauses.append("%s IS NULL" % expr)
+            elif op in ('$eq', '$gt', '$gte', '$lt', '$lte'):
+                clauses.append("%s %s ?" % (expr, {'$eq': '=', '$gt': '>', '$gte': '>=', '$lt': '<', '$lte': '<='}[op]))
+                params.append(val)
+            elif op == '$ne':
+                clauses.append("(%s IS NULL OR %s != ?)" % (expr, expr))
+                params.append(val)
+            elif op == '$in':
+                clauses.append("%s IN (SELECT value FROM json_each(?))" % expr)
+                params.append(json.dumps(list(val)))
+            elif op == '$nin':
+                clauses.append("(%s IS NULL OR %s NOT IN (SELECT value FROM json_each(?)))" % (expr, expr))
+                params.append(json.dumps(list(val)))
+            elif op == '$regex':
+                clauses.append("%s REGEXP ?" % expr)
+                params.append(val)
+            elif op == '$exists':
+                clauses.append("%s IS %sNULL" % (expr, "NOT " if val else ""))
+            else:
+                raise ValueError("Query operator '%s' not supported by the SQLite backend." % op)
+    return (" AND ".join(clauses) or "1"), params
+
+
+class SqliteDatabase(object):
+    """A SQLite file acting as a database, whose tables are :class:`SqliteCollection` instances.
+
+    The file is opened in WAL mode, so readers are not blocked by the writer.
+
+    """
+    def __init__(self, filename):
+        """Constructor.
+
+        :param filename: location of the SQLite file. It is created if it does not exist.
+        :type filename: str
+
+        """
+        self.filename = filename
+        self.name = os.path.splitext(os.path.basename(filename))[0]
+        self.lock = threading.RLock()
+        self.roundTrips = 0  # Number of statements executed, for benchmarking
+        self.conn = sqlite3.connect(filename, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        if sys.version_info >= (3, 8):  # Deterministic functions can be used in indexes and optimised
+            self.conn.create_function("REGEXP", 2, _regexp, deterministic=True)
+        else:
+            self.conn.create_function("REGEXP", 2, _regexp)
+        self.collections = dict()
+
+    def execute(self, sql, params=()):
+        """Executes a statement, returning all the rows it produced."""
+        with self.lock:
+            self.roundTrips += 1
+            return self.conn.execute(sql, params).fetchall()
+
+    def executeChanges(self, sql, params=()):
+        """Executes a statement, returning the number of rows it modified."""
+        with self.lock:
+            self.roundTrips += 1
+            return self.conn.execute(sql, params).rowcount
+
+    def executemany(self, sql, seqParams):
+        """Executes a statement for each set of parameters, in a single transaction. Returns the number of rows changed."""
+        with self.lock:
+            self.roundTrips += 1
+            self.conn.execute("BEGIN")
+            try:
+                cursor = self.conn.executemany(sql, seqParams)
+                self.conn.execute("COMMIT")
+            except:
+                self.conn.execute("ROLLBACK")
+                raise
+            return cursor.rowcount
+
+    def __getitem__(self, name):
+        if name not in self.collections:
+            self.collections[name] = SqliteCollection(self, name)
+        return self.collections[name]
+
+    def collectionNames(self):
+        """Returns the names of the existing collections."""
+        return [row[0] for row in self.execute("SELECT name FROM sqlite_master WHERE type='table'")]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def drop(self):
+        """Deletes the database file."""
+        self.close()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.isfile(self.filename + suffix):
+                os.remove(self.filename + suffix)
+
+
+class SqliteCollection(object):
+    """A SQLite table that stores JSON documents, with a subset of the interface of a mongoDB collection."""
+
+    pageSize = 1000  # Documents fetched in each query while iterating
+
+    def __init__(self, database, name):
+        """Constructor.
+
+        :param database: the database that contains the collection
+        :type database: SqliteDatabase
+        :param name: name of the collection
+        :type name: str
+
+        """
+        if not re.match(r"^\w+$", name):
+            raise ValueError("Collection name '%s' not supported." % name)
+        self.database = database
+        self.name = name
+        self.database.execute('CREATE TABLE IF NOT EXISTS "%s" (_id INTEGER PRIMARY KEY, doc TEXT NOT NULL)' % name)
+
+    def create_index(self, keys, unique=False):
+        """Creates an index on the given fields.
+
+        :param keys: list of pairs (field, direction), like in pymongo.
+        :param unique: flag that tells whether values must be unique.
+        :type unique: bool
+
+        """
+        fields = [field for field, _ in keys]
+        self.database.execute('CREATE %sINDEX IF NOT EXISTS "%s_%s" ON "%s" (%s)' % (
+            "UNIQUE " if unique else "", self.name, "_".join(fields), self.name,
+            ", ".join(_fieldExpr(field) for field in fields)))
+
+    def find(self, filter=None, projection=None, sort=None):
+        """Iterator over the documents that match the filter.
+
+        Documents are fetched in pages, so no statement is left open while the caller
+        processes them: it is safe to modify the collection while iterating.
+
+        :param filter: mongoDB-style filter
+        :type filter: dict
+        :param projection: if provided, only these fields are returned.
+        :type projection: list or dict
+        :param sort: list of pairs (field, direction), like in pymongo. Sort on indexed fields,
+               otherwise each page requires a full sort.
+        :type sort: list
+
+        """
+        cond, params = translateFilter(filter)
+        sortExprs = [(_fieldExpr(field), "DESC" if direction < 0 else "ASC") for field, direction in (sort or [])]
+        sortExprs.append(("_id", "ASC"))
+        orderBy = ", ".join("%s %s" % exprDir for exprDir in sortExprs)
+        exprs = ", ".join(expr for expr, _ in sortExprs)
+        lastKey = None
+        while True:
+            if lastKey is None:
+                pageCond, pageParams = cond, params
+            else:  # Keyset pagination: documents after the last one returned
+                afterCond, afterParams = self._afterCondition(sortExprs, lastKey)
+                pageCond = "(%s) AND (%s)" % (cond, afterCond)
+                pageParams = params + afterParams
+            rows = self.database.execute('SELECT doc, %s FROM "%s" WHERE %s ORDER BY %s LIMIT %d' % (
+                exprs, self.name, pageCond, orderBy, self.pageSize), pageParams)
+            for row in rows:
+                doc = json.loads(row[0])
+                if projection is not None:
+                    doc = {field: doc[field] for field in projection if field in doc}
+                yield doc
+            if len(rows) < self.pageSize:
+                return
+            lastKey = rows[-1][1:]
+
+    @staticmethod
+    def _afterCondition(sortExprs, lastKey):
+        """SQL condition (and its parameters) for rows strictly after a given key, in the sort order.
+
+        NULLs come first in ascending order, and last in descending order, as in SQLite.
+        """
+        clauses = []
+        params = []
+        for i, (expr, direction) in enumerate(sortExprs):
+            parts = ["%s IS ?" % e for e, _ in sortExprs[:i]]
+            params.extend(lastKey[:i])
+            if direction == 'ASC':
+                parts.append("((? IS NULL AND %s IS NOT NULL) OR %s > ?)" % (expr, expr))
+            else:
+                parts.append("((%s IS NULL AND ? IS NOT NULL) OR %s < ?)" % (expr, expr))
+            params.extend([lastKey[i], lastKey[i]])
+            clauses.append("(%s)" % " AND ".join(parts))
+        return " OR ".join(clauses), params
+
+    def find_one(self, filter=None):
+        cond, params = translateFilter(filter)
+        rows = self.database.execute('SELECT doc FROM "%s" WHERE %s LIMIT 1' % (self.name, cond), params)
+        return json.loads(rows[0][0]) if rows else None
+
+    def count(self, filter=None):
+        cond, params = translateFilter(filter)
+        return self.database.execute('SELECT COUNT(*) FROM "%s" WHERE %s' % (self.name, cond), params)[0][0]
+
+    def count_documents(self, filter):
+        return self.count(filter)
+
+    def insert_one(self, doc):
+        self.database.execute('INSERT INTO "%s" (doc) VALUES (?)' % self.name, (json.dumps(doc),))
+
+    def insert_many(self, docs, ordered=True):
+        """Inserts the documents in a single transaction."""
+        nbInserted = self.database.executemany('INSERT INTO "%s" (doc) VALUES (?)' % self.name,
+                                               ((json.dumps(doc),) for doc in docs))
+        return InsertManyResult(nbInserted)
+
+    def insert(self, docs):
+        """Equivalent to the deprecated pymongo insert, for a list of documents."""
+        return self.insert_many(docs)
+
+    def update_one(self, filter, update, upsert=False):
+        """Updates the first document that matches the filter. Only ``$set`` is supported."""
+        if set(update) != {'$set'}:
+            raise ValueError("Only '$set' updates are supported by the SQLite backend.")
+        cond, params = translateFilter(filter)
+        with self.database.lock:
+            rows = self.database.execute('SELECT _id, doc FROM "%s" WHERE %s LIMIT 1' % (self.name, cond), params)
+            if rows:
+                doc = json.loads(rows[0][1])
+                doc.update(update['$set'])
+                self.database.execute('UPDATE "%s" SET doc = ? WHERE _id = ?' % self.name, (json.dumps(doc), rows[0][0]))
+            elif upsert:
+                doc = {field: val for field, val in filter.items() if not isinstance(val, dict)}
+                doc.update(update['$set'])
+                self.insert_one(doc)
+
+    def delete_one(self, filter):
+        cond, params = translateFilter(filter)
+        return DeleteResult(self.database.executeChanges(
+            'DELETE FROM "%s" WHERE _id IN (SELECT _id FROM "%s" WHERE %s LIMIT 1)' % (self.name, self.name, cond), params))
+
+    def delete_many(self, filter):
+        cond, params = translateFilter(filter)
+        return DeleteResult(self.database.executeChanges('DELETE FROM "%s" WHERE %s' % (self.name, cond), params))
+
+    def drop(self):
+        self.database.execute('DROP TABLE IF EXISTS "%s"' % self.name)
+        self.database.collections.pop(self.name, None)
+
+
+class SqliteShelve(object):
+    """Wrapper to use a :class:`SqliteCollection` as a permanent dict.
+
+    It has the same interface as :class:`mongo_shelve.Mongo_shelve`, plus the bulk operations
+    of :class:`MongoShelve <fsbackup.mongoShelve.MongoShelve>`.
+
+    """
+    def __init__(self, col, keyField):
+        """Constructor
+
+        :param col: the collection that stores the information
+        :type col: SqliteCollection
+        :param keyField: the name of the field used for look-up
+        :type keyField: str
+        """
+        self.col = col
+        self.keyField = keyField
+
+    def __getitem__(self, key):
+        output = self.col.find_one({self.keyField: key})
+        if output is None:
+            raise KeyError("Key '%s' not found in SQLite database." % key)
+        del output[self.keyField]
+        return output
+
+    def __setitem__(self, key, value):
+        self.col.update_one({self.keyField: key}, {"$set": value}, upsert=True)
+
+    def __delitem__(self, key):
+        if self.col.delete_one({self.keyField: key}).deleted_count != 1:
+            raise KeyError("No document with key '%s' could be deleted." % key)
+
+    def __contains__(self, key):
+        return self.col.find_one({self.keyField: key}) is not None
+
+    def __len__(self):
+        return self.col.count()
+
+    def __iter__(self):
+        yield from self.keys()
+
+    def __repr__(self):
+        return "<%s.%s (%s)>" % (self.col.database.name, self.col.name, self.keyField)
+
+    def keys(self):
+        for data in self.col.find():
+            yield data[self.keyField]
+
+    def items(self):
+        for data in self.col.find():
+            key = data.pop(self.keyField)
+            yield (key, data)
+
+    def values(self):
+        for _, data in self.items():
+            yield data
+
+    def clear(self):
+        self.col.delete_many({})
+
+    def delete_many(self, *args, **kwargs):
+        return self.col.delete_many(*args, **kwargs)
+
+    def insert(self, *args, **kwargs):
+        return self.col.insert(*args, **kwargs)
+
+    def find(self, *args, **kwargs):
+        return self.col.find(*args, **kwargs)
+
+    def applyBatch(self, ops):
+        """Applies a list of operations in a single transaction.
+
+        :param ops: operations, either ``('set', key, value)`` or ``('del', key)``.
+               Deleting an absent key is not an error.
+        :type ops: list of tuple
+
+        """
+        db = self.col.database
+        with db.lock:
+            db.execute("BEGIN")
+            try:
+                for op in ops:
+                    if op[0] == 'set':
+                        self[op[1]] = op[2]
+                    else:
+                        self.col.delete_one({self.keyField: op[1]})
+                db.execute("COMMIT")
+            except:
+                db.execute("ROLLBACK")
+                raise
+
+    def replaceWhere(self, selector, docs, batchSize=10000):
+        """Replaces all the documents matching the selector with the given documents.
+
+        Everything happens in a single transaction, so other readers see either the old or
+        the new documents. Returns the pair (number of documents inserted, number removed).
+
+        If a new document has the key of an existing one that does not match the selector, a ``ValueError``
+        is raised and nothing is modified, as :class:`MongoShelve <fsbackup.mongoShelve.MongoShelve>` does.
+
+        :param selector: mongoDB-style filter of the documents to replace
+        :type selector: dict
+        :param docs: iterable of the new documents
+        :param batchSize: number of documents sent to SQLite at once
+        :type batchSize: int
+        :rtype: pair of int
+
+        """
+        db = self.col.database
+        cond, params = translateFilter(selector)
+        with db.lock:
+            db.execute("BEGIN")
+            try:
+                nbRemoved = db.executeChanges('DELETE FROM "%s" WHERE %s' % (self.col.name, cond), params)
+                nbInserted = 0
+                batch = []
+                for doc in docs:
+                    batch.append(doc)
+                    if len(batch) >= batchSize:
+                        self._insertBatch(batch)
+                        nbInserted += len(batch)
+                        batch = []
+                if batch:
+                    self._insertBatch(batch)
+                    nbInserted += len(batch)
+                db.execute("COMMIT")
+            except:
+                db.execute("ROLLBACK")
+                raise
+        return nbInserted, nbRemoved
+
+    def _insertBatch(self, batch):
+        """Inserts a batch of documents, once checked that their keys are not taken. The lock must be held."""
+        db = self.col.database
+        keyExpr = _fieldExpr(self.keyField)
+        taken = db.execute('SELECT doc FROM "%s" WHERE %s IN (SELECT value FROM json_each(?)) LIMIT 1' % (
+            self.col.name, keyExpr), (json.dumps([doc[self.keyField] for doc in batch]),))
+        if taken:
+            doc = json.loads(taken[0][0])
+            raise ValueError("Key '%s' already belongs to a document not being replaced: %s" % (doc[self.keyField], doc))
+        db.conn.executemany('INSERT INTO "%s" (doc) VALUES (?)' % self.col.name, [(json.dumps(doc),) for doc in batch])
+        db.roundTrips += 1
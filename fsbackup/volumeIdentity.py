@@ -0,0 +1,99 @@
+#!/usr/bin/python3.6
+
+"""
+.. module:: volumeIdentity
+    :platform: Windows, linux
+    :synopsis: module for class :class:`VolumeIdentity <volumeIdentity.VolumeIdentity>`.
+
+.. moduleauthor:: Miguel Garcia <zeycus@gmail.com>
+"""
+
+
+import os
+import json
+import time
+import uuid
+import shutil
+
+
+LAYOUT_VERSION = 1  # Hash folders, pack files, zstd objects and the manifest
+HASH_ALGORITHM = 'sha256'
+
+
+class VolumeIdentity(object):
+    """Class that handles the identity file kept at the root of a backup volume.
+
+    The file :file:`fsbackup_volume.json` tells the volume id, so that it does not depend on the OS nor on the
+    hardware: the volume can be moved to another drive, machine or OS. It is a JSON object with the keys:
+
+        * ``volumeId``: the volume id. A random UUID for new volumes, the id they had for older ones.
+        * ``created``: creation time of the file, in seconds since the epoch.
+        * ``hashAlgorithm``: the hash objects are stored under. Only ``'sha256'`` is supported.
+        * ``layoutVersion``: version of the layout of the volume. Volumes with a newer one are refused.
+        * ``capacity``: dict with the ``total``, ``used`` and ``free`` bytes of the drive, and the ``time``
+          they were taken, refreshed after the volume is updated or cleaned.
+
+    """
+    fileName = 'fsbackup_volume.json'
+
+    def __init__(self, locationPath):
+        """Constructor. The identity file is read, if it exists.
+
+        :param locationPath: root path of the volume.
+        :type locationPath: str
+
+        """
+        self.filename = os.path.join(locationPath, self.fileName)
+        self.locationPath = locationPath
+        try:
+            with open(self.filename) as f:
+                self.info = json.load(f)
+        except FileNotFoundError:
+            self.info = None
+        if self.info is not None:
+            if self.info.get('hashAlgorithm') != HASH_ALGORITHM:
+                raise ValueError("Volume '%s' uses hash algorithm '%s', not supported." %
+                                 (locationPath, self.info.get('hashAlgorithm')))
+            if self.info.get('layoutVersion', 0) > LAYOUT_VERSION:
+                raise ValueError("Volume '%s' has layout version %s, this release supports up to %s." %
+                                 (locationPath, self.info.get('layoutVersion'), LAYOUT_VERSION))
+
+    def exists(self):
+        """Returns whether the volume has an identity file.
+
+        :rtype: bool
+        """
+        return self.info is not None
+
+    @property
+    def volId(self):
+        """The volume id, or ``None`` if the volume has no identity file."""
+        return None if self.info is None else self.info['volumeId']
+
+    def create(self, volId=None):
+        """Creates the identity file.
+
+        :param volId: the volume id. If ``None``, a random UUID is used.
+        :type volId: str
+
+        """
+        self.info = dict(
+            volumeId=uuid.uuid4().hex if volId is None else volId,
+            created=time.time(),
+            hashAlgorithm=HASH_ALGORITHM,
+            layoutVersion=LAYOUT_VERSION,
+        )
+        self.refreshCapacity()
+
+    def refreshCapacity(self):
+        """Updates the capacity stats of the drive in the identity file, that must exist."""
+        usage = shutil.disk_usage(self.locationPath)
+        self.info['capacity'] = dict(total=usage.total, used=usage.used, free=usage.free, time=time.time())
+        self._write()
+
+    def _write(self):
+        """Writes the identity file, replacing it only once completely written."""
+        fnTemp = self.filename + '.tmp'
+        with open(fnTemp, 'w') as f:
+            json.dump(self.info, f, indent=4, sort_keys=True)
+        os.replace(fnTemp, self.filename)
@@ -0,0 +1,182 @@
+#!/usr/bin/python3.6
+
+"""
+.. module:: volumeManifest
+    :platform: Windows, linux
+    :synopsis: module for class :class:`VolumeManifest <volumeManifest.VolumeManifest>`.
+
+.. moduleauthor:: Miguel Garcia <zeycus@gmail.com>
+"""
+
+
+import os
+import time
+
+
+class VolumeManifest(object):
+    """Class that handles the manifest kept at the root of a backup volume.
+
+    The manifest tells which objects are stored in the volume, with their size, stored size and
+    the time they were written. It allows rebuilding the DDBB information of the volume without
+    traversing it. It is made of two files:
+
+        * :file:`fsbackup_manifest.txt`, the snapshot, with a line ``<sha> <size> <storedSize> <time>`` per object.
+        * :file:`fsbackup_manifest.log`, the journal, where a line ``+ <sha> <size> <storedSize> <time>`` is
+          appended when an object is stored, and ``- <sha>`` when it is removed.
+
+    When the journal grows over ``journalLimit`` lines, it is merged into the snapshot.
+    Replaying the journal is idempotent, so an interrupted compaction does no harm.
+
+    The manifest is complete only when the snapshot exists: volumes created before the manifest
+    was introduced get one the first time their information is rebuilt by traversing them.
+
+    """
+    snapshotName = 'fsbackup_manifest.txt'
+    journalName = 'fsbackup_manifest.log'
+
+    def __init__(self, locationPath, journalLimit=100000):
+        """Constructor.
+
+        :param locationPath: root path of the volume.
+        :type locationPath: str
+        :param journalLimit: number of journal lines that triggers a compaction.
+        :type journalLimit: int
+
+        """
+        self.fnSnapshot = os.path.join(locationPath, self.snapshotName)
+        self.fnJournal = os.path.join(locationPath, self.journalName)
+        self.journalLimit = journalLimit
+        self._journalLines = None  # Counted the first time it is needed
+
+    def isComplete(self):
+        """Returns whether the manifest describes the whole volume.
+
+        :rtype: bool
+        """
+        return os.path.isfile(self.fnSnapshot)
+
+    def initialize(self):
+        """Creates an empty snapshot, to be used for volumes that contain no objects yet."""
+        with open(self.fnSnapshot, 'w'):
+            pass
+
+    def _appendJournal(self, *lines):
+        if self._journalLines is None:
+            self._journalLines = sum(1 for _ in self._genJournal())
+        with open(self.fnJournal, 'a') as f:
+            for line in lines:
+                print(line, file=f)
+        self._journalLines += len(lines)
+        if self.isComplete() and (self._journalLines > self.journalLimit):
+            self.compact()
+
+    def add(self, sha, size, storedSize):
+        """Records that an object was stored in the volume.
+
+        :param sha: hash of the object
+        :type sha: str
+        :param size: size in bytes of the original file
+        :type size: int
+        :param storedSize: room the object takes in the volume, in bytes
+        :type storedSize: int
+
+        """
+        self._appendJournal("+ %s %d %d %d" % (sha, size, storedSize, time.time()))
+
+    def discard(self, sha):
+        """Records that an object was removed from the volume.
+
+        :param sha: hash of the object
+        :type sha: str
+
+        """
+        self._appendJournal("- %s" % sha)
+
+    def discardMany(self, shas):
+        """Records that several objects were removed from the volume.
+
+        :param shas: hashes of the objects
+        :type shas: list of str
+
+        """
+        if shas:
+            self._appendJournal(*["- %s" % sha for sha in shas])
+
+    def _genJournal(self):
+        """Iterator over the well-formed journal lines, already split."""
+        if os.path.isfile(self.fnJournal):
+            with open(self.fnJournal) as f:
+                for line in f:
+                    parts = line.split()
+                    if ((len(parts) == 5) and (parts[0] == '+')) or ((len(parts) == 2) and (parts[0] == '-')):
+                        yield parts
+                    # Anything else is a line truncated by an interrupted write: it is ignored.
+
+    def _journalChanges(self):
+        """Returns dict {sha: entry or None} with the last change in the journal for each hash.
+
+        ``None`` means the object was removed.
+        """
+        changes = dict()
+        for parts in self._genJournal():
+            if parts[0] == '+':
+                changes[parts[1]] = (parts[1], int(parts[2]), int(parts[3]), int(parts[4]))
+            else:
+                changes[parts[1]] = None
+        return changes
+
+    def entries(self):
+        """Iterator over quadruplets (sha, size, storedSize, time) for the objects in the volume.
+
+        The snapshot is streamed, only the journal is held in memory.
+        """
+        changes = self._journalChanges()
+        if os.path.isfile(self.fnSnapshot):
+            with open(self.fnSnapshot) as f:
+                for line in f:
+                    parts = line.split()
+                    if (len(parts) == 4) and (parts[0] not in changes):
+                        yield (parts[0], int(parts[1]), int(parts[2]), int(parts[3]))
+        for entry in changes.values():
+            if entry is not None:
+                yield entry
+
+    def _writeSnapshot(self, entries):
+        """Writes a new snapshot with the given entries and empties the journal. Returns the number of entries."""
+        nbEntries = 0
+        with open(self.fnSnapshot + '.tmp', 'w') as f:
+            for entry in entries:
+                print("%s %d %d %d" % entry, file=f)
+                nbEntries += 1
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.fnSnapshot + '.tmp', self.fnSnapshot)
+        if os.path.isfile(self.fnJournal):
+            os.remove(self.fnJournal)
+        self._journalLines = 0
+        return nbEntries
+
+    def compact(self):
+        """Merges the journal into the snapshot.
+
+        Returns the number of objects in the manifest.
+
+        :rtype: int
+        """
+        return self._writeSnapshot(self.entries())
+
+    def rewriting(self, triplets):
+        """Iterator that writes a brand new manifest while passing through the triplets (sha, size, storedSize).
+
+        It is meant to be used while traversing the actual volume. The new manifest replaces the old one
+        only once the iteration is finished.
+        """
+        now = int(time.time())
+        with open(self.fnSnapshot + '.new', 'w') as f:
+            for sha, size, storedSize in triplets:
+                print("%s %d %d %d" % (sha, size, storedSize, now), file=f)
+                yield sha, size, storedSize
+        os.replace(self.fnSnapshot + '.new', self.fnSnapshot)
+        if os.path.isfile(self.fnJournal):
+            os.remove(self.fnJournal)
+        self._journalLines = 0
@@ -0,0 +1,171 @@
+#!/usr/bin/python3.6
+
+"""
+.. module:: writeBehind
+    :platform: Windows, linux
+    :synopsis: module for class :class:`WriteBehindShelve <writeBehind.WriteBehindShelve>`.
+
+.. moduleauthor:: Miguel Garcia <zeycus@gmail.com>
+"""
+
+
+import queue
+import threading
+
+
+class WriteBehindShelve(object):
+    """Permanent dict whose writes are sent to the DDBB by a background thread.
+
+    Assignments and deletions are queued, and return at once. A background thread takes
+    them from the queue in batches, and applies each batch with a single bulk operation
+    (see ``applyBatch`` in :class:`MongoShelve <fsbackup.mongoShelve.MongoShelve>` and
+    :class:`SqliteShelve <fsbackup.sqliteShelve.SqliteShelve>`). That way, hashing and copying
+    files overlap with the DDBB writes, instead of waiting for them.
+
+    Any other operation waits until the queued writes are applied, and is then delegated to the
+    wrapped shelve, so reads always see the writes done before. Deleting an absent key is not an error.
+
+    If a batch fails, its operations are applied one by one up to the failing one. From then on the error
+    is sticky: the writes queued after it are discarded, and every later operation, :meth:`close` included,
+    raises it. So the DDBB always gets a prefix of the writes, without gaps in the middle.
+
+    The queue is bounded, so that a slow DDBB eventually slows down the producer instead of
+    exhausting the memory. :meth:`close` must be called at the end, to apply the pending writes.
+
+    """
+    def __init__(self, shelve, batchSize=1000, maxPending=100000, metrics=None):
+        """Constructor.
+
+        :param shelve: the permanent dict that actually stores the information.
+        :type shelve: MongoShelve or SqliteShelve
+        :param batchSize: maximum number of operations applied at once.
+        :type batchSize: int
+        :param maxPending: maximum number of operations in the queue.
+        :type maxPending: int
+        :param metrics: if provided, the time spent writing in the background is added to its phase ``dbWriteBehind``.
+        :type metrics: Metrics
+
+        """
+        self.shelve = shelve
+        self.batchSize = batchSize
+        self.metrics = metrics
+        self.queue = queue.Queue(maxsize=maxPending)
+        self.error = None
+        self.thread = threading.Thread(target=self._worker, daemon=True)
+        self.thread.start()
+
+    def _worker(self):
+        while True:
+            op = self.queue.get()
+            if op is None:
+                self.queue.task_done()
+                return
+            batch = [op]
+            while len(batch) < self.batchSize:
+                try:
+                    op = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if op is None:
+                    self.queue.put(None)  # Handled on the next loop, after this batch
+                    self.queue.task_done()
+                    break
+                batch.append(op)
+            if self.error is None:
+                try:
+                    if self.metrics is None:
+                        self._applyBatch(batch)
+                    else:
+                        with self.metrics.timer('dbWriteBehind'):
+                            self._applyBatch(batch)
+                except Exception as exc:
+                    self.error = exc  # Raised in the main thread. Later batches are discarded.
+            for _ in batch:
+                self.queue.task_done()
+
+    def _applyBatch(self, batch):
+        """Applies a batch. If it fails, its operations are applied one by one, until the one that fails.
+
+        Operations are idempotent, so those already applied by the failed batch do no harm.
+        """
+        try:
+            self.shelve.applyBatch(batch)
+        except Exception:
+            if len(batch) == 1:
+                raise
+            for op in batch:
+                self.shelve.applyBatch([op])
+
+    def _checkError(self):
+        if self.error is not None:
+            raise self.error
+
+    def flush(self):
+        """Waits until all the queued writes are applied."""
+        self.queue.join()
+        self._checkError()
+
+    def close(self):
+        """Applies the pending writes, and stops the background thread. Raises the error of the writes, if any."""
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        self._checkError()
+
+    def __setitem__(self, key, value):
+        self._checkError()
+        self.queue.put(('set', key, dict(value)))
+
+    def __delitem__(self, key):
+        self._checkError()
+        self.queue.put(('del', key))
+
+    def __getitem__(self, key):
+        self.flush()
+        return self.shelve[key]
+
+    def __contains__(self, key):
+        self.flush()
+        return key in self.shelve
+
+    def __len__(self):
+        self.flush()
+        return len(self.shelve)
+
+    def __iter__(self):
+        self.flush()
+        return iter(self.shelve)
+
+    def __getattr__(self, name):
+        """Any other attribute (``items``, ``find``, ``col``...) is taken from the wrapped shelve, once the writes are applied."""
+        if name in ('shelve', 'queue', 'thread'):  # Not set yet, avoid infinite recursion
+            raise AttributeError(name)
+        self.flush()
+        return getattr(self.shelve, name)
+
+
+def closeAll(shelves, logger=None, raiseErrors=True):
+    """Closes several write-behind shelves. All of them are closed, even if some fail.
+
+    :param shelves: the shelves
+    :type shelves: iterable of WriteBehindShelve
+    :param logger: if provided, the errors are logged.
+    :type logger: logging.Logger
+    :param raiseErrors: whether the first error is raised, once all are closed.
+    :type raiseErrors: bool
+    :rtype: Exception
+
+    Returns the first error, if it is not raised, or None.
+
+    """
+    firstError = None
+    for shelve in shelves:
+        try:
+            shelve.close()
+        except Exception as exc:
+            if logger is not None:
+                logger.error("Pending writes to the DDBB could not be applied: %s" % exc)
+            firstError = exc if firstError is None else firstError
+    if raiseErrors and (firstError is not None):
+        raise firstError
+    return firstError
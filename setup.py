@@ -23,7 +23,11 @@ setup(name='fsbackup',
       author_email='zeycus@gmail.com',
       license='MIT',
       packages=['fsbackup'],
-      install_requires=["pymongo", "mongo_shelve"],
+      install_requires=["pymongo", "mongo_shelve", "numpy"],
+      extras_require={
+          'zstd': ["zstandard"],
+          'parquet': ["pyarrow"],
+      },
       include_package_data=True,
       scripts=['bin/fsbck.py'],
       zip_safe=False,
@@ -13,23 +13,35 @@
 import os
 import unittest
 import shutil
+import glob
+import gzip
+import json
+import time
 
 from fsbackup.auxiliarForTests import createTree, checkFiletreesIdentical
 from fsbackup.mountPathInDrive import MountPathInDrive
 from fsbackup.diskTools import getAvailableLetter
 from fsbackup.fsbckWrapper import fsbck_wrapper
+from fsbackup.dbBackends import dropDatabase
+from fsbackup.compressTools import zstandard
+from fsbackup.changeJournal import ChangeJournal
+from fsbackup.restorePlanner import RestoreState
 
 
 class TestFsbackup(unittest.TestCase):
+    connFiles = dict(nt='conn_testing_win.json', posix='conn_testing_linux.json')
+    nBigFiles = 0  # Files big and compressible, added to the tree
+    fsbckArgs = []  # Extra arguments for the commands that hash and copy files
+
     @classmethod
     def setUpClass(cls):
         cls.pathbase = os.path.join(os.path.dirname(__file__), 'temp')
-        if os.name == 'nt':
-            cls.conn_testing = os.path.join(os.path.dirname(__file__), 'conn_testing_win.json')
-        elif os.name == 'posix':
-            cls.conn_testing = os.path.join(os.path.dirname(__file__), 'conn_testing_linux.json')
+        if os.name in cls.connFiles:
+            cls.conn_testing = os.path.join(os.path.dirname(__file__), cls.connFiles[os.name])
         else:
             raise OSError("OS '%s' not supported" % os.name)
+        with open(cls.conn_testing) as f:
+            cls.dbConf = json.load(f)
         cls.nFiles = 319
 
         # Create the database, or make it empty if it existed.
@@ -44,9 +56,29 @@ class TestFsbackup(unittest.TestCase):
 
     @classmethod
     def tearDownClass(cls):
-        cls.db.client.drop_database(cls.db.name)
+        dropDatabase(cls.db)
         shutil.rmtree(cls.pathbase, ignore_errors=True)
-
+        for fn in glob.glob('testing_*'):  # Backup status reports, in any format
+            os.remove(fn)
+        for fn in glob.glob(os.path.splitext(cls.conn_testing)[0] + '_journal.txt*'):
+            os.remove(fn)
+        fnSnapshot = os.path.splitext(cls.conn_testing)[0] + '_snapshot.bin'
+        if os.path.isfile(fnSnapshot):
+            os.remove(fnSnapshot)
+
+
+    @staticmethod
+    def openReport(fn):
+        """Opens a text report, compressed or not, for reading."""
+        return gzip.open(fn, 'rt') if fn.endswith('.gz') else open(fn)
+
+    def checkVolumeLayout(self, vol_path):
+        """The volume stores objects as the config tells."""
+        dbConf = self.dbConf
+        if dbConf.get('packThreshold') is not None:
+            self.assertTrue(glob.glob(os.path.join(vol_path, 'packs', '*.pack')), msg="No pack files were created.")
+        if dbConf.get('compression') is not None:
+            self.assertTrue(glob.glob(os.path.join(vol_path, '*', '*', '*', '*.zst')), msg="No objects were compressed.")
 
     def testBasicBackup(self):
         """Backup & checkout in a simple scenario works. Modifying the filesystem and updating, too.
@@ -63,6 +95,13 @@ class TestFsbackup(unittest.TestCase):
         vol_path = os.path.join(self.pathbase, 'volume')
         checkout_path = os.path.join(self.pathbase, 'checkout')
         createTree(pathbase=fs_path, nFiles=self.nFiles)
+        for n in range(self.nBigFiles):
+            os.makedirs(os.path.join(fs_path, 'logs'), exist_ok=True)
+            with open(os.path.join(fs_path, 'logs', 'log%d.log' % n), 'wt') as f:
+                for line in range(1000):
+                    print("Line %d of log %d, repeated enough to be compressed." % (line, n), file=f)
+        for root, _, _ in os.walk(fs_path):  # Folders look old, so that refreshes can skip them if unchanged
+            os.utime(root, (time.time() - 3600, time.time() - 3600))
         os.makedirs(vol_path, exist_ok=True)
 
         self.assertEqual(self.db['files'].count(), 0)  # Make sure collections are empty
@@ -73,8 +112,8 @@ class TestFsbackup(unittest.TestCase):
             'refreshHashes',
             '-db=%s' % self.conn_testing,
             '--loglevel=CRITICAL',
-        ])
-        self.assertEqual(self.db['files'].count(), self.nFiles)  # Make sure each file has an entry
+        ] + self.fsbckArgs)
+        self.assertEqual(self.db['files'].count(), self.nFiles + self.nBigFiles)  # Make sure each file has an entry
 
         regexp = '24'  # To be used in the removal of duplicates.
         if os.name == 'nt':
@@ -87,10 +126,37 @@ class TestFsbackup(unittest.TestCase):
                     '--drive=%s' % avLetter,
                     '--volumeid=999999',  # Volume for testing.
                     '--loglevel=CRITICAL',
-                ])
+                ] + self.fsbckArgs)
                 # Make sure each file has an entry, and identical files are backed-up only once.
                 # There are 100 or less because of the special way in which createTree fills files content.
-                self.assertEqual(self.db['volumes'].count(), min(self.nFiles, 100))
+                self.assertEqual(self.db['volumes'].count(), min(self.nFiles, 100) + self.nBigFiles)
+                self.checkVolumeLayout(vol_path)
+
+                # The volume id is shown without opening the DDBB, read from the identity file of the volume
+                info = fsbck_wrapper([
+                    'showVolumeId',
+                    '-db=%s' % self.conn_testing,
+                    '--drive=%s' % avLetter,
+                    '--loglevel=CRITICAL',
+                ])
+                self.assertEqual(info['volId'], '999999')
+                self.assertIsNone(info['db'])
+                self.assertRaises(Exception, fsbck_wrapper, [  # The identity exists already
+                    'initVolume',
+                    '-db=%s' % self.conn_testing,
+                    '--drive=%s' % avLetter,
+                    '--loglevel=CRITICAL',
+                ])
+
+                # Full status report, that also stores the summary kept up to date from now on
+                info = fsbck_wrapper([
+                    'backupStatus',
+                    '-db=%s' % self.conn_testing,
+                    '--loglevel=CRITICAL',
+                ])
+                self.assertEqual(info['summary']['missing']['files'], 0)
+                with self.openReport('testing_content_999999.' + self.dbConf.get('reportFormat', 'txt')) as f:
+                    self.assertIn('5.txt', f.read())
 
                 # Restore info from the volume
                 fsbck_wrapper([
@@ -107,6 +173,90 @@ class TestFsbackup(unittest.TestCase):
                 self.assertTrue(checkFiletreesIdentical(fs_path, checkout_path),
                                 msg="The checkout tree is not exactly equal to the original filesystem.")
 
+                # Files with the same content can be restored as hard links of the first one
+                linked_path = os.path.join(self.pathbase, 'linked')
+                fsbck_wrapper([
+                    'checkout',
+                    '-db=%s' % self.conn_testing,
+                    '--drive=%s' % avLetter,
+                    '--sourcepath=temp\\filesystem',
+                    '--destpath=%s' % linked_path,
+                    '--volumeid=999999',  # Volume for testing.
+                    '--linkmode=hardlink',
+                    '--loglevel=CRITICAL',
+                ])
+                self.assertTrue(checkFiletreesIdentical(fs_path, linked_path),
+                                msg="The checkout tree with hard links is not exactly equal to the original filesystem.")
+                self.assertGreater(os.stat(os.path.join(linked_path, '5.txt')).st_nlink, 1)  # Same content as 105.txt, 205.txt...
+                shutil.rmtree(linked_path)
+                # A filtered checkout in dry-run mode only lists the matching files
+                info = fsbck_wrapper([
+                    'checkout',
+                    '-db=%s' % self.conn_testing,
+                    '--drive=%s' % avLetter,
+                    '--sourcepath=temp\\filesystem',
+                    '--destpath=%s' % os.path.join(self.pathbase, 'filtered'),
+                    '--volumeid=999999',  # Volume for testing.
+                    '--regexp=5\\.txt$',
+                    '--maxsize=1Ki',
+                    '--dryrun',
+                    '--loglevel=CRITICAL',
+                ])
+                self.assertEqual(len(info['restored']), 32)  # 5, 15, ..., 315
+                self.assertFalse(os.path.exists(os.path.join(self.pathbase, 'filtered')))
+
+                # The only volume is enough to restore everything
+                info = fsbck_wrapper([
+                    'restorePlan',
+                    '-db=%s' % self.conn_testing,
+                    '--sourcepath=temp\\filesystem',
+                    '--destpath=%s' % checkout_path,
+                    '--loglevel=CRITICAL',
+                ])
+                self.assertEqual([step['volume'] for step in info['plan']], ['999999'])
+                self.assertEqual(info['unavailable'], [])
+
+                # Restoring from it leaves nothing pending, and then the restore state is removed
+                restored_path = os.path.join(self.pathbase, 'restored')
+                info = fsbck_wrapper([
+                    'restore',
+                    '-db=%s' % self.conn_testing,
+                    '--drive=%s' % avLetter,
+                    '--sourcepath=temp\\filesystem',
+                    '--destpath=%s' % restored_path,
+                    '--volumeid=999999',  # Volume for testing.
+                    '--loglevel=CRITICAL',
+                ])
+                self.assertEqual(info['plan'], [])
+                self.assertTrue(checkFiletreesIdentical(fs_path, restored_path),  # The state is not among the files restored
+                                msg="The restored tree is not exactly equal to the original filesystem.")
+                self.assertFalse(os.path.exists(restored_path + RestoreState.stateSuffix))
+                shutil.rmtree(restored_path)
+
+                # A refresh driven by the change journal checks only the paths recorded in it
+                journal = ChangeJournal(os.path.splitext(self.conn_testing)[0] + '_journal.txt')
+                for fn in ('journaled.txt', 'unjournaled.txt'):
+                    with open(os.path.join(fs_path, fn), 'wt') as f:
+                        print("Content of %s." % fn, file=f)
+                journal.record([os.path.join('temp', 'filesystem', 'journaled.txt')])
+                journal.heartbeat()  # As if a watcher was running
+                fsbck_wrapper([
+                    'refreshHashes',
+                    '-db=%s' % self.conn_testing,
+                    '--loglevel=CRITICAL',
+                ] + self.fsbckArgs)
+                self.assertEqual(self.db['files'].count(), self.nFiles + self.nBigFiles + 1)
+                for fn in ('journaled.txt', 'unjournaled.txt'):
+                    os.remove(os.path.join(fs_path, fn))
+                journal.record([os.path.join('temp', 'filesystem')])  # A folder: the files under it are checked
+                fsbck_wrapper([
+                    'refreshHashes',
+                    '-db=%s' % self.conn_testing,
+                    '--loglevel=CRITICAL',
+                ] + self.fsbckArgs)
+                self.assertEqual(self.db['files'].count(), self.nFiles + self.nBigFiles)
+                os.remove(journal.fnAlive)  # No watcher anymore, so the next refresh traverses the filesystem
+
                 # Delete a few files from the original filesystem: those ending in 5 and 6
                 nDeleted = 0
                 for root, _, files in os.walk(fs_path):
@@ -117,14 +267,18 @@ class TestFsbackup(unittest.TestCase):
                             nDeleted += 1
 
                 # Refresh file content in DB
-                fsbck_wrapper([
+                info = fsbck_wrapper([
                     'refreshHashes',
                     '-db=%s' % self.conn_testing,
                     '--loglevel=CRITICAL',
-                ])
+                ] + self.fsbckArgs)
+                if self.dbConf.get('pruneDirs'):  # Folders without deleted files are not listed
+                    self.assertGreater(info['metrics'].counters['dirsPruned'], 0)
+                else:  # Folders are not recorded if they are not going to be pruned
+                    self.assertEqual(self.db['dirs'].count(), 0)
 
                 # Make sure entries were deleted
-                self.assertEqual(self.db['files'].count(), self.nFiles - nDeleted)
+                self.assertEqual(self.db['files'].count(), self.nFiles + self.nBigFiles - nDeleted)
 
                 # Clean the volume
                 infoAux = fsbck_wrapper([
@@ -133,9 +287,69 @@ class TestFsbackup(unittest.TestCase):
                     '--drive=%s' % avLetter,
                     '--volumeid=999999',  # Volume for testing.
                     '--loglevel=CRITICAL',
-                ])
+                ] + self.fsbckArgs)
                 self.assertEqual(infoAux['nDeleted'], 20)  # Exactly 20 hashes, 10 for files ending in 6 and 10 ending in 5
 
+                # The summary kept up to date is the one computed from scratch
+                infoCached = fsbck_wrapper([
+                    'backupStatus',
+                    '-db=%s' % self.conn_testing,
+                    '--summaryonly',
+                    '--loglevel=CRITICAL',
+                ])
+                info = fsbck_wrapper([
+                    'backupStatus',
+                    '-db=%s' % self.conn_testing,
+                    '--loglevel=CRITICAL',
+                ])
+                self.assertEqual(infoCached['summary'], info['summary'])
+                self.assertEqual(info['summary']['volumes']['999999']['deletableFiles'], 0)
+
+                # The same summary, from a snapshot of the catalogue
+                infoAux = fsbck_wrapper([
+                    'snapshot',
+                    '-db=%s' % self.conn_testing,
+                    '--loglevel=CRITICAL',
+                ])
+                self.assertEqual(infoAux['nFiles'], self.db['files'].count())
+                infoAux = fsbck_wrapper([
+                    'backupStatus',
+                    '-db=%s' % self.conn_testing,
+                    '--fromsnapshot',
+                    '--loglevel=CRITICAL',
+                ])
+                self.assertEqual(infoAux['summary'], info['summary'])
+
+                # The volume information is rebuilt from the manifest, and then traversing the volume
+                nObjects = self.db['volumes'].count()
+                for extraArgs in ([], ['--fullscan']):
+                    fsbck_wrapper([
+                        'extractVolumeInfo',
+                        '-db=%s' % self.conn_testing,
+                        '--drive=%s' % avLetter,
+                        '--loglevel=CRITICAL',
+                    ] + extraArgs)
+                    self.assertEqual(self.db['volumes'].count(), nObjects)
+                    infoAux = fsbck_wrapper([
+                        'backupStatus',
+                        '-db=%s' % self.conn_testing,
+                        '--loglevel=CRITICAL',
+                    ])
+                    self.assertEqual(infoAux['summary'], info['summary'])
+
+                # A hash of the volume recorded under another one makes the rebuild fail, without changing anything
+                sha = self.db['volumes'].find_one({'volume': '999999'})['hash']
+                self.db['volumes'].update_one({'hash': sha}, {'$set': {'volume': 'other'}})
+                self.assertRaises(ValueError, fsbck_wrapper, [
+                    'extractVolumeInfo',
+                    '-db=%s' % self.conn_testing,
+                    '--drive=%s' % avLetter,
+                    '--loglevel=CRITICAL',
+                ])
+                self.assertEqual(self.db['volumes'].count(), nObjects)
+                self.assertEqual(self.db['volumes'].find_one({'hash': sha})['volume'], 'other')
+                self.db['volumes'].update_one({'hash': sha}, {'$set': {'volume': '999999'}})
+
                 # Perform another checkout
                 shutil.rmtree(checkout_path)
                 fsbck_wrapper([
@@ -177,10 +391,37 @@ class TestFsbackup(unittest.TestCase):
                 '--drivemountpoint=%s' % vol_path,
                 '--volumeid=999999',  # Volume for testing.
                 '--loglevel=CRITICAL',
-            ])
+            ] + self.fsbckArgs)
             # Make sure each file has an entry, and identical files are backed-up only once.
             # There are 100 or less because of the special way in which createTree fills files content.
-            self.assertEqual(self.db['volumes'].count(), min(self.nFiles, 100))
+            self.assertEqual(self.db['volumes'].count(), min(self.nFiles, 100) + self.nBigFiles)
+            self.checkVolumeLayout(vol_path)
+
+            # The volume id is shown without opening the DDBB, read from the identity file of the volume
+            info = fsbck_wrapper([
+                'showVolumeId',
+                '-db=%s' % self.conn_testing,
+                '--drivemountpoint=%s' % vol_path,
+                '--loglevel=CRITICAL',
+            ])
+            self.assertEqual(info['volId'], '999999')
+            self.assertIsNone(info['db'])
+            self.assertRaises(Exception, fsbck_wrapper, [  # The identity exists already
+                'initVolume',
+                '-db=%s' % self.conn_testing,
+                '--drivemountpoint=%s' % vol_path,
+                '--loglevel=CRITICAL',
+            ])
+
+            # Full status report, that also stores the summary kept up to date from now on
+            info = fsbck_wrapper([
+                'backupStatus',
+                '-db=%s' % self.conn_testing,
+                '--loglevel=CRITICAL',
+            ])
+            self.assertEqual(info['summary']['missing']['files'], 0)
+            with self.openReport('testing_content_999999.' + self.dbConf.get('reportFormat', 'txt')) as f:
+                self.assertIn('5.txt', f.read())
 
             # Restore info from the volume
             fsbck_wrapper([
@@ -197,6 +438,90 @@ class TestFsbackup(unittest.TestCase):
             self.assertTrue(checkFiletreesIdentical(fs_path, checkout_path),
                             msg="The checkout tree is not exactly equal to the original filesystem.")
 
+            # Files with the same content can be restored as hard links of the first one
+            linked_path = os.path.join(self.pathbase, 'linked')
+            fsbck_wrapper([
+                'checkout',
+                '-db=%s' % self.conn_testing,
+                '--drivemountpoint=%s' % vol_path,
+                '--sourcepath=temp/filesystem',
+                '--destpath=%s' % linked_path,
+                '--volumeid=999999',  # Volume for testing.
+                '--linkmode=hardlink',
+                '--loglevel=CRITICAL',
+            ])
+            self.assertTrue(checkFiletreesIdentical(fs_path, linked_path),
+                            msg="The checkout tree with hard links is not exactly equal to the original filesystem.")
+            self.assertGreater(os.stat(os.path.join(linked_path, '5.txt')).st_nlink, 1)  # Same content as 105.txt, 205.txt...
+            shutil.rmtree(linked_path)
+            # A filtered checkout in dry-run mode only lists the matching files
+            info = fsbck_wrapper([
+                'checkout',
+                '-db=%s' % self.conn_testing,
+                '--drivemountpoint=%s' % vol_path,
+                '--sourcepath=temp/filesystem',
+                '--destpath=%s' % os.path.join(self.pathbase, 'filtered'),
+                '--volumeid=999999',  # Volume for testing.
+                '--regexp=5\\.txt$',
+                '--maxsize=1Ki',
+                '--dryrun',
+                '--loglevel=CRITICAL',
+            ])
+            self.assertEqual(len(info['restored']), 32)  # 5, 15, ..., 315
+            self.assertFalse(os.path.exists(os.path.join(self.pathbase, 'filtered')))
+
+            # The only volume is enough to restore everything
+            info = fsbck_wrapper([
+                'restorePlan',
+                '-db=%s' % self.conn_testing,
+                '--sourcepath=temp/filesystem',
+                '--destpath=%s' % checkout_path,
+                '--loglevel=CRITICAL',
+            ])
+            self.assertEqual([step['volume'] for step in info['plan']], ['999999'])
+            self.assertEqual(info['unavailable'], [])
+
+            # Restoring from it leaves nothing pending, and then the restore state is removed
+            restored_path = os.path.join(self.pathbase, 'restored')
+            info = fsbck_wrapper([
+                'restore',
+                '-db=%s' % self.conn_testing,
+                '--drivemountpoint=%s' % vol_path,
+                '--sourcepath=temp/filesystem',
+                '--destpath=%s' % restored_path,
+                '--volumeid=999999',  # Volume for testing.
+                '--loglevel=CRITICAL',
+            ])
+            self.assertEqual(info['plan'], [])
+            self.assertTrue(checkFiletreesIdentical(fs_path, restored_path),  # The state is not among the files restored
+                            msg="The restored tree is not exactly equal to the original filesystem.")
+            self.assertFalse(os.path.exists(restored_path + RestoreState.stateSuffix))
+            shutil.rmtree(restored_path)
+
+            # A refresh driven by the change journal checks only the paths recorded in it
+            journal = ChangeJournal(os.path.splitext(self.conn_testing)[0] + '_journal.txt')
+            for fn in ('journaled.txt', 'unjournaled.txt'):
+                with open(os.path.join(fs_path, fn), 'wt') as f:
+                    print("Content of %s." % fn, file=f)
+            journal.record([os.path.join('temp', 'filesystem', 'journaled.txt')])
+            journal.heartbeat()  # As if a watcher was running
+            fsbck_wrapper([
+                'refreshHashes',
+                '-db=%s' % self.conn_testing,
+                '--loglevel=CRITICAL',
+            ] + self.fsbckArgs)
+            self.assertEqual(self.db['files'].count(), self.nFiles + self.nBigFiles + 1)
+            for fn in ('journaled.txt', 'unjournaled.txt'):
+                os.remove(os.path.join(fs_path, fn))
+            journal.record([os.path.join('temp', 'filesystem')])  # A folder: the files under it are checked
+            fsbck_wrapper([
+                'refreshHashes',
+                '-db=%s' % self.conn_testing,
+                '--loglevel=CRITICAL',
+            ] + self.fsbckArgs)
+            self.assertEqual(self.db['files'].count(), self.nFiles + self.nBigFiles)
+            os.remove(journal.fnAlive)  # No watcher anymore, so the next refresh traverses the filesystem
+
             # Delete a few files from the original filesystem: those ending in 5 and 6
             nDeleted = 0
             for root, _, files in os.walk(fs_path):
@@ -207,14 +532,18 @@ class TestFsbackup(unittest.TestCase):
                         nDeleted += 1
 
             # Refresh file content in DB
-            fsbck_wrapper([
+            info = fsbck_wrapper([
                 'refreshHashes',
                 '-db=%s' % self.conn_testing,
                 '--loglevel=CRITICAL',
-            ])
+            ] + self.fsbckArgs)
+            if self.dbConf.get('pruneDirs'):  # Folders without deleted files are not listed
+                self.assertGreater(info['metrics'].counters['dirsPruned'], 0)
+            else:  # Folders are not recorded if they are not going to be pruned
+                self.assertEqual(self.db['dirs'].count(), 0)
 
             # Make sure entries were deleted
-            self.assertEqual(self.db['files'].count(), self.nFiles - nDeleted)
+            self.assertEqual(self.db['files'].count(), self.nFiles + self.nBigFiles - nDeleted)
 
             # Clean the volume
             infoAux = fsbck_wrapper([
@@ -223,9 +552,69 @@ class TestFsbackup(unittest.TestCase):
                 '--drivemountpoint=%s' % vol_path,
                 '--volumeid=999999',  # Volume for testing.
                 '--loglevel=CRITICAL',
-            ])
+            ] + self.fsbckArgs)
             self.assertEqual(infoAux['nDeleted'], 20)  # Exactly 20 hashes, 10 for files ending in 6 and 10 ending in 5
 
+            # The summary kept up to date is the one computed from scratch
+            infoCached = fsbck_wrapper([
+                'backupStatus',
+                '-db=%s' % self.conn_testing,
+                '--summaryonly',
+                '--loglevel=CRITICAL',
+            ])
+            info = fsbck_wrapper([
+                'backupStatus',
+                '-db=%s' % self.conn_testing,
+                '--loglevel=CRITICAL',
+            ])
+            self.assertEqual(infoCached['summary'], info['summary'])
+            self.assertEqual(info['summary']['volumes']['999999']['deletableFiles'], 0)
+
+            # The same summary, from a snapshot of the catalogue
+            infoAux = fsbck_wrapper([
+                'snapshot',
+                '-db=%s' % self.conn_testing,
+                '--loglevel=CRITICAL',
+            ])
+            self.assertEqual(infoAux['nFiles'], self.db['files'].count())
+            infoAux = fsbck_wrapper([
+                'backupStatus',
+                '-db=%s' % self.conn_testing,
+                '--fromsnapshot',
+                '--loglevel=CRITICAL',
+            ])
+            self.assertEqual(infoAux['summary'], info['summary'])
+
+            # The volume information is rebuilt from the manifest, and then traversing the volume
+            nObjects = self.db['volumes'].count()
+            for extraArgs in ([], ['--fullscan']):
+                fsbck_wrapper([
+                    'extractVolumeInfo',
+                    '-db=%s' % self.conn_testing,
+                    '--drivemountpoint=%s' % vol_path,
+                    '--loglevel=CRITICAL',
+                ] + extraArgs)
+                self.assertEqual(self.db['volumes'].count(), nObjects)
+                infoAux = fsbck_wrapper([
+                    'backupStatus',
+                    '-db=%s' % self.conn_testing,
+                    '--loglevel=CRITICAL',
+                ])
+                self.assertEqual(infoAux['summary'], info['summary'])
+
+            # A hash of the volume recorded under another one makes the rebuild fail, without changing anything
+            sha = self.db['volumes'].find_one({'volume': '999999'})['hash']
+            self.db['volumes'].update_one({'hash': sha}, {'$set': {'volume': 'other'}})
+            self.assertRaises(ValueError, fsbck_wrapper, [
+                'extractVolumeInfo',
+                '-db=%s' % self.conn_testing,
+                '--drivemountpoint=%s' % vol_path,
+                '--loglevel=CRITICAL',
+            ])
+            self.assertEqual(self.db['volumes'].count(), nObjects)
+            self.assertEqual(self.db['volumes'].find_one({'hash': sha})['volume'], 'other')
+            self.db['volumes'].update_one({'hash': sha}, {'$set': {'volume': '999999'}})
+
             # Perform another checkout
             shutil.rmtree(checkout_path)
             fsbck_wrapper([
@@ -260,5 +649,30 @@ class TestFsbackup(unittest.TestCase):
             self.assertEqual(info['nDeleted'], 0,
                              msg="Duplicate files were found, none were expected.")
 
+
+class TestFsbackupSqlite(TestFsbackup):
+    """The same scenario, with the catalogue in a local SQLite file instead of mongoDB."""
+    connFiles = dict(nt='conn_testing_sqlite_win.json', posix='conn_testing_sqlite_linux.json')
+
+
+@unittest.skipIf(zstandard is None, "Package 'zstandard' is not installed")
+class TestFsbackupPacked(TestFsbackup):
+    """The same scenario, with small objects stored in pack files in the volume, and big ones compressed."""
+    connFiles = dict(nt='conn_testing_packed_win.json', posix='conn_testing_packed_linux.json')
+    nBigFiles = 3
+
+
+class TestFsbackupWriteBehind(TestFsbackup):
+    """The same scenario, with the DDBB written from a background thread."""
+    connFiles = dict(nt='conn_testing_sqlite_win.json', posix='conn_testing_sqlite_linux.json')
+    fsbckArgs = ['--writebehind']
+
+
+class TestFsbackupInodeOrder(TestFsbackup):
+    """The same scenario, with files read in the order of their inodes."""
+    connFiles = dict(nt='conn_testing_sqlite_win.json', posix='conn_testing_sqlite_linux.json')
+    fsbckArgs = ['--ioorder=inode']
+
+
 if __name__ == '__main__':
     unittest.main()
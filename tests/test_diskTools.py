@@ -0,0 +1,118 @@
+#!/usr/bin/python 3.5
+
+"""
+.. module:: test_diskTools
+    :platform: linux
+    :synopsis: the serial numbers of disks in Linux are read from a fake sysfs tree
+
+.. moduleauthor:: Miguel Garcia <zeycus@gmail.com>
+
+"""
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from fsbackup.diskTools import getMountPointSerialNumberLinux, getBlockDeviceSerialLinux
+
+
+@unittest.skipUnless(os.name == 'posix', "sysfs is only in Linux")
+class TestDiskSerialLinux(unittest.TestCase):
+    def setUp(self):
+        self.root = os.path.realpath(tempfile.mkdtemp())
+        self.sysRoot = os.path.join(self.root, 'sys')
+        self.devRoot = os.path.join(self.root, 'dev')
+        self.mountInfo = os.path.join(self.root, 'mountinfo')
+        self.mountPoint = os.path.join(self.root, 'mnt', 'E321-ABCD')
+        os.makedirs(self.mountPoint)
+        os.makedirs(os.path.join(self.sysRoot, 'dev', 'block'))
+        os.makedirs(os.path.join(self.devRoot, 'disk', 'by-id'))
+        st = os.stat(self.mountPoint)
+        self.devNumber = "%d:%d" % (os.major(st.st_dev), os.minor(st.st_dev))
+        with open(self.mountInfo, 'w') as f:
+            f.write("23 28 0:22 / /proc rw,relatime - proc proc rw\n")
+        getBlockDeviceSerialLinux.cache_clear()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+        getBlockDeviceSerialLinux.cache_clear()
+
+    def writeFile(self, path, content):
+        path = os.path.join(self.sysRoot, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb' if isinstance(content, bytes) else 'w') as f:
+            f.write(content)
+
+    def addPartition(self, devNumber, diskPath, partName):
+        """Creates the partition of the disk at diskPath (relative to sysfs), and its /sys/dev/block link."""
+        self.writeFile(os.path.join(diskPath, partName, 'partition'), '1\n')
+        self.writeFile(os.path.join(diskPath, partName, 'dev'), devNumber + '\n')
+        os.symlink(os.path.join('..', '..', diskPath, partName), os.path.join(self.sysRoot, 'dev', 'block', devNumber))
+
+    def serial(self):
+        return getMountPointSerialNumberLinux(self.mountPoint, sysRoot=self.sysRoot, devRoot=self.devRoot,
+                                              mountInfo=self.mountInfo)
+
+    def testUsb(self):
+        usbDevice = 'devices/pci0000:00/0000:00:14.0/usb2/2-1'
+        self.writeFile('devices/pci0000:00/0000:00:14.0/usb2/serial', '0000:00:14.0\n')  # The root hub
+        self.writeFile(os.path.join(usbDevice, 'idVendor'), '1058\n')
+        self.writeFile(os.path.join(usbDevice, 'serial'), '575836314141\n')
+        scsiDevice = os.path.join(usbDevice, '2-1:1.0/host6/target6:0:0/6:0:0:0')
+        self.writeFile(os.path.join(scsiDevice, 'vpd_pg80'), b'\x00\x80\x00\x04ABCD')  # The bridge's, not udev's
+        diskPath = os.path.join(scsiDevice, 'block', 'sdb')
+        self.writeFile(os.path.join(diskPath, 'dev'), '8:16\n')
+        os.symlink(os.path.join(self.sysRoot, scsiDevice), os.path.join(self.sysRoot, diskPath, 'device'))
+        self.addPartition(self.devNumber, diskPath, 'sdb1')
+        self.assertEqual(self.serial(), '575836314141')
+
+    def testNvme(self):
+        ctrl = 'devices/pci0000:00/0000:00:1d.0/0000:3d:00.0/nvme/nvme0'
+        self.writeFile(os.path.join(ctrl, 'serial'), 'S4EWNX0R123456      \n')
+        diskPath = os.path.join(ctrl, 'nvme0n1')
+        self.writeFile(os.path.join(diskPath, 'dev'), '259:0\n')
+        os.symlink(os.path.join(self.sysRoot, ctrl), os.path.join(self.sysRoot, diskPath, 'device'))
+        self.addPartition(self.devNumber, diskPath, 'nvme0n1p1')
+        self.assertEqual(self.serial(), 'S4EWNX0R123456')
+
+    def testSataAndCache(self):
+        scsiDevice = 'devices/pci0000:00/0000:00:17.0/ata1/host0/target0:0:0/0:0:0:0'
+        self.writeFile(os.path.join(scsiDevice, 'vpd_pg80'), b'\x00\x80\x00\x0c    Z1D2ABCD')
+        diskPath = os.path.join(scsiDevice, 'block', 'sda')
+        self.writeFile(os.path.join(diskPath, 'dev'), '8:0\n')
+        os.symlink(os.path.join(self.sysRoot, scsiDevice), os.path.join(self.sysRoot, diskPath, 'device'))
+        self.addPartition(self.devNumber, diskPath, 'sda1')
+        self.assertEqual(self.serial(), 'Z1D2ABCD')
+        # The serial is cached for each device
+        self.writeFile(os.path.join(scsiDevice, 'vpd_pg80'), b'\x00\x80\x00\x08ZZZZZZZZ')
+        self.assertEqual(self.serial(), 'Z1D2ABCD')
+        getBlockDeviceSerialLinux.cache_clear()
+        self.assertEqual(self.serial(), 'ZZZZZZZZ')
+
+    def testDiskIdAndMountInfo(self):
+        # The path reports a device unknown to sysfs (like btrfs): the device mounted is taken from mountinfo
+        with open(self.mountInfo, 'a') as f:
+            f.write("36 28 0:45 / %s rw,relatime shared:1 - btrfs /dev/sdc1 rw\n" %
+                    self.mountPoint.replace(' ', '\\040'))
+        diskPath = 'devices/virtual/block/sdc'
+        self.writeFile(os.path.join(diskPath, 'dev'), '8:32\n')
+        self.addPartition('8:33', diskPath, 'sdc1')
+        os.makedirs(os.path.join(self.sysRoot, 'class', 'block'))
+        os.symlink(os.path.join(self.sysRoot, diskPath, 'sdc1'), os.path.join(self.sysRoot, 'class', 'block', 'sdc1'))
+        # No serial in sysfs, so the links in /dev/disk/by-id are used
+        for name in ('sdc', 'sdc1'):
+            open(os.path.join(self.devRoot, name), 'w').close()
+        byId = os.path.join(self.devRoot, 'disk', 'by-id')
+        os.symlink('../../sdc', os.path.join(byId, 'wwn-0x5000c500a1b2c3d4'))
+        os.symlink('../../sdc1', os.path.join(byId, 'usb-WD_My_Passport_0820_575836314141-0:0-part1'))
+        os.symlink('../../sdc', os.path.join(byId, 'usb-WD_My_Passport_0820_575836314141-0:0'))
+        self.assertEqual(self.serial(), '575836314141')
+
+    def testNotFound(self):
+        self.assertRaises(OSError, self.serial)
+
+
+if __name__ == '__main__':
+    unittest.main()